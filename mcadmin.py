@@ -1,13 +1,22 @@
 # Tools and utilities for managing a minecraft server instance
 
-import requests
+import argparse
 import sys
-import pprint
 import re
 import os
-import shutil
-import zipfile
 import json
+import zlib
+import mmap
+import struct
+import datetime
+import fnmatch
+import hashlib
+import time
+import threading
+import mcfs
+import mclog
+import mcmetrics
+import mcpropmerge
 
 
 def MINUTES(num):
@@ -22,129 +31,860 @@ def DAYS(num):
     return num * 24 * 60 * 60
 
 
-DEBUG_ENABLED = True
-MOJANG_VERSION_MANIFEST_URL = 'https://launchermeta.mojang.com/mc/game/version_manifest.json'
+MOJANG_RESOURCES_URL = 'https://resources.download.minecraft.net'
+MOJANG_VERSION_MANIFEST_URL = 'https://launchermeta.mojang.com/mc/game/version_manifest_v2.json'
+MOJANG_PROFILES_URL = 'https://api.mojang.com/profiles/minecraft'
 MCADMIN_WORKDIR_ENV_VAR = 'MC_ADMIN_PATH'
-MCADMIN_VERSION_MANIFEST_EXPIRY = None
-#MCADMIN_VERSION_MANIFEST_EXPIRY = HOURS(6)
+MCADMIN_VERSION_MANIFEST_EXPIRY = MINUTES(5)
+MCADMIN_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MCADMIN_DOWNLOAD_CHECKPOINT_SIZE = 1024 * 1024
+MCADMIN_DOWNLOAD_ATTEMPTS = 3
+MCADMIN_HTTP_TIMEOUT = (10, 60)
+MCADMIN_HTTP_RETRIES = 3
+MCADMIN_HTTP_POOL_SIZE = 16
+MCADMIN_PREFETCH_WORKERS = 8
+MCADMIN_MIRROR_WORKERS = MCADMIN_HTTP_POOL_SIZE
+MCADMIN_PROGRESS_INTERVAL = 5
+MCADMIN_SYNC_WORKERS = 8
+MCADMIN_CACHE_MAX_BYTES = 256 * 1024 * 1024
+MCADMIN_CACHE_MAX_ENTRIES = 2048
+MCADMIN_CACHE_PINNED = ['version_manifest.json', 'version-state.json', 'profiles.json']
+MCADMIN_CACHE_ATIME_RESOLUTION = MINUTES(10)
+MCADMIN_LOCK_STRIPES = 256
+MCADMIN_EXTRACT_WORKERS = os.cpu_count() or 4
+MCADMIN_PROFILE_BATCH_SIZE = 10
+MCADMIN_PROFILE_WORKERS = 4
+MCADMIN_PROFILE_TTL = DAYS(7)
+MCADMIN_PROFILE_NEGATIVE_TTL = HOURS(1)
+
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+
+log = mclog.get_logger('mcadmin')
+metrics = mcmetrics.REGISTRY
+
+# Messages take their format arguments separately, e.g. debug_msg("Fetched [{}]", url),
+# and are only formatted when their level is enabled
+debug_msg = log.debug
+info_msg = log.info
+warn_msg = log.warn
+error_msg = log.error
 
 
-def eprint(*args, **kwargs):
-    print(*args, file=sys.stderr, **kwargs)
+def dump_json(json):
+    import pprint
+    pp = pprint.PrettyPrinter(indent=4)
+    pp.pprint(json)
 
 
-def debug_msg(*args, **kwargs):
-    if DEBUG_ENABLED:
-        eprint("DEBUG:", *args, **kwargs)
+def make_dirs(path):
+    try:
+        os.makedirs(path, exist_ok=True)
+    except Exception as ex:
+        error_msg("Failed to create directory [{}]: {}", path, str(ex))
+        return False
+    return True
 
 
-def error_msg(*args, **kwargs):
-    eprint("ERROR:", *args, **kwargs)
+def get_url(url, session=None):
+    import requests
+    http = session if session is not None else requests
+    r = http.get(url, timeout=MCADMIN_HTTP_TIMEOUT)
+    if r.status_code != 200:
+        error_msg("Failed to retrieve url[{}]: http status {}", url, r.status_code)
+        return None
+    return r.content
 
 
-def info_msg(*args, **kwargs):
-    eprint("INFO :", *args, **kwargs)
+def get_default_working_dir():
+    """The working directory used when none is given: $MC_ADMIN_PATH, or ~/mcadmin"""
+    return os.path.expanduser(os.environ.get(MCADMIN_WORKDIR_ENV_VAR, '~/mcadmin'))
 
 
-def warn_msg(*args, **kwargs):
-    eprint("WARN :", *args, **kwargs)
+def format_uuid(value):
+    """Dashed lower case form of a uuid given with or without dashes, or None if it is not one"""
+    value = value.strip().lower().replace('-', '')
+    if len(value) != 32 or any(c not in '0123456789abcdef' for c in value):
+        return None
+    return '{}-{}-{}-{}-{}'.format(value[:8], value[8:12], value[12:16], value[16:20], value[20:])
 
 
-def dump_json(json):
-    pp = pprint.PrettyPrinter(indent=4)
-    pp.pprint(json)
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(MCADMIN_DOWNLOAD_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
 
 
-def make_dirs(path):
+def verify_file(path, sha1=None, size=None):
+    """Check a local file against an expected size and SHA-1 digest"""
     try:
-        os.makedirs(path, exist_ok=True)
+        if size is not None and os.path.getsize(path) != size:
+            return False
+        if sha1 is not None and file_sha1(path) != sha1:
+            return False
     except Exception as ex:
-        error_msg("Failed to create directory [{}]: {}".format(path, str(ex)))
+        error_msg("Failed to verify file [{}]: {}", path, str(ex))
         return False
     return True
 
 
-def get_url(url):
-    r = requests.get(url)
-    if r.status_code != 200:
-        error_msg("Failed to retrieve url[{}]: http status {}".format(url, r.status_code))
+class MCDownloadError(Exception):
+    """A download failure that retrying or resuming will not fix"""
+    pass
+
+
+def _load_part_meta(meta_path, url, sha1, size):
+    """Load resume state for a partial download, if it matches this request"""
+    try:
+        with open(meta_path, 'r') as fp:
+            meta = json.load(fp)
+    except Exception:
         return None
-    return r.content
 
+    if meta.get('url') != url or meta.get('sha1') != sha1 or meta.get('size') != size:
+        debug_msg("Discarding stale partial download state [{}]", meta_path)
+        return None
+    return meta
 
-class MCVersion(object):
-    def __init__(self, admin, version, manifest):
-        self._admin = admin
-        self._version = version
-        self._manifest = manifest
 
-    def dump_manifest(self):
-        if self._manifest is None:
-            return
-        dump_json(self._manifest)
+def _save_part_meta(meta_path, meta):
+    mcfs.atomic_write(meta_path, json.dumps(meta).encode())
 
-    def _create_version_dir(self):
-        return make_dirs(self._admin.get_version_dir(self._version))
 
-    def _resource_exists(self, path):
-        return os.path.exists(os.path.join(self._admin.get_version_dir(self._version), path))
+def _remove_partial(part_path, meta_path):
+    for stale in (part_path, meta_path):
+        if os.path.exists(stale):
+            os.remove(stale)
 
-    def download_client_jar(self):
-        if self._resource_exists('client.jar'):
-            info_msg("Client jar for version [{}] is cached".format(self._version))
+
+def _split_ranges(size, parts):
+    step = -(-size // parts)
+    return [[start, min(start + step, size) - 1, 0] for start in range(0, size, step)]
+
+
+def _fetch_range(http, url, fd, rng, meta, meta_path, lock, digest=None):
+    """
+    Stream one byte range [start, end] of url into fd, resuming after the
+    rng[2] bytes already received. Progress is recorded in the shared resume
+    metadata as data is written. Returns False if the server ignored the
+    range request and sent the whole body instead.
+    """
+    start, end, received = rng
+    headers = {}
+    if start + received > 0 or end is not None:
+        headers['Range'] = 'bytes={}-{}'.format(start + received, '' if end is None else end)
+
+    with http.get(url, headers=headers, stream=True, timeout=MCADMIN_HTTP_TIMEOUT) as r:
+        if r.status_code == 416 and end is None:
+            # Nothing left to fetch; the partial file is already complete
             return True
+        if r.status_code == 200 and 'Range' in headers:
+            return False
+        if r.status_code not in (200, 206):
+            raise MCDownloadError("http status {}".format(r.status_code))
+        length = r.headers.get('Content-Length')
+        if r.status_code == 200 and meta['size'] is not None and length is not None and int(length) != meta['size']:
+            raise MCDownloadError("expected {} bytes, server reports {}".format(meta['size'], length))
+
+        offset = start + received
+        unsaved = 0
+        for chunk in r.iter_content(chunk_size=MCADMIN_DOWNLOAD_CHUNK_SIZE):
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+            rng[2] += len(chunk)
+            unsaved += len(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            if unsaved >= MCADMIN_DOWNLOAD_CHECKPOINT_SIZE:
+                with lock:
+                    _save_part_meta(meta_path, meta)
+                unsaved = 0
+    return True
+
 
-        if 'downloads' not in self._manifest or 'client' not in self._manifest['downloads'] or 'url' not in self._manifest['downloads']['client']:
-            error_msg("Version manifest for [{}] is incomplete; missing downloads:client:url entry".format(self._version))
+def download_file(url, path, sha1=None, size=None, parts=1, session=None):
+    """
+    Stream a url to disk without buffering it in memory. The content is
+    written to a '<path>.part' file next to the destination, with resume state
+    kept in '<path>.part.json'; an interrupted download picks up where it left
+    off using HTTP Range requests. When the size is known and the server
+    accepts ranges, parts > 1 fetches the file as that many byte ranges in
+    parallel. The result is only renamed into place once the size and SHA-1
+    (when known) have been verified. Requests go through session when given,
+    so callers can share pooled connections.
+    """
+    started = time.perf_counter()
+    stats = {}
+    ok = _download_file(url, path, sha1, size, parts, session, stats)
+    if ok:
+        elapsed = time.perf_counter() - started
+        metrics.inc('mcadmin_downloads_total', result='ok')
+        metrics.inc('mcadmin_download_bytes_total', stats.get('bytes', 0))
+        metrics.observe('mcadmin_download_seconds', elapsed)
+        if elapsed > 0:
+            metrics.set('mcadmin_download_throughput_bytes_per_second', round(stats.get('bytes', 0) / elapsed))
+        debug_msg("Downloaded url[{}]", url, operation='download', bytes=stats.get('bytes', 0), parts=stats.get('parts'),
+                  elapsed_ms=round(elapsed * 1000, 3))
+    else:
+        metrics.inc('mcadmin_downloads_total', result='verify_failed' if stats.get('verify_failed') else 'failed')
+    return ok
+
+
+def _download_file(url, path, sha1, size, parts, session, stats):
+    import concurrent.futures
+    import shutil
+    import requests
+    http = session if session is not None else requests
+    dest_dir = os.path.dirname(path)
+    part_path = path + '.part'
+    meta_path = path + '.part.json'
+
+    meta = _load_part_meta(meta_path, url, sha1, size)
+    if meta is None or not os.path.exists(part_path):
+        _remove_partial(part_path, meta_path)
+        meta = None
+    resumed = sum(rng[2] for rng in meta['ranges']) if meta is not None else 0
+
+    if size is not None:
+        have = sum(rng[2] for rng in meta['ranges']) if meta is not None else 0
+        try:
+            free = shutil.disk_usage(dest_dir).free
+        except Exception as ex:
+            error_msg("Failed to determine free space in [{}]: {}", dest_dir, str(ex))
+            return False
+        if free < size - have:
+            error_msg("Insufficient space in [{}] for [{}]: need {} bytes, have {}", dest_dir, url, size - have, free)
             return False
 
-        if not self._create_version_dir():
+    if meta is None:
+        ranges = [[0, None, 0]]
+        if size is not None and parts > 1 and size >= parts * MCADMIN_DOWNLOAD_CHECKPOINT_SIZE:
+            try:
+                r = http.head(url, allow_redirects=True, timeout=MCADMIN_HTTP_TIMEOUT)
+                length = r.headers.get('Content-Length')
+                if r.status_code != 200:
+                    error_msg("Failed to retrieve url[{}]: http status {}", url, r.status_code)
+                    return False
+                if length is not None and int(length) != size:
+                    error_msg("Size mismatch for url[{}]: expected {} bytes, server reports {}", url, size, length)
+                    return False
+                if r.headers.get('Accept-Ranges') == 'bytes':
+                    ranges = _split_ranges(size, parts)
+                else:
+                    debug_msg("Server for url[{}] does not accept ranges; downloading sequentially", url)
+            except Exception as ex:
+                error_msg("Failed to retrieve url[{}]: {}", url, str(ex))
+                return False
+        meta = {'url': url, 'sha1': sha1, 'size': size, 'ranges': ranges}
+    else:
+        info_msg("Resuming download of [{}] from {} bytes", url, sum(rng[2] for rng in meta['ranges']))
+
+    sequential = len(meta['ranges']) == 1 and meta['ranges'][0][1] is None
+    lock = threading.Lock()
+    for attempt in range(MCADMIN_DOWNLOAD_ATTEMPTS):
+        try:
+            fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except Exception as ex:
+            error_msg("Failed to open partial download [{}]: {}", part_path, str(ex))
+            return False
+        try:
+            _save_part_meta(meta_path, meta)
+            if sequential:
+                rng = meta['ranges'][0]
+                os.ftruncate(fd, rng[2])
+                # Hash what a previous attempt already wrote, then the rest as it arrives
+                digest = hashlib.sha1()
+                offset = 0
+                while offset < rng[2]:
+                    chunk = os.pread(fd, min(MCADMIN_DOWNLOAD_CHUNK_SIZE, rng[2] - offset), offset)
+                    digest.update(chunk)
+                    offset += len(chunk)
+                if not _fetch_range(http, url, fd, rng, meta, meta_path, lock, digest):
+                    debug_msg("Server ignored range request for url[{}]; restarting", url)
+                    rng[2] = 0
+                    resumed = 0
+                    os.ftruncate(fd, 0)
+                    digest = hashlib.sha1()
+                    _fetch_range(http, url, fd, rng, meta, meta_path, lock, digest)
+                received = rng[2]
+                digest = digest.hexdigest()
+            else:
+                if size is not None and os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                pending = [rng for rng in meta['ranges'] if rng[2] < rng[1] - rng[0] + 1]
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(pending) or 1) as pool:
+                    futures = [pool.submit(_fetch_range, http, url, fd, rng, meta, meta_path, lock) for rng in pending]
+                    ignored = [future for future in futures if not future.result()]
+                if ignored:
+                    debug_msg("Server ignored range request for url[{}]; downloading sequentially", url)
+                    meta['ranges'] = [[0, None, 0]]
+                    sequential = True
+                    resumed = 0
+                    continue
+                received = sum(rng[2] for rng in meta['ranges'])
+                digest = file_sha1(part_path) if sha1 is not None else None
+        except MCDownloadError as ex:
+            error_msg("Failed to retrieve url[{}]: {}", url, str(ex))
+            _remove_partial(part_path, meta_path)
+            return False
+        except Exception as ex:
+            with lock:
+                _save_part_meta(meta_path, meta)
+            warn_msg("Download of url[{}] interrupted (attempt {}/{}): {}", url, attempt + 1, MCADMIN_DOWNLOAD_ATTEMPTS, str(ex))
+            continue
+        finally:
+            os.close(fd)
+
+        if size is not None and received != size:
+            error_msg("Size mismatch for url[{}]: expected {} bytes, received {}", url, size, received)
+            _remove_partial(part_path, meta_path)
+            stats['verify_failed'] = True
             return False
 
-        url = self._manifest['downloads']['client']['url']
-        info_msg("Downloading [{}]...".format(url))
-        r = requests.get(url)
-        if r.status_code != 200:
-            error_msg("Failed to retrieve client jar from url[{}]: http status {}".format(url, r.status_code))
+        if sha1 is not None and digest != sha1:
+            error_msg("SHA-1 mismatch for url[{}]: expected {}, received {}", url, sha1, digest)
+            _remove_partial(part_path, meta_path)
+            stats['verify_failed'] = True
             return False
 
         try:
-            with open(os.path.join(self._admin.get_version_dir(self._version), 'client.jar'), 'wb') as f:
-                f.write(r.content)
+            os.replace(part_path, path)
+            os.remove(meta_path)
         except Exception as ex:
-            error_msg("Failed to save version [{}] client jar: {}".format(self._version, str(ex)))
+            error_msg("Failed to save url[{}] to [{}]: {}", url, path, str(ex))
             return False
-
+        stats['bytes'] = received - resumed
+        stats['parts'] = len(meta['ranges'])
         return True
 
-    def get_server_jar(self):
-        if self._resource_exists('server.jar'):
-            info_msg("Server jar for version [{}] is cached".format(self._version))
+    error_msg("Failed to retrieve url[{}] after {} attempts; partial download kept for resume", url, MCADMIN_DOWNLOAD_ATTEMPTS)
+    return False
+
+
+class MCProgress(object):
+    """Thread-safe progress counter that periodically logs item and byte throughput"""
+
+    def __init__(self, label, total, interval=None):
+        self._label = label
+        self._total = total
+        self._interval = interval if interval is not None else MCADMIN_PROGRESS_INTERVAL
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._last = self._start
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def update(self, size=0, skipped=False, failed=False):
+        with self._lock:
+            self.done += 1
+            self.bytes += size
+            if skipped:
+                self.skipped += 1
+            if failed:
+                self.failed += 1
+            now = time.time()
+            if now - self._last >= self._interval:
+                self._last = now
+                self._report(now)
+
+    def _report(self, now):
+        elapsed = max(now - self._start, 0.001)
+        info_msg("{}: {}/{} ({} skipped, {} failed), {:.1f} MB, {:.1f} items/s, {:.2f} MB/s",
+            self._label, self.done, self._total, self.skipped, self.failed,
+            self.bytes / 1e6, (self.done - self.skipped) / elapsed, self.bytes / 1e6 / elapsed)
+
+    def finish(self):
+        with self._lock:
+            self._report(time.time())
+
+
+class MCCache(object):
+    """
+    Index of the files in the cache directory, tracking the size and last
+    access time of each entry. The cache is kept within a byte and entry
+    budget by evicting the least recently used entries; pinned entries are
+    never evicted. Hit, miss and eviction counts persist with the index.
+
+    Several mcadmin processes may share the cache, so changes are kept as
+    pending updates and merged into the on-disk index under a lock.
+
+    Lookups alone do not rewrite the index: like relatime, an entry's access
+    time is only recorded right away once it is MCADMIN_CACHE_ATIME_RESOLUTION
+    old, and hit/miss counts wait for the next write, so read-only commands
+    leave the cache untouched. Pending updates are saved by the next write or
+    by flush(), which MCAdmin.close() calls.
+    """
+
+    INDEX_FILE = 'index.json'
+    STAT_KEYS = ('hits', 'misses', 'evictions')
+
+    def __init__(self, admin, max_bytes=None, max_entries=None, pinned=None):
+        self._admin = admin
+        self._max_bytes = max_bytes if max_bytes is not None else MCADMIN_CACHE_MAX_BYTES
+        self._max_entries = max_entries if max_entries is not None else MCADMIN_CACHE_MAX_ENTRIES
+        self._pinned = set(pinned if pinned is not None else MCADMIN_CACHE_PINNED)
+        self._entries = None
+        self._stats = None
+        self._pending = {}
+        self._stats_delta = dict.fromkeys(self.STAT_KEYS, 0)
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def _get_index_path(self):
+        return self._admin.get_cache_path(self.INDEX_FILE)
+
+    def _read_index(self):
+        path = self._get_index_path()
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'r') as fp:
+                index = json.load(fp)
+            stats = dict.fromkeys(self.STAT_KEYS, 0)
+            stats.update(index['stats'])
+            return index['entries'], stats
+        except Exception as ex:
+            warn_msg("Ignoring unreadable cache index [{}]: {}", path, str(ex))
+            return None
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        index = self._read_index()
+        if index is not None:
+            self._entries, self._stats = index
+            return
+
+        self._entries = {}
+        self._stats = dict.fromkeys(self.STAT_KEYS, 0)
+        # First use; index whatever an earlier version left in the cache
+        cache_dir = self._admin.get_cache_dir()
+        if os.path.isdir(cache_dir):
+            for filename in os.listdir(cache_dir):
+                if filename != self.INDEX_FILE and not filename.endswith(('.meta.json', '.tmp')):
+                    self._adopt(filename)
+
+    def _set(self, filename, entry, defer=False):
+        if entry is None:
+            self._entries.pop(filename, None)
+        else:
+            self._entries[filename] = entry
+        self._pending[filename] = entry
+        if not defer:
+            self._dirty = True
+
+    def _count(self, stat, defer=False):
+        self._stats_delta[stat] += 1
+        if not defer:
+            self._dirty = True
+
+    def flush(self, enforce=False, keep=None):
+        """Merge pending changes into the on-disk index, optionally enforcing the budget"""
+        with self._lock:
+            if not self._dirty and not enforce:
+                return True
+            self._load()
+            with mcfs.file_lock(self._admin.get_lock_path('index')):
+                index = self._read_index()
+                entries, stats = index if index is not None else ({}, dict.fromkeys(self.STAT_KEYS, 0))
+                for filename, entry in self._pending.items():
+                    if entry is None:
+                        entries.pop(filename, None)
+                    elif filename in entries and entries[filename]['atime'] > entry['atime']:
+                        entries[filename]['size'] = entry['size']
+                    else:
+                        entries[filename] = entry
+                for stat, delta in self._stats_delta.items():
+                    stats[stat] += delta
+                self._entries = entries
+                self._stats = stats
+                self._pending = {}
+                self._stats_delta = dict.fromkeys(self.STAT_KEYS, 0)
+
+                if enforce:
+                    self._enforce(keep)
+
+                try:
+                    mcfs.atomic_write(self._get_index_path(), json.dumps({'entries': entries, 'stats': stats}).encode())
+                except Exception as ex:
+                    error_msg("Failed to save cache index [{}]: {}", self._get_index_path(), str(ex))
+                    return False
+            self._dirty = False
             return True
 
-        if 'downloads' not in self._manifest or 'server' not in self._manifest['downloads'] or 'url' not in self._manifest['downloads']['server']:
-            error_msg("Version manifest for [{}] is incomplete; missing downloads:server:url entry".format(self._version))
+    def _meta_size(self, filename):
+        try:
+            return os.path.getsize(self._admin.get_cache_meta_path(filename))
+        except OSError:
+            return 0
+
+    def _adopt(self, filename):
+        """Index a file that was cached before the index knew about it"""
+        path = self._admin.get_cache_path(filename)
+        if not os.path.isfile(path):
             return False
+        st = os.stat(path)
+        self._set(filename, {'size': st.st_size + self._meta_size(filename), 'atime': st.st_mtime})
+        return True
 
-        if not self._create_version_dir():
+    def contains(self, filename):
+        with self._lock:
+            self._load()
+            return filename in self._entries or self._adopt(filename)
+
+    def lookup(self, filename):
+        """Check whether a file is cached, counting the hit or miss and marking it as recently used"""
+        with self._lock:
+            self._load()
+            if filename in self._entries or self._adopt(filename):
+                entry = self._entries[filename]
+                now = time.time()
+                recent = now - entry['atime'] < MCADMIN_CACHE_ATIME_RESOLUTION
+                self._set(filename, {'size': entry['size'], 'atime': now}, defer=recent)
+                self._count('hits', defer=True)
+                return True
+            self._count('misses', defer=True)
             return False
 
-        url = self._manifest['downloads']['server']['url']
-        info_msg("Downloading [{}]...".format(url))
-        r = requests.get(url)
-        if r.status_code != 200:
-            error_msg("Failed to retrieve server jar from url[{}]: http status {}".format(url, r.status_code))
+    def add(self, filename, size):
+        """Index a cached file of size bytes; its metadata sidecar, if any, counts toward the entry"""
+        with self._lock:
+            self._load()
+            self._set(filename, {'size': size + self._meta_size(filename), 'atime': time.time()})
+            return self.flush(enforce=True, keep=filename)
+
+    def _remove_files(self, filename):
+        for path in (self._admin.get_cache_path(filename), self._admin.get_cache_meta_path(filename)):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as ex:
+                error_msg("Failed to remove cache file [{}]: {}", path, str(ex))
+                return False
+        return True
+
+    def evict(self, filename, flush=True):
+        with self._lock:
+            self._load()
+            if not self._remove_files(filename):
+                return False
+            if filename in self._entries:
+                self._set(filename, None)
+                self._count('evictions')
+            return self.flush() if flush else True
+
+    def _enforce(self, keep=None):
+        # Called from flush() with the index lock held, on the merged index
+        total = sum(entry['size'] for entry in self._entries.values())
+        count = len(self._entries)
+
+        def within_budget():
+            return (self._max_bytes is None or total <= self._max_bytes) and (self._max_entries is None or count <= self._max_entries)
+
+        if within_budget():
+            return
+        candidates = sorted((entry['atime'], filename) for filename, entry in self._entries.items()
+                            if filename not in self._pinned and filename != keep)
+        for atime, filename in candidates:
+            if within_budget():
+                break
+            size = self._entries[filename]['size']
+            debug_msg("Evicting [{}] ({} bytes) from cache", filename, size)
+            if self._remove_files(filename):
+                del self._entries[filename]
+                self._stats['evictions'] += 1
+                total -= size
+                count -= 1
+
+    def enforce(self):
+        """Evict least recently used, unpinned entries until the cache is within budget"""
+        return self.flush(enforce=True)
+
+    def clear(self, pinned=False):
+        """Remove every cached entry, including pinned ones if pinned is True"""
+        with self._lock:
+            self._load()
+            ok = True
+            for filename in list(self._entries):
+                if filename in self._pinned and not pinned:
+                    continue
+                ok = self.evict(filename, flush=False) and ok
+            return self.flush() and ok
+
+    def get_stats(self):
+        with self._lock:
+            self._load()
+            stats = dict((stat, self._stats[stat] + self._stats_delta[stat]) for stat in self.STAT_KEYS)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = sum(entry['size'] for entry in self._entries.values())
+            stats['max_entries'] = self._max_entries
+            stats['max_bytes'] = self._max_bytes
+            return stats
+
+
+class MCStore(object):
+    """
+    Content-addressed artifact store. Each artifact is kept once, under its
+    SHA-1, at store/<sha1[:2]>/<sha1>; version directories hard-link to the
+    stored object, so its link count doubles as a reference count. Objects
+    nothing refers to are unreferenced and can be reclaimed.
+
+    On filesystems without hard links, artifacts fall back to plain copies,
+    whose paths are listed in store/<sha1[:2]>/<sha1>.refs and counted as
+    references along with the links.
+    """
+
+    REFS_SUFFIX = '.refs'
+
+    def __init__(self, admin):
+        self._admin = admin
+
+    def get_object_path(self, sha1):
+        return os.path.join(self._admin.get_store_dir(), sha1[:2], sha1)
+
+    def _get_refs_path(self, sha1):
+        return self.get_object_path(sha1) + self.REFS_SUFFIX
+
+    def contains(self, sha1):
+        return os.path.isfile(self.get_object_path(sha1))
+
+    def _read_copies(self, sha1):
+        """Paths of the copies of an object that still exist"""
+        try:
+            with open(self._get_refs_path(sha1), 'r') as fp:
+                copies = json.load(fp)
+        except FileNotFoundError:
+            return []
+        except Exception as ex:
+            warn_msg("Ignoring unreadable reference list [{}]: {}", self._get_refs_path(sha1), str(ex))
+            return []
+        return [path for path in copies if os.path.isfile(path)]
+
+    def _update_copies(self, sha1, add=None, remove=None):
+        # Called with the object's resource lock held
+        refs_path = self._get_refs_path(sha1)
+        if add is None and not os.path.exists(refs_path):
+            return
+        copies = [path for path in self._read_copies(sha1) if path != add and path != remove]
+        if add is not None:
+            copies.append(add)
+        if copies:
+            mcfs.atomic_write(refs_path, json.dumps(copies, indent=4).encode())
+        else:
+            os.remove(refs_path)
+
+    def refcount(self, sha1):
+        """Number of references to an object outside of the store: its links and its copies"""
+        try:
+            links = os.stat(self.get_object_path(sha1)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+        return links + len(self._read_copies(sha1))
+
+    def is_linked(self, sha1, path):
+        """True if path is a link to, or a recorded copy of, a stored object"""
+        try:
+            if os.path.samefile(self.get_object_path(sha1), path):
+                return True
+        except OSError:
+            return False
+        return os.path.abspath(path) in self._read_copies(sha1)
+
+    def verify_object(self, sha1, size=None):
+        """Re-hash a stored object, removing it if it is corrupt; False if it was"""
+        path = self.get_object_path(sha1)
+        if verify_file(path, sha1, size):
+            return True
+        warn_msg("Stored object [{}] is corrupt; removing", sha1)
+        try:
+            os.remove(path)
+        except Exception as ex:
+            error_msg("Failed to remove corrupt object [{}]: {}", sha1, str(ex))
+        return False
+
+    def fetch(self, url, sha1, size=None):
+        """Download an object into the store, unless it is already present"""
+        if self.contains(sha1):
+            return True
+        path = self.get_object_path(sha1)
+        if not make_dirs(os.path.dirname(path)):
+            return False
+        with self._admin.lock_resource('store:' + sha1):
+            if self.contains(sha1):
+                debug_msg("Object [{}] was fetched concurrently", sha1)
+                return True
+            info_msg("Downloading [{}]...", url)
+            return download_file(url, path, sha1, size, session=self._admin.get_session())
+
+    def adopt(self, path, sha1):
+        """Move an existing file into the store (it must already match sha1) and link it back"""
+        if not self.contains(sha1):
+            dest = self.get_object_path(sha1)
+            if not make_dirs(os.path.dirname(dest)):
+                return False
+            try:
+                os.replace(path, dest)
+            except Exception as ex:
+                error_msg("Failed to move [{}] into the artifact store: {}", path, str(ex))
+                return False
+        return self.link(sha1, path)
+
+    def link(self, sha1, path):
+        """Atomically make path a reference to a stored object"""
+        import shutil
+        path = os.path.abspath(path)
+        tmp_path = '{}.{}.{}.link'.format(path, os.getpid(), threading.get_ident())
+        try:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            copied = False
+            try:
+                os.link(self.get_object_path(sha1), tmp_path)
+            except OSError:
+                shutil.copy2(self.get_object_path(sha1), tmp_path)
+                copied = True
+            with self._admin.lock_resource('store:' + sha1):
+                os.replace(tmp_path, path)
+                self._update_copies(sha1, add=path if copied else None, remove=path)
+        except Exception as ex:
+            error_msg("Failed to link stored object [{}] to [{}]: {}", sha1, path, str(ex))
             return False
+        return True
 
+    def release(self, path, sha1=None):
+        """
+        Drop a reference to a stored object, removing the object as well
+        once nothing else refers to it.
+        """
         try:
-            with open(os.path.join(self._admin.get_version_dir(self._version), 'server.jar'), 'wb') as f:
-                f.write(r.content)
+            if sha1 is None:
+                sha1 = file_sha1(path)
+            with self._admin.lock_resource('store:' + sha1):
+                os.remove(path)
+                self._update_copies(sha1, remove=os.path.abspath(path))
+                if self.contains(sha1) and self.refcount(sha1) == 0:
+                    debug_msg("Removing unreferenced object [{}]", sha1)
+                    os.remove(self.get_object_path(sha1))
         except Exception as ex:
-            error_msg("Failed to save version [{}] server jar: {}".format(self._version, str(ex)))
+            error_msg("Failed to release [{}]: {}", path, str(ex))
+            return False
+        return True
+
+    def _objects(self):
+        base = self._admin.get_store_dir()
+        if not os.path.isdir(base):
+            return
+        for prefix in os.listdir(base):
+            subdir = os.path.join(base, prefix)
+            if len(prefix) != 2 or not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if len(name) == 40 and name.startswith(prefix):
+                    yield name, os.path.join(subdir, name)
+
+    @log.timing('store_gc', mclog.INFO)
+    def gc(self):
+        """Remove unreferenced objects; returns the number of objects and bytes reclaimed"""
+        count = 0
+        reclaimed = 0
+        for sha1, path in self._objects():
+            try:
+                with self._admin.lock_resource('store:' + sha1):
+                    if self.refcount(sha1) > 0:
+                        continue
+                    st = os.stat(path)
+                    os.remove(path)
+                    if os.path.exists(self._get_refs_path(sha1)):
+                        os.remove(self._get_refs_path(sha1))
+            except Exception as ex:
+                error_msg("Failed to remove stored object [{}]: {}", sha1, str(ex))
+                continue
+            count += 1
+            reclaimed += st.st_size
+        info_msg("Reclaimed {} unreferenced object(s), {} bytes", count, reclaimed)
+        return count, reclaimed
+
+    def verify(self):
+        """Re-hash every stored object, removing any that are corrupt; returns the corrupt hashes"""
+        return [sha1 for sha1, _ in self._objects() if not self.verify_object(sha1)]
+
+
+class MCVersion(object):
+    def __init__(self, admin, version, manifest):
+        self._admin = admin
+        self._version = version
+        self._manifest = manifest
+
+    def dump_manifest(self):
+        if self._manifest is None:
+            return
+        dump_json(self._manifest)
+
+    def _create_version_dir(self):
+        return make_dirs(self._admin.get_version_dir(self._version))
+
+    def _resource_exists(self, path):
+        return os.path.exists(os.path.join(self._admin.get_version_dir(self._version), path))
+
+    def _get_artifact(self, kind, filename):
+        path = os.path.join(self._admin.get_version_dir(self._version), filename)
+
+        if 'downloads' not in self._manifest or kind not in self._manifest['downloads'] or 'url' not in self._manifest['downloads'][kind] or 'sha1' not in self._manifest['downloads'][kind]:
+            error_msg("Version manifest for [{}] is incomplete; missing downloads:{}:url/sha1 entry", self._version, kind)
             return False
 
+        download = self._manifest['downloads'][kind]
+        store = self._admin.get_store()
+        sha1 = download['sha1']
+        size = download.get('size')
+        if store.is_linked(sha1, path):
+            # Re-hashing on every call would read the whole jar; a size check catches truncation
+            if verify_file(path, None, size):
+                info_msg("{} jar for version [{}] is cached", kind.capitalize(), self._version)
+                return True
+            warn_msg("Cached {} jar for version [{}] is corrupt; downloading again", kind, self._version)
+            store.verify_object(sha1, size)
+
+        if not self._create_version_dir():
+            return False
+
+        if os.path.isfile(path) and not store.contains(sha1):
+            # A jar cached before the artifact store existed; keep it if intact
+            if verify_file(path, sha1, size):
+                return store.adopt(path, sha1)
+            warn_msg("Cached {} jar for version [{}] is corrupt; downloading again", kind, self._version)
+        elif store.contains(sha1):
+            # First link of this version to an object fetched for another one
+            store.verify_object(sha1, size)
+
+        if not store.fetch(download['url'], sha1, size):
+            error_msg("Failed to retrieve {} jar for version [{}]", kind, self._version)
+            return False
+
+        return store.link(sha1, path)
+
+    def _release_artifact(self, kind, filename):
+        path = os.path.join(self._admin.get_version_dir(self._version), filename)
+        if not os.path.isfile(path):
+            return True
+        sha1 = None
+        if self._manifest is not None and 'downloads' in self._manifest and kind in self._manifest['downloads']:
+            sha1 = self._manifest['downloads'][kind].get('sha1')
+        if not self._admin.get_store().release(path, sha1):
+            error_msg("Failed to remove cached {} jar for version [{}]", kind, self._version)
+            return False
         return True
 
+    def download_client_jar(self):
+        return self._get_artifact('client', 'client.jar')
+
+    def get_server_jar(self):
+        return self._get_artifact('server', 'server.jar')
+
     def get_client_jar_path(self):
         return os.path.join(self._admin.get_version_dir(self._version), 'client.jar')
 
@@ -155,31 +895,116 @@ class MCVersion(object):
         return os.path.join(self._admin.get_version_dir(self._version), 'textures')
 
     def purge_version_cache(self):
+        import shutil
         fail = False
-        info_msg("Purging cache for version [{}]...".format(self._version))
-        if self._resource_exists('client.jar'):
-            try:
-                os.remove(os.path.join(self._admin.get_version_dir(self._version), 'client.jar'))
-            except Exception as ex:
-                error_msg("Failed to remove cached client jar for version [{}]: {}".format(self._version, str(ex)))
-                fail = True
+        info_msg("Purging cache for version [{}]...", self._version)
+        if not self._release_artifact('client', 'client.jar'):
+            fail = True
 
-        if self._resource_exists('server.jar'):
-            try:
-                os.remove(os.path.join(self._admin.get_version_dir(self._version), 'server.jar'))
-            except Exception as ex:
-                error_msg("Failed to remove cached server jar for version [{}]: {}".format(self._version, str(ex)))
-                fail = True
+        if not self._release_artifact('server', 'server.jar'):
+            fail = True
 
         if self._resource_exists('textures'):
             try:
                 shutil.rmtree(os.path.join(self._admin.get_version_dir(self._version), 'textures'))
             except Exception as ex:
-                error_msg("Failed to remove texture cache for version [{}]: {}".format(self._version, str(ex)))
+                error_msg("Failed to remove texture cache for version [{}]: {}", self._version, str(ex))
                 fail = True
 
         return not fail
 
+    def _mirror_file(self, url, path, sha1, size, verify):
+        """Fetch one file into the mirror; returns (bytes transferred, skipped)"""
+        if os.path.isfile(path) and (size is None or os.path.getsize(path) == size):
+            if not verify or verify_file(path, sha1):
+                return 0, True
+        if not make_dirs(os.path.dirname(path)):
+            raise IOError("cannot create [{}]".format(os.path.dirname(path)))
+
+        session = self._admin.get_session()
+        if size is not None and size > MCADMIN_DOWNLOAD_CHECKPOINT_SIZE:
+            if not download_file(url, path, sha1, size, session=session):
+                raise IOError("failed to download [{}]".format(url))
+            return size, False
+
+        # Small objects: a single request, verified in memory and written atomically
+        content = get_url(url, session=session)
+        if content is None:
+            raise IOError("failed to download [{}]".format(url))
+        if sha1 is not None and hashlib.sha1(content).hexdigest() != sha1:
+            raise IOError("SHA-1 mismatch for url[{}]".format(url))
+        mcfs.atomic_write(path, content)
+        return len(content), False
+
+    def _get_asset_index(self):
+        assets = self._manifest.get('assetIndex')
+        if assets is None or 'id' not in assets or 'url' not in assets:
+            error_msg("Version manifest for [{}] is incomplete; missing assetIndex entry", self._version)
+            return None
+
+        path = os.path.join(self._admin.get_assets_dir(), 'indexes', '{}.json'.format(assets['id']))
+        try:
+            self._mirror_file(assets['url'], path, assets.get('sha1'), assets.get('size'), True)
+            with open(path, 'rb') as fp:
+                return json.load(fp)
+        except Exception as ex:
+            error_msg("Failed to retrieve asset index [{}] for version [{}]: {}", assets['id'], self._version, str(ex))
+            return None
+
+    def _get_mirror_files(self, asset_index):
+        files = {}
+        assets_dir = self._admin.get_assets_dir()
+        for entry in asset_index.get('objects', {}).values():
+            digest = entry['hash']
+            url = '{}/{}/{}'.format(MOJANG_RESOURCES_URL, digest[:2], digest)
+            files[digest] = (url, os.path.join(assets_dir, 'objects', digest[:2], digest), digest, entry.get('size'))
+
+        libraries_dir = self._admin.get_libraries_dir()
+        for library in self._manifest.get('libraries', []):
+            downloads = library.get('downloads', {})
+            artifacts = [downloads['artifact']] if 'artifact' in downloads else []
+            artifacts.extend(downloads.get('classifiers', {}).values())
+            for artifact in artifacts:
+                if 'url' in artifact and 'path' in artifact:
+                    files[artifact['path']] = (artifact['url'], os.path.join(libraries_dir, artifact['path']), artifact.get('sha1'), artifact.get('size'))
+        return list(files.values())
+
+    @log.timing('mirror', mclog.INFO)
+    def mirror(self, workers=MCADMIN_MIRROR_WORKERS, verify=False):
+        """
+        Mirror this version's asset index, asset objects and libraries into
+        the working directory, laid out like a launcher's: assets/indexes,
+        assets/objects/<hash[:2]>/<hash> and libraries/<maven path>. Files
+        are fetched concurrently over the shared session and verified against
+        their hashes; files already present (with the right size, or hash
+        when verify is set) are skipped. Progress and throughput are logged
+        as the mirror runs.
+        """
+        import concurrent.futures
+        asset_index = self._get_asset_index()
+        if asset_index is None:
+            return False
+
+        files = self._get_mirror_files(asset_index)
+        progress = MCProgress("Mirror [{}]".format(self._version), len(files))
+
+        def fetch(entry):
+            url, path, sha1, size = entry
+            try:
+                transferred, skipped = self._mirror_file(url, path, sha1, size, verify)
+            except Exception as ex:
+                error_msg("Failed to mirror [{}]: {}", url, str(ex))
+                progress.update(failed=True)
+                return False
+            progress.update(transferred, skipped)
+            return True
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            failed = sum(1 for ok in pool.map(fetch, files) if not ok)
+        progress.finish()
+        return not failed
+
+    TEXTURE_ROOT = 'assets/minecraft/textures/'
     TEXTURE_RESOURCES=['entity/chest/normal.png',
                        'entity/chest/normal_double.png',
                        'entity/chest/ender.png',
@@ -188,25 +1013,496 @@ class MCVersion(object):
                        'colormap/foliage.png',
                        'colormap/grass.png',
                        'blocks/*',
+                       'block/*',
                        'entity/end_portal.png']
+    TEXTURE_MANIFEST = '.manifest.json'
+
+    def _load_texture_manifest(self, version=None):
+        path = os.path.join(self._admin.get_version_dir(version or self._version), 'textures', self.TEXTURE_MANIFEST)
+        try:
+            with open(path, 'r') as fp:
+                return json.load(fp)
+        except Exception:
+            return None
 
-    def extract_textures(self):
+    def _find_shared_textures(self):
+        """Map (member, crc) to an already extracted copy in any other version's texture cache"""
+        shared = {}
+        versions_dir = self._admin.get_version_dir()
+        for version in os.listdir(versions_dir):
+            if version == self._version:
+                continue
+            manifest = self._load_texture_manifest(version)
+            if manifest is None:
+                continue
+            for member, crc in manifest['members'].items():
+                shared.setdefault((member, crc), os.path.join(versions_dir, version, 'textures', member))
+        return shared
+
+    @staticmethod
+    def _extract_member(jar, info, dest):
+        """Inflate one member straight out of the memory-mapped jar, checking its CRC"""
+        import zipfile
+        signature, _, _, method, _, _, _, _, _, name_len, extra_len = ZIP_LOCAL_HEADER.unpack_from(jar, info.header_offset)
+        if signature != b'PK\x03\x04':
+            raise zipfile.BadZipFile("bad local header for [{}]".format(info.filename))
+        start = info.header_offset + ZIP_LOCAL_HEADER.size + name_len + extra_len
+        data = jar[start:start + info.compress_size]
+        if method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif method != zipfile.ZIP_STORED:
+            raise zipfile.BadZipFile("unsupported compression {} for [{}]".format(method, info.filename))
+        if zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile("CRC mismatch for [{}]".format(info.filename))
+        make_dirs(os.path.dirname(dest))
+        mcfs.atomic_write(dest, data)
+        return len(data)
+
+    @log.timing('extract_textures', mclog.INFO)
+    def extract_textures(self, workers=MCADMIN_EXTRACT_WORKERS):
+        """
+        Extract the TEXTURE_RESOURCES members of the client jar into the
+        version's texture cache. The jar's central directory is read once and
+        the resource globs resolved against it; matching members are inflated
+        in parallel straight from the memory-mapped jar. A manifest of member
+        CRCs makes re-runs incremental: unchanged members are skipped, and
+        members identical to one already extracted for another version are
+        hard-linked instead of extracted again.
+        """
+        import concurrent.futures
+        import zipfile
         if not self.download_client_jar():
             return False
 
-        if self._resource_exists('textures'):
+        started = time.perf_counter()
+        texture_dir = self.get_texture_path()
+        jar_sha1 = self._manifest['downloads']['client']['sha1']
+        previous = self._load_texture_manifest()
+        if previous is not None and previous.get('jar') == jar_sha1 and \
+                all(os.path.isfile(os.path.join(texture_dir, member)) for member in previous['members']):
+            debug_msg("Textures for version [{}] are up to date", self._version)
             return True
+        previous = previous['members'] if previous is not None else {}
 
         try:
-            os.mkdir(os.path.join(self._admin.get_version_dir(self._version), 'textures'))
-            jar = zipfile.ZipFile(os.path.join(self._admin.get_version_dir(self._version), 'client.jar'))
-            for entry in self.TEXTURE_RESOURCES:
-                jar.getinfo()
-            #jar.extract()
+            with zipfile.ZipFile(self.get_client_jar_path()) as jar:
+                members = {}
+                for info in jar.infolist():
+                    if info.filename.startswith(self.TEXTURE_ROOT) and not info.is_dir():
+                        member = info.filename[len(self.TEXTURE_ROOT):]
+                        if any(fnmatch.fnmatchcase(member, pattern) for pattern in self.TEXTURE_RESOURCES):
+                            members[member] = info
         except Exception as ex:
-            error_msg("Failed to extract textures from client jar for version [{}]: {}".format(self._version, str(ex)))
+            error_msg("Failed to read client jar for version [{}]: {}", self._version, str(ex))
             return False
 
+        shared = None
+        extract = []
+        linked = 0
+        for member, info in members.items():
+            dest = os.path.join(texture_dir, member)
+            if previous.get(member) == info.CRC and os.path.isfile(dest):
+                continue
+            if shared is None:
+                shared = self._find_shared_textures()
+            source = shared.get((member, info.CRC))
+            if source is not None and os.path.isfile(source):
+                make_dirs(os.path.dirname(dest))
+                try:
+                    if os.path.lexists(dest):
+                        os.remove(dest)
+                    os.link(source, dest)
+                    linked += 1
+                    continue
+                except OSError:
+                    pass
+            extract.append((member, info))
+
+        try:
+            with open(self.get_client_jar_path(), 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as jar:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = [pool.submit(self._extract_member, jar, info, os.path.join(texture_dir, member)) for member, info in extract]
+                    extracted = sum(future.result() for future in futures)
+        except Exception as ex:
+            error_msg("Failed to extract textures from client jar for version [{}]: {}", self._version, str(ex))
+            return False
+
+        for member in previous:
+            if member not in members:
+                try:
+                    os.remove(os.path.join(texture_dir, member))
+                except OSError:
+                    pass
+
+        try:
+            manifest = {'jar': jar_sha1, 'members': dict((member, info.CRC) for member, info in members.items())}
+            mcfs.atomic_write(os.path.join(texture_dir, self.TEXTURE_MANIFEST), json.dumps(manifest, indent=4).encode())
+        except Exception as ex:
+            error_msg("Failed to save texture manifest for version [{}]: {}", self._version, str(ex))
+            return False
+
+        info_msg("Textures for version [{}]: {} extracted ({} bytes), {} linked, {} unchanged",
+            self._version, len(extract), extracted, linked, len(members) - len(extract) - linked)
+        metrics.inc('mcadmin_texture_files_total', len(extract), result='extracted')
+        metrics.inc('mcadmin_texture_files_total', linked, result='linked')
+        metrics.inc('mcadmin_texture_files_total', len(members) - len(extract) - linked, result='unchanged')
+        metrics.inc('mcadmin_texture_bytes_total', extracted)
+        metrics.observe('mcadmin_texture_extract_seconds', time.perf_counter() - started)
+        return True
+
+
+class MCManifestStore(object):
+    """
+    Single-file SQLite store of per-version manifests. Alongside the raw
+    manifest, each version's downloads, libraries and asset index reference
+    are kept in indexed tables, so questions that span versions are answered
+    with a query instead of opening and parsing a file per version.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS versions (
+               id TEXT PRIMARY KEY,
+               type TEXT NOT NULL,
+               release_time INTEGER NOT NULL,
+               sha1 TEXT,
+               manifest BLOB NOT NULL)""",
+        """CREATE TABLE IF NOT EXISTS downloads (
+               version TEXT NOT NULL REFERENCES versions(id) ON DELETE CASCADE,
+               kind TEXT NOT NULL,
+               sha1 TEXT,
+               size INTEGER,
+               url TEXT,
+               PRIMARY KEY (version, kind))""",
+        """CREATE TABLE IF NOT EXISTS libraries (
+               version TEXT NOT NULL REFERENCES versions(id) ON DELETE CASCADE,
+               name TEXT NOT NULL,
+               artifact TEXT NOT NULL,
+               path TEXT,
+               sha1 TEXT,
+               size INTEGER,
+               url TEXT)""",
+        """CREATE TABLE IF NOT EXISTS asset_indexes (
+               version TEXT PRIMARY KEY REFERENCES versions(id) ON DELETE CASCADE,
+               id TEXT NOT NULL,
+               sha1 TEXT,
+               size INTEGER,
+               total_size INTEGER,
+               url TEXT)""",
+        "CREATE INDEX IF NOT EXISTS versions_release_time ON versions(release_time)",
+        "CREATE INDEX IF NOT EXISTS libraries_version ON libraries(version)",
+        "CREATE INDEX IF NOT EXISTS libraries_name ON libraries(name)",
+        "CREATE INDEX IF NOT EXISTS libraries_artifact ON libraries(artifact)",
+        "CREATE INDEX IF NOT EXISTS asset_indexes_id ON asset_indexes(id)",
+    ]
+
+    def __init__(self, admin):
+        self._admin = admin
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get_path(self):
+        return os.path.join(self._admin.get_version_dir(), 'manifests.db')
+
+    def _db(self):
+        import sqlite3
+        # sqlite connections cannot be shared between threads; keep one per thread.
+        # They are only used by the thread that opened them, but close() may
+        # be called from any thread
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.get_path(), timeout=30, check_same_thread=False)
+            with self._lock:
+                self._connections.append(db)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            for statement in self.SCHEMA:
+                db.execute(statement)
+            db.commit()
+            self._local.db = db
+        return db
+
+    def close(self):
+        """Close the connections of every thread; the store reopens them on next use"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for db in connections:
+            db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def get_sha1(self, version):
+        row = self._db().execute("SELECT sha1 FROM versions WHERE id = ?", (version,)).fetchone()
+        return row[0] if row is not None else None
+
+    def contains(self, version, sha1=None):
+        row = self._db().execute("SELECT sha1 FROM versions WHERE id = ?", (version,)).fetchone()
+        return row is not None and (sha1 is None or row[0] == sha1)
+
+    def load(self, version):
+        """The parsed manifest for a version, or None if it is not stored"""
+        row = self._db().execute("SELECT manifest FROM versions WHERE id = ?", (version,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def save(self, version, vtype, release_time, sha1, content):
+        """Store a raw per-version manifest, replacing any previous copy"""
+        manifest = json.loads(content)
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM versions WHERE id = ?", (version,))
+            db.execute("INSERT INTO versions (id, type, release_time, sha1, manifest) VALUES (?, ?, ?, ?, ?)",
+                       (version, vtype, release_time, sha1, content))
+            for kind, download in manifest.get('downloads', {}).items():
+                db.execute("INSERT INTO downloads (version, kind, sha1, size, url) VALUES (?, ?, ?, ?, ?)",
+                           (version, kind, download.get('sha1'), download.get('size'), download.get('url')))
+            for library in manifest.get('libraries', []):
+                artifact = library.get('downloads', {}).get('artifact', {})
+                name = library.get('name', '')
+                db.execute("INSERT INTO libraries (version, name, artifact, path, sha1, size, url) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (version, name, ':'.join(name.split(':')[:2]), artifact.get('path'), artifact.get('sha1'), artifact.get('size'), artifact.get('url')))
+            assets = manifest.get('assetIndex')
+            if assets is not None:
+                db.execute("INSERT INTO asset_indexes (version, id, sha1, size, total_size, url) VALUES (?, ?, ?, ?, ?, ?)",
+                           (version, assets.get('id'), assets.get('sha1'), assets.get('size'), assets.get('totalSize'), assets.get('url')))
+        return manifest
+
+    def remove(self, version):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM versions WHERE id = ?", (version,))
+
+    def get_versions_with_library(self, library):
+        """
+        Versions using a library, given either its full maven name
+        ('group:artifact:version') or just 'group:artifact' to match any
+        version of it; ordered by release time.
+        """
+        column = 'name' if library.count(':') >= 2 else 'artifact'
+        rows = self._db().execute("SELECT DISTINCT v.id FROM libraries l JOIN versions v ON v.id = l.version "
+                                  "WHERE l.{} = ? ORDER BY v.release_time".format(column), (library,))
+        return [row[0] for row in rows]
+
+    def get_download_size(self, start, end):
+        """
+        Bytes needed to download every stored version released between start
+        and end (epoch seconds, inclusive): version downloads, plus libraries
+        and asset indexes counted once however many versions share them.
+        """
+        db = self._db()
+        bounds = (start, end)
+        downloads = db.execute("SELECT COALESCE(SUM(d.size), 0) FROM downloads d JOIN versions v ON v.id = d.version "
+                               "WHERE v.release_time BETWEEN ? AND ?", bounds).fetchone()[0]
+        libraries = db.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT l.sha1, l.size FROM libraries l "
+                               "JOIN versions v ON v.id = l.version WHERE v.release_time BETWEEN ? AND ?)", bounds).fetchone()[0]
+        assets = db.execute("SELECT COALESCE(SUM(total_size), 0) FROM (SELECT DISTINCT a.id, a.total_size FROM asset_indexes a "
+                            "JOIN versions v ON v.id = a.version WHERE v.release_time BETWEEN ? AND ?)", bounds).fetchone()[0]
+        return {'downloads': downloads, 'libraries': libraries, 'assets': assets, 'total': downloads + libraries + assets}
+
+
+class MCVersionDelta(object):
+    """Versions added, removed and changed between two version manifests"""
+
+    def __init__(self, added=None, removed=None, changed=None, initial=False):
+        self.added = added or []
+        self.removed = removed or []
+        self.changed = changed or []
+        self.initial = initial
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def dump(self):
+        if self.initial:
+            info_msg("Initial version manifest: {} version(s)", len(self.added))
+            return
+        if not self:
+            info_msg("No version changes")
+            return
+        for label, versions in (('Added', self.added), ('Removed', self.removed), ('Changed', self.changed)):
+            if versions:
+                info_msg("{:8}: {}", label, ', '.join(versions))
+
+
+class MCVersionIndex(object):
+    """
+    Precompiled, read-only index of a version manifest. Each version is a
+    fixed-size record holding a numeric sort key, type, release time and the
+    offsets of its id and manifest url in a string table. Releases are
+    ordered by version and snapshots by release time, with an id-ordered
+    lookup table alongside, so queries bisect over a memory-mapped file
+    instead of parsing the manifest JSON.
+    """
+
+    MAGIC = b'MCVI'
+    FORMAT = 2
+    # magic, format, release count, snapshot count, latest release (offset, length),
+    # latest snapshot (offset, length), string table offset
+    HEADER = struct.Struct('<4sHIIIHIHI')
+    # key (3 x uint16), type, flags, release time, id (offset, length), url (offset, length), manifest sha1
+    RECORD = struct.Struct('<HHHBBqIHIH20s')
+    KEY = struct.Struct('<HHH')
+    TIME = struct.Struct('<q')
+    ID_ENTRY = struct.Struct('<I')
+
+    RELEASE = 0
+    SNAPSHOT = 1
+    KEYED = 0x01
+
+    RELEASE_RE = re.compile(r'^\s*(?P<major>\d+)\.(?P<minor>\d+)(\.(?P<revision>\d+))?\s*$')
+    SNAPSHOT_RE = re.compile(r'^\s*(?P<major>\d+)w(?P<minor>\d+)(?P<revision>[a-z])\s*$')
+
+    def __init__(self, buf):
+        self._buf = buf
+        magic, fmt, self._releases, self._snapshots, lr_off, lr_len, ls_off, ls_len, self._strings = self.HEADER.unpack_from(buf, 0)
+        if magic != self.MAGIC or fmt != self.FORMAT:
+            raise ValueError("not a version index (format {})".format(fmt))
+        self._records = self.HEADER.size
+        self._ids = self._records + (self._releases + self._snapshots) * self.RECORD.size
+        self.latest_release = self._string(lr_off, lr_len)
+        self.latest_snapshot = self._string(ls_off, ls_len)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fp:
+            return cls(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def parse_release_key(cls, version):
+        m = cls.RELEASE_RE.match(version)
+        if m is None:
+            return None
+        return int(m.group('major')), int(m.group('minor')), int(m.group('revision') or 0)
+
+    @classmethod
+    def parse_snapshot_key(cls, version):
+        m = cls.SNAPSHOT_RE.match(version)
+        if m is None:
+            return None
+        return int(m.group('major')), int(m.group('minor')), ord(m.group('revision'))
+
+    @staticmethod
+    def parse_time(value):
+        """Epoch seconds for an ISO 8601 string, datetime or number"""
+        if isinstance(value, (int, float)):
+            return int(value)
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return int(value.timestamp())
+
+    @classmethod
+    def build(cls, manifest):
+        """Compile a parsed version manifest into index bytes"""
+        strings = bytearray()
+
+        def add_string(value):
+            data = value.encode('utf-8')
+            offset = len(strings)
+            strings.extend(data)
+            return offset, len(data)
+
+        releases = []
+        snapshots = []
+        for entry in manifest['versions']:
+            if entry['type'] == MCVersions.RELEASE:
+                key = cls.parse_release_key(entry['id'])
+                vtype, target = cls.RELEASE, releases
+            elif entry['type'] == MCVersions.SNAPSHOT:
+                key = cls.parse_snapshot_key(entry['id'])
+                vtype, target = cls.SNAPSHOT, snapshots
+            else:
+                continue
+            flags = cls.KEYED if key is not None else 0
+            sha1 = bytes.fromhex(entry['sha1']) if entry.get('sha1') else bytes(20)
+            target.append((key or (0, 0, 0), vtype, flags, cls.parse_time(entry['releaseTime']), entry['id'], entry['url'], sha1))
+
+        releases.sort(key=lambda record: (record[0], record[3]))
+        snapshots.sort(key=lambda record: (record[3], record[0]))
+        records = releases + snapshots
+
+        body = bytearray()
+        for key, vtype, flags, release_time, vid, url, sha1 in records:
+            body.extend(cls.RECORD.pack(key[0], key[1], key[2], vtype, flags, release_time, *(add_string(vid) + add_string(url) + (sha1,))))
+        for n in sorted(range(len(records)), key=lambda n: records[n][4]):
+            body.extend(cls.ID_ENTRY.pack(n))
+
+        latest_release = add_string(manifest['latest'][MCVersions.RELEASE])
+        latest_snapshot = add_string(manifest['latest'][MCVersions.SNAPSHOT])
+        header = cls.HEADER.pack(cls.MAGIC, cls.FORMAT, len(releases), len(snapshots),
+                                 latest_release[0], latest_release[1], latest_snapshot[0], latest_snapshot[1],
+                                 cls.HEADER.size + len(body))
+        return bytes(header + body + strings)
+
+    def _string(self, offset, length):
+        start = self._strings + offset
+        return bytes(self._buf[start:start + length]).decode('utf-8')
+
+    def _offset(self, n):
+        return self._records + n * self.RECORD.size
+
+    def _key(self, n):
+        return self.KEY.unpack_from(self._buf, self._offset(n))
+
+    def _time(self, n):
+        return self.TIME.unpack_from(self._buf, self._offset(n) + 8)[0]
+
+    def _id(self, n):
+        record = self.RECORD.unpack_from(self._buf, self._offset(n))
+        return self._string(record[6], record[7])
+
+    def _id_at(self, i):
+        return self.ID_ENTRY.unpack_from(self._buf, self._ids + i * self.ID_ENTRY.size)[0]
+
+    @staticmethod
+    def _bisect(lo, hi, value, target, right=False):
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value(mid) < target or (right and value(mid) == target):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def record(self, n):
+        """(type, key, flags, release time, id, url, manifest sha1 or None) for record n"""
+        k0, k1, k2, vtype, flags, release_time, id_off, id_len, url_off, url_len, sha1 = self.RECORD.unpack_from(self._buf, self._offset(n))
+        sha1 = sha1.hex() if any(sha1) else None
+        return vtype, (k0, k1, k2), flags, release_time, self._string(id_off, id_len), self._string(url_off, url_len), sha1
+
+    def __len__(self):
+        return self._releases + self._snapshots
+
+    def find(self, version):
+        """Record number for a version id, or None"""
+        count = self._releases + self._snapshots
+        i = self._bisect(0, count, lambda i: self._id(self._id_at(i)), version)
+        if i < count and self._id(self._id_at(i)) == version:
+            return self._id_at(i)
+        return None
+
+    def release_ids(self, start=0, end=None):
+        end = self._releases if end is None else end
+        return [self._id(n) for n in range(start, end)]
+
+    def snapshot_ids(self, start=0, end=None):
+        end = self._snapshots if end is None else end
+        return [self._id(self._releases + n) for n in range(start, end)]
+
+    def bisect_release(self, key, right=False):
+        return self._bisect(0, self._releases, self._key, tuple(key), right)
+
+    def bisect_snapshot_time(self, release_time, right=False):
+        return self._bisect(0, self._snapshots, lambda n: self._time(self._releases + n), release_time, right)
+
 
 class MCVersions(object):
     """See https://wiki.vg/Game_files for manifest details"""
@@ -217,65 +1513,96 @@ class MCVersions(object):
     OLD_ALPHA='old_alpha'
     OLD_BETA='old_beta'
 
+    STATE_FILE = 'version-state.json'
+
     def __init__(self, admin, manifest):
         self._valid = False
         self._admin = admin
+        self._raw_manifest = manifest
         self._manifest = None
-        self._versions = {}
+        self._index = None
         self._manifests = {}
         self._latest = None
 
         if manifest is not None:
-            try:
-                self._manifest = json.loads(manifest)
-            except Exception as ex:
-                error_msg("Failed to parse version manifest: {}".format(str(ex)))
+            self._index = self._load_index()
+            if self._index is None:
                 return
-            self._parse_manifest()
+            self._latest = {MCVersions.RELEASE: self._index.latest_release,
+                            MCVersions.SNAPSHOT: self._index.latest_snapshot}
+            self._valid = True
 
     def _parse_manifest(self):
-        self._failed = False
-        versions = {MCVersions.RELEASE: {}, MCVersions.SNAPSHOT: {}}
-        if 'latest' in self._manifest and 'release' in self._manifest['latest'] and 'snapshot' in self._manifest['latest']:
-            self._latest = self._manifest['latest']
-        else:
+        try:
+            self._manifest = json.loads(self._raw_manifest)
+        except Exception as ex:
+            error_msg("Failed to parse version manifest: {}", str(ex))
+            return False
+
+        if 'latest' not in self._manifest or 'release' not in self._manifest['latest'] or 'snapshot' not in self._manifest['latest']:
             error_msg("Missing or incomplete latest version definition in Mojang release manifest")
-            return
+            return False
 
-        if 'versions' in self._manifest:
-            for entry in self._manifest['versions']:
-                if entry['type'] == MCVersions.OLD_ALPHA or entry['type'] == MCVersions.OLD_BETA:
-                    continue
-                versions[entry['type']][entry['id']] = entry['url']
-        else:
+        if 'versions' not in self._manifest:
             error_msg("No versions found in Mojang release manifest")
-            return
+            return False
 
-        self._versions = versions
-        self._valid = True
+        return True
+
+    def _load_index(self):
+        """
+        Load the precompiled index for this manifest, building and caching it
+        the first time a given manifest (by hash) is seen.
+        """
+        local = 'version-index-{}.bin'.format(hashlib.sha1(self._raw_manifest).hexdigest())
+        if self._admin.is_file_cached(local):
+            try:
+                return MCVersionIndex.load(self._admin.get_cache_path(local))
+            except Exception as ex:
+                warn_msg("Rebuilding unreadable version index [{}]: {}", local, str(ex))
+
+        if not self._parse_manifest():
+            return None
+        try:
+            data = MCVersionIndex.build(self._manifest)
+        except Exception as ex:
+            error_msg("Failed to index version manifest: {}", str(ex))
+            return None
+
+        debug_msg("Built version index [{}]", local)
+        if self._admin.cache_save(local, data):
+            try:
+                return MCVersionIndex.load(self._admin.get_cache_path(local))
+            except Exception as ex:
+                warn_msg("Failed to map version index [{}]: {}", local, str(ex))
+        return MCVersionIndex(data)
 
     def dump_manifest(self):
-        if self._manifest is None:
+        if self._manifest is None and (self._raw_manifest is None or not self._parse_manifest()):
             return
         dump_json(self._manifest)
 
     def dump_latest(self):
-        info_msg("Release : {}".format(self._latest[MCVersions.RELEASE]))
-        info_msg("Snapshot: {}".format(self._latest[MCVersions.SNAPSHOT]))
+        info_msg("Release : {}", self._latest[MCVersions.RELEASE])
+        info_msg("Snapshot: {}", self._latest[MCVersions.SNAPSHOT])
+
+    def _find(self, version):
+        n = self._index.find(version) if self._index is not None else None
+        return self._index.record(n) if n is not None else None
 
     def resolve_version_type(self, version):
-        if version in self._versions[MCVersions.RELEASE]:
-            return MCVersions.RELEASE
-        if version in self._versions[MCVersions.SNAPSHOT]:
-            return MCVersions.SNAPSHOT
-        error_msg("Cannot determine release type for unknown version [{}]".format(version))
-        return None
+        record = self._find(version)
+        if record is None:
+            error_msg("Cannot determine release type for unknown version [{}]", version)
+            return None
+        return MCVersions.RELEASE if record[0] == MCVersionIndex.RELEASE else MCVersions.SNAPSHOT
 
     def _resolve_update_version(self, check):
-        if self.resolve_version_type(check) is None:
-            return False
+        vtype = self.resolve_version_type(check)
+        if vtype is None:
+            return None
 
-        comp = self.get_latest_version(self.resolve_version_type(check))
+        comp = self.get_latest_version(vtype)
         if comp is None:
             return None
 
@@ -312,112 +1639,384 @@ class MCVersions(object):
         return self._latest[release_type]
 
     def get_release_list(self):
-        return self._versions[MCVersions.RELEASE].keys()
+        """Release ids, oldest version first"""
+        return self._index.release_ids()
 
     def get_snapshot_list(self):
-        return self._versions[MCVersions.SNAPSHOT].keys()
+        """Snapshot ids, oldest release time first"""
+        return self._index.snapshot_ids()
+
+    def get_releases_newer_than(self, version):
+        key = MCVersionIndex.parse_release_key(version)
+        if key is None:
+            error_msg("Failed to parse release version: [{}]", version)
+            return []
+        return self._index.release_ids(self._index.bisect_release(key, right=True))
+
+    def get_latest_patch(self, release):
+        """Latest release in the same major.minor line as release, e.g. '1.20' -> '1.20.6'"""
+        key = MCVersionIndex.parse_release_key(release)
+        if key is None:
+            error_msg("Failed to parse release version: [{}]", release)
+            return None
+        n = self._index.bisect_release((key[0], key[1] + 1, 0)) - 1
+        if n < 0:
+            return None
+        vtype, found, flags, release_time, vid, url, sha1 = self._index.record(n)
+        return vid if found[:2] == key[:2] else None
 
-    def _parse_release_version(self, version):
-        if self.resolve_version_type(version) != MCVersions.RELEASE:
-            return 0, 0, 0
+    def get_snapshots_between(self, start, end):
+        """Snapshots released between start and end (ISO 8601 strings, datetimes or epoch seconds), inclusive"""
+        lo = self._index.bisect_snapshot_time(MCVersionIndex.parse_time(start))
+        hi = self._index.bisect_snapshot_time(MCVersionIndex.parse_time(end), right=True)
+        return self._index.snapshot_ids(lo, hi)
 
-        m = re.match('^\s*(?P<major>\d+)\.(?P<minor>\d+)(\.(?P<revision>\d+))?\s*$', version)
-        if m is None:
-            error_msg("Failed to parse release version: [{}]".format(version))
+    def parse_version(self, version):
+        record = self._find(version)
+        if record is None:
+            error_msg("Cannot determine release type for unknown version [{}]", version)
             return 0, 0, 0
 
-        rev = m.group('revision') if m.group('revision') is not None else 0
-        return m.group('major'), m.group('minor'), rev
+        vtype, key, flags, release_time, vid, url, sha1 = record
+        if vtype == MCVersionIndex.RELEASE:
+            if not flags & MCVersionIndex.KEYED:
+                error_msg("Failed to parse release version: [{}]", version)
+                return 0, 0, 0
+            return key
 
-    def _parse_snapshot_version(self, version):
-        if self.resolve_version_type(version) != MCVersions.SNAPSHOT:
+        if not flags & MCVersionIndex.KEYED:
+            error_msg("Failed to parse snapshot version: [{}]", version)
             return 0, 0, 'a'
+        return key[0], key[1], chr(key[2])
 
-        m = re.match('^\s*(?P<major>\d+)w(?P<minor>\d+)(?P<revision>[a-z])\s*$', version)
-        if m is None:
-            error_msg("Failed to parse snapshot version: [{}]".format(version))
-            return 0, 0, 'a'
+    def version_url(self, version):
+        record = self._find(version)
+        if record is None:
+            error_msg("Cannot determine URL for unknown version [{}]", version)
+            return None
+        return record[5]
 
-        return m.group('major'), m.group('minor'), m.group('revision')
+    def get_delta(self, commit=True):
+        """
+        Compare this manifest against the state recorded by the last call and
+        return an MCVersionDelta, comparing each entry's sha1 and time. An
+        unchanged manifest is recognized by its hash alone. With commit, the
+        current state is recorded and stored per-version manifests of changed
+        or removed versions are dropped.
+        """
+        digest = hashlib.sha1(self._raw_manifest).hexdigest()
+        state = None
+        if self._admin.is_file_cached(MCVersions.STATE_FILE):
+            try:
+                state = json.loads(self._admin.cache_load(MCVersions.STATE_FILE))
+            except Exception as ex:
+                warn_msg("Ignoring unreadable version state: {}", str(ex))
 
-    def parse_version(self, version):
-        vtype = self.resolve_version_type(version)
-        if vtype is None:
-            return 0, 0, 0
+        if state is not None and state.get('manifest_sha1') == digest:
+            debug_msg("Version manifest [{}] is unchanged", digest)
+            return MCVersionDelta()
 
-        if vtype == MCVersions.RELEASE:
-            return self._parse_release_version(version)
-        return self._parse_snapshot_version(version)
+        if self._manifest is None and not self._parse_manifest():
+            return None
 
-    def version_url(self, version):
-        if version in self._versions[MCVersions.RELEASE]:
-            return self._versions[MCVersions.RELEASE][version]
-        if version in self._versions[MCVersions.SNAPSHOT]:
-            return self._versions[MCVersions.SNAPSHOT][version]
-        error_msg("Cannot determine URL for unknown version [{}]".format(version))
-        return None
+        current = {}
+        for entry in self._manifest['versions']:
+            if entry['type'] in (MCVersions.RELEASE, MCVersions.SNAPSHOT):
+                current[entry['id']] = [entry.get('sha1'), entry.get('time')]
+
+        if state is None:
+            delta = MCVersionDelta(added=list(current), initial=True)
+        else:
+            previous = state['versions']
+            delta = MCVersionDelta(added=[vid for vid in current if vid not in previous],
+                                   removed=[vid for vid in previous if vid not in current],
+                                   changed=[vid for vid in current if vid in previous and current[vid] != previous[vid]])
+
+        if commit:
+            for vid in delta.removed + delta.changed:
+                self._manifests.pop(vid, None)
+                self._admin.get_manifest_store().remove(vid)
+            if not self._admin.cache_save(MCVersions.STATE_FILE, json.dumps({'manifest_sha1': digest, 'versions': current}).encode()):
+                return None
+
+        return delta
+
+    def _fetch_version_manifest(self, record):
+        """Download a per-version manifest into the manifest store, verifying it against the version manifest's sha1"""
+        vtype, key, flags, release_time, version, url, sha1 = record
+        store = self._admin.get_manifest_store()
+        with self._admin.lock_resource('manifest:' + version):
+            if store.contains(version, sha1):
+                return store.load(version)
+
+            debug_msg("Retrieving version [{}] manifest [{}]...", version, url)
+            try:
+                content = get_url(url, session=self._admin.get_session())
+            except Exception as ex:
+                error_msg("Failed to retrieve url[{}]: {}", url, str(ex))
+                return None
+            if content is None:
+                return None
+
+            if sha1 is not None and hashlib.sha1(content).hexdigest() != sha1:
+                error_msg("Version [{}] manifest does not match its sha1 [{}]", version, sha1)
+                return None
+
+            try:
+                vtype = MCVersions.RELEASE if vtype == MCVersionIndex.RELEASE else MCVersions.SNAPSHOT
+                return store.save(version, vtype, release_time, sha1, content)
+            except Exception as ex:
+                error_msg("Failed to store version [{}] manifest: {}", version, str(ex))
+                return None
 
     def get_version(self, version):
         if version in self._manifests:
             return self._manifests[version]
 
-        url = self.version_url(version)
-        if url is None:
-            error_msg("Unrecognized version [{}]".format(version))
+        record = self._find(version)
+        if record is None:
+            error_msg("Unrecognized version [{}]", version)
             return None
 
-        manifest = self._admin.get_url_and_cache(url, 'version-{}.json'.format(version))
+        store = self._admin.get_manifest_store()
+        manifest = store.load(version) if store.contains(version, record[6]) else None
+        if manifest is None:
+            manifest = self._fetch_version_manifest(record)
         if manifest is None:
             return None
 
+        release = MCVersion(self._admin, version, manifest)
+        self._manifests[version] = release
+        return release
+
+    @log.timing('store_manifests', mclog.INFO)
+    def store_manifests(self, versions=None, workers=MCADMIN_PREFETCH_WORKERS):
+        """
+        Bulk-fill the manifest store with the per-version manifests of the
+        given versions (all releases and snapshots by default), fetching at
+        most workers at a time. Versions already stored with a matching sha1
+        are skipped. Returns True if every manifest is now stored.
+        """
+        import concurrent.futures
+        if not self._valid:
+            error_msg("Cannot store manifests without a valid version manifest")
+            return False
+
+        store = self._admin.get_manifest_store()
+        wanted = set(versions) if versions is not None else None
+        records = [self._index.record(n) for n in range(len(self._index))]
+        missing = [record for record in records
+                   if (wanted is None or record[4] in wanted) and not store.contains(record[4], record[6])]
+        if wanted is not None:
+            for version in wanted.difference(record[4] for record in records):
+                error_msg("Unrecognized version [{}]", version)
+
+        info_msg("Fetching {} version manifest(s)...", len(missing))
         try:
-            manifest = json.loads(manifest)
-        except Exception as ex:
-            error_msg("Failed to parse version [{}] manifest: {}".format(version, str(ex)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+                failed = sum(1 for manifest in pool.map(self._fetch_version_manifest, missing) if manifest is None)
+        finally:
+            # Releases the connections the worker threads opened
+            store.close()
+        if failed:
+            error_msg("Failed to store {} version manifest(s)", failed)
+        return not failed and (wanted is None or wanted.issubset(record[4] for record in records))
+
+    def get_versions_with_library(self, library):
+        return self._admin.get_manifest_store().get_versions_with_library(library)
+
+    def get_download_size(self, start, end):
+        """Download size breakdown for the stored versions released from start to end, inclusive"""
+        first = self._find(start)
+        last = self._find(end)
+        if first is None or last is None:
+            error_msg("Unrecognized version range [{}..{}]", start, end)
             return None
+        return self._admin.get_manifest_store().get_download_size(first[3], last[3])
 
-        release = MCVersion(admin, version, manifest)
-        if release is not None:
-            self._manifests[version] = release
 
-        return release
+class MCProfileResolver(object):
+    """
+    Resolves player names to uuids through the bulk profiles endpoint, in
+    batches of at most MCADMIN_PROFILE_BATCH_SIZE names per request. Results
+    are cached in the cache directory: known names for MCADMIN_PROFILE_TTL,
+    unknown names for MCADMIN_PROFILE_NEGATIVE_TTL. Names whose request
+    failed are not cached, so they are retried on the next lookup.
+    """
+
+    CACHE_FILE = 'profiles.json'
+    VALID_NAME = re.compile(r'^[A-Za-z0-9_]{1,25}$')
+
+    def __init__(self, admin, url=None, batch_size=None, workers=None):
+        self._admin = admin
+        self._url = url if url is not None else MOJANG_PROFILES_URL
+        self._batch_size = batch_size if batch_size is not None else MCADMIN_PROFILE_BATCH_SIZE
+        self._workers = workers if workers is not None else MCADMIN_PROFILE_WORKERS
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _get_cache_path(self):
+        return self._admin.get_cache_path(self.CACHE_FILE)
+
+    def _read_cache(self):
+        path = self._get_cache_path()
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path, 'r') as fp:
+                return json.load(fp)
+        except Exception as ex:
+            warn_msg("Ignoring unreadable profile cache [{}]: {}", path, str(ex))
+            return {}
+
+    @staticmethod
+    def _is_fresh(entry, now):
+        ttl = MCADMIN_PROFILE_TTL if entry.get('uuid') else MCADMIN_PROFILE_NEGATIVE_TTL
+        return now - entry.get('fetched', 0) < ttl
+
+    def _missing(self, keys, now):
+        return [key for key in keys if key not in self._entries or not self._is_fresh(self._entries[key], now)]
+
+    def _save(self, updates):
+        with mcfs.file_lock(self._admin.get_lock_path('profiles')):
+            # Merge with what other processes resolved meanwhile, dropping expired entries
+            entries = self._read_cache()
+            entries.update(updates)
+            now = time.time()
+            entries = {key: entry for key, entry in entries.items() if self._is_fresh(entry, now)}
+            content = json.dumps(entries, indent=1, sort_keys=True).encode()
+            try:
+                mcfs.atomic_write(self._get_cache_path(), content)
+            except Exception as ex:
+                error_msg("Failed to save profile cache [{}]: {}", self._get_cache_path(), str(ex))
+                return False
+        self._entries = entries
+        return self._admin.get_cache().add(self.CACHE_FILE, len(content))
+
+    def _fetch_batch(self, names):
+        """Look up one batch of names; returns a mapping of lower case name to cache entry, or None on failure"""
+        session = self._admin.get_session()
+        debug_msg("Resolving {} player names...", len(names))
+        for attempt in range(MCADMIN_HTTP_RETRIES + 1):
+            try:
+                r = session.post(self._url, json=names, timeout=MCADMIN_HTTP_TIMEOUT)
+            except Exception as ex:
+                error_msg("Failed to resolve player names at [{}]: {}", self._url, str(ex))
+                return None
+            if r.status_code != 429 or attempt == MCADMIN_HTTP_RETRIES:
+                break
+            try:
+                delay = float(r.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                delay = 2 ** attempt
+            warn_msg("Profile lookups are rate limited; retrying in {} seconds", delay)
+            time.sleep(delay)
+
+        if r.status_code != 200:
+            error_msg("Failed to resolve player names at [{}]: http status {}", self._url, r.status_code)
+            return None
+        try:
+            profiles = r.json()
+        except ValueError as ex:
+            error_msg("Unreadable profile lookup response from [{}]: {}", self._url, str(ex))
+            return None
+        if type(profiles) != type([]):
+            error_msg("Unexpected profile lookup response from [{}]", self._url)
+            return None
+
+        now = time.time()
+        found = {name: {'uuid': None, 'name': name, 'fetched': now} for name in names}
+        for profile in profiles:
+            if type(profile) != type({}) or not isinstance(profile.get('id'), str) or not isinstance(profile.get('name'), str):
+                continue
+            uuid = format_uuid(profile['id'])
+            if uuid is not None:
+                found[profile['name'].lower()] = {'uuid': uuid, 'name': profile['name'], 'fetched': now}
+        return found
+
+    @log.timing('resolve_names', mclog.INFO)
+    def resolve(self, names):
+        """
+        Map each of names to its dashed uuid, or None if the name is unknown,
+        invalid or could not be looked up. Only names missing from the cache
+        (or expired) are requested.
+        """
+        import concurrent.futures
+        keys = []
+        for name in names:
+            if not isinstance(name, str) or not self.VALID_NAME.match(name):
+                warn_msg("Not a valid player name [{}]", name)
+            elif name.lower() not in keys:
+                keys.append(name.lower())
+
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read_cache()
+            now = time.time()
+            missing = self._missing(keys, now)
+            if missing:
+                # Another process may have resolved these already
+                self._entries = self._read_cache()
+                missing = self._missing(keys, now)
+            if missing:
+                batches = [missing[n:n + self._batch_size] for n in range(0, len(missing), self._batch_size)]
+                updates = {}
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as pool:
+                    for found in pool.map(self._fetch_batch, batches):
+                        if found is not None:
+                            updates.update(found)
+                if updates:
+                    self._entries.update(updates)
+                    self._save(updates)
+                info_msg("Resolved {} of {} player names in {} requests",
+                    sum(1 for key in missing if updates.get(key, {}).get('uuid')), len(missing), len(batches))
+            entries = self._entries
+
+        result = {}
+        for name in names:
+            entry = entries.get(name.lower()) if isinstance(name, str) else None
+            result[name] = entry.get('uuid') if entry is not None else None
+        return result
 
 
 class MCAdmin(object):
-    CORE_DIRS = ['cache', 'versions', 'worlds', 'conf']
+    CORE_DIRS = ['cache', 'versions', 'worlds', 'conf', 'store']
 
     def __init__(self):
         self._working_dir = os.getcwd()
         self._working_dir_resolved = False
         self._working_dir_cli_arg = False
         self._versions = None
+        self._session = None
+        self._store = None
+        self._cache = None
+        self._manifest_store = None
+        self._profile_resolver = None
+        self._session_lock = threading.Lock()
 
     def _resolve_working_dir(self):
         if not self._working_dir_resolved:
             if not self._working_dir_cli_arg:
-                if MCADMIN_WORKDIR_ENV_VAR in os.environ:
-                    self._working_dir = os.environ[MCADMIN_WORKDIR_ENV_VAR]
-                else:
-                    self._working_dir = '~/mcadmin'
+                self._working_dir = get_default_working_dir()
         self._working_dir_resolved = True
 
     def is_init(self):
         basedir = self.get_working_dir()
         init = True
         if not os.path.exists(basedir):
-            warn_msg("MCAdmin working directory [{}] does not exist.".format(basedir))
+            warn_msg("MCAdmin working directory [{}] does not exist.", basedir)
             init = False
         elif not os.path.isdir(basedir):
-            error_msg("MCAdmin working directory [{}] is not a directory.".format(basedir))
+            error_msg("MCAdmin working directory [{}] is not a directory.", basedir)
             return False
         else:
             for sub in self.CORE_DIRS:
                 subdir = os.path.join(basedir, sub)
                 if not os.path.exists(subdir):
-                    warn_msg("MCAdmin working directory [{}] was not found.".format(subdir))
+                    warn_msg("MCAdmin working directory [{}] was not found.", subdir)
                     init = False
         if not init:
-            info_msg("MCAdmin is not initialized in working directory [{}].".format(basedir))
+            info_msg("MCAdmin is not initialized in working directory [{}].", basedir)
             info_msg("Please run 'mcadmin init' to initialize MCAdmin")
         return init
 
@@ -425,16 +2024,16 @@ class MCAdmin(object):
         basedir = self.get_working_dir()
         if not os.path.exists(basedir):
             if not make_dirs(basedir):
-                error_msg("Failed to create base working directory [{}]".format(basedir))
+                error_msg("Failed to create base working directory [{}]", basedir)
                 return False
         elif not os.path.isdir(basedir):
-            error_msg("MCAdmin working directory [{}] is not a directory.".format(basedir))
+            error_msg("MCAdmin working directory [{}] is not a directory.", basedir)
             return False
 
         for sub in self.CORE_DIRS:
             subdir = os.path.join(basedir, sub)
             if not make_dirs(subdir):
-                error_msg("Failed to create working subdir [{}]".format(subdir))
+                error_msg("Failed to create working subdir [{}]", subdir)
                 return False
 
         # TODO - copy configuration templates
@@ -465,6 +2064,83 @@ class MCAdmin(object):
             return os.path.join(self.get_working_dir(), 'versions', version)
         return os.path.join(self.get_working_dir(), 'versions')
 
+    def get_store_dir(self):
+        return os.path.join(self.get_working_dir(), 'store')
+
+    def get_store(self):
+        if self._store is None:
+            self._store = MCStore(self)
+        return self._store
+
+    def get_assets_dir(self):
+        return os.path.join(self.get_working_dir(), 'assets')
+
+    def get_libraries_dir(self):
+        return os.path.join(self.get_working_dir(), 'libraries')
+
+    def mirror(self, versions, workers=MCADMIN_MIRROR_WORKERS, verify=False):
+        """Mirror the assets and libraries of several versions; shared files are only fetched once"""
+        registry = self.get_versions()
+        ok = True
+        for version in versions:
+            release = registry.get_version(version)
+            if release is None or not release.mirror(workers, verify):
+                error_msg("Failed to mirror version [{}]", version)
+                ok = False
+        return ok
+
+    def get_manifest_store(self):
+        if self._manifest_store is None:
+            self._manifest_store = MCManifestStore(self)
+        return self._manifest_store
+
+    def close(self):
+        """
+        Save the cache index updates and metrics recorded by this process and
+        release the resources held for this working directory (manifest store
+        connections)
+        """
+        if self._cache is not None:
+            self._cache.flush()
+        self.flush_metrics()
+        if self._manifest_store is not None:
+            self._manifest_store.close()
+
+    def get_metrics_path(self):
+        return os.path.join(self.get_working_dir(), mcmetrics.METRICS_FILE)
+
+    def flush_metrics(self):
+        """Merge the metrics recorded by this process into the working directory's metrics file"""
+        try:
+            return metrics.flush(self.get_metrics_path())
+        except Exception as ex:
+            error_msg("Failed to save metrics [{}]: {}", self.get_metrics_path(), str(ex))
+            return False
+
+    def get_metrics(self):
+        """Metrics recorded so far by every process using this working directory, including this one"""
+        return mcmetrics.merge_snapshots(mcmetrics.load(self.get_metrics_path()), metrics.snapshot())
+
+    def reset_metrics(self):
+        metrics.snapshot(reset=True)
+        try:
+            os.remove(self.get_metrics_path())
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            error_msg("Failed to reset metrics [{}]: {}", self.get_metrics_path(), str(ex))
+            return False
+        return True
+
+    def get_profile_resolver(self):
+        if self._profile_resolver is None:
+            self._profile_resolver = MCProfileResolver(self)
+        return self._profile_resolver
+
+    def resolve_names(self, names):
+        """Map player names to uuids; see MCProfileResolver.resolve()"""
+        return self.get_profile_resolver().resolve(names)
+
     def get_config_dir(self):
         return os.path.join(self.get_working_dir(), 'conf')
 
@@ -473,84 +2149,446 @@ class MCAdmin(object):
             return os.path.join(self.get_working_dir(), 'worlds', instance)
         return os.path.join(self.get_working_dir(), 'worlds')
 
+    def get_backups_dir(self, instance):
+        if instance is not None:
+            return os.path.join(self.get_working_dir(), 'backups', instance)
+        return os.path.join(self.get_working_dir(), 'backups')
+
+    def get_maps_dir(self, instance):
+        if instance is not None:
+            return os.path.join(self.get_working_dir(), 'maps', instance)
+        return os.path.join(self.get_working_dir(), 'maps')
+
+    def get_index_path(self, instance):
+        return os.path.join(self.get_working_dir(), 'index', '{}.json'.format(instance))
+
+    def get_instances(self):
+        """Names of the server instances under worlds/, sorted; none if worlds/ does not exist yet"""
+        worlds_dir = self.get_worlds_dir(None)
+        if not os.path.isdir(worlds_dir):
+            return []
+        return sorted(name for name in os.listdir(worlds_dir) if os.path.isdir(os.path.join(worlds_dir, name)))
+
+    def find_player(self, ident):
+        """[(instance, player entry)] of a player name or uuid, from the refreshed world indexes"""
+        found = []
+        for instance in self.get_instances():
+            index = MCWorld(self, instance).get_index()
+            found.extend((instance, player) for player in index.find_player(ident))
+        return found
+
+    def find_worlds(self, version=None):
+        """[(instance, world directory, level entry)] of all world saves, or of those on version"""
+        found = []
+        for instance in self.get_instances():
+            for world, level in sorted(MCWorld(self, instance).get_index().get_worlds().items()):
+                if version is None or level.get('version') == version:
+                    found.append((instance, world, level))
+        return found
+
     def get_url(self, url, dump=False):
-        r = requests.get(url)
+        import pprint
+        r = self.get_session().get(url, timeout=MCADMIN_HTTP_TIMEOUT)
         if r.status_code != 200:
-            error_msg("Failed to retrieve url[{}]: http status {}".format(url, r.status_code))
+            error_msg("Failed to retrieve url[{}]: http status {}", url, r.status_code)
             return False
         if dump:
             pp = pprint.PrettyPrinter(indent=4)
             pp.pprint(r.json())
         return True
 
-    def clear_cache(self):
-        # TODO
-        pass
+    def get_session(self):
+        """
+        The shared HTTP session used for every fetch. Connections are pooled
+        and kept alive across requests, and transient connection failures and
+        5xx responses are retried with backoff.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        with self._session_lock:
+            if self._session is None:
+                retry = Retry(total=MCADMIN_HTTP_RETRIES,
+                              backoff_factor=0.5,
+                              status_forcelist=(500, 502, 503, 504),
+                              allowed_methods=frozenset(['GET', 'HEAD']))
+                adapter = HTTPAdapter(pool_connections=MCADMIN_HTTP_POOL_SIZE,
+                                      pool_maxsize=MCADMIN_HTTP_POOL_SIZE,
+                                      max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+        return self._session
+
+    @log.timing('prefetch', mclog.INFO)
+    def prefetch(self, versions, artifacts=('manifest', 'server', 'client'), workers=MCADMIN_PREFETCH_WORKERS):
+        """
+        Fetch the manifests and jars for a list of versions concurrently over
+        the shared session, using at most workers threads. Artifact downloads
+        for a version are queued as soon as its manifest is available.
+        Returns True if everything requested was fetched.
+        """
+        import concurrent.futures
+        downloads = {'server': MCVersion.get_server_jar, 'client': MCVersion.download_client_jar}
+        registry = self.get_versions()
+        if not registry._valid:
+            error_msg("Cannot prefetch without a valid version manifest")
+            return False
+
+        failed = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = {pool.submit(registry.get_version, version): (version, 'manifest') for version in versions}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    version, artifact = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as ex:
+                        error_msg("Failed to prefetch {} for version [{}]: {}", artifact, version, str(ex))
+                        result = None
+                    if not result:
+                        failed.append((version, artifact))
+                        continue
+                    if artifact == 'manifest':
+                        for name in artifacts:
+                            if name in downloads:
+                                pending[pool.submit(downloads[name], result)] = (version, name)
+
+        info_msg("Prefetched {} version(s); {} failure(s)", len(versions), len(failed))
+        for version, artifact in failed:
+            error_msg("Failed to prefetch {} for version [{}]", artifact, version)
+        return not failed
+
+    def gc_store(self):
+        return self.get_store().gc()
+
+    def get_cache(self):
+        if self._cache is None:
+            self._cache = MCCache(self)
+        return self._cache
+
+    def get_cache_stats(self):
+        return self.get_cache().get_stats()
+
+    def poll_versions(self, prefetch=None):
+        """
+        Refresh the version manifest and return what changed since the last
+        poll. With prefetch (a tuple of artifacts, as for prefetch()), the
+        added and changed versions are fetched; the first poll only records
+        the baseline.
+        """
+        registry = self.get_versions()
+        if not registry._valid:
+            error_msg("Cannot poll versions without a valid version manifest")
+            return None
+
+        delta = registry.get_delta()
+        if delta is None:
+            return None
+        if prefetch and delta and not delta.initial:
+            self.prefetch(delta.added + delta.changed, artifacts=prefetch)
+        return delta
+
+    def _resolve_missing_uuids(self, lists):
+        """Fill in missing uuids across several property lists, resolving all their names together"""
+        names = []
+        for prop_type, props in lists.items():
+            names.extend(mcpropmerge.missing_uuid_names(props, prop_type))
+        if not names:
+            return lists
+        uuids = self.resolve_names(names)
+        return {prop_type: mcpropmerge.fill_uuids(props, prop_type, lambda missing: uuids)
+                for prop_type, props in lists.items()}
+
+    def _sync_instance(self, instance, global_props, resolve=True):
+        results = {}
+        instance_dir = self.get_worlds_dir(instance)
+        local_props = {}
+        for prop_type in global_props:
+            local_path = os.path.join(instance_dir, 'local.{}.json'.format(prop_type))
+            local_props[prop_type] = mcpropmerge.load_props(local_path) if os.path.exists(local_path) else []
+        if resolve:
+            local_props = self._resolve_missing_uuids({prop_type: props for prop_type, props in local_props.items()
+                                                       if props is not None})
+
+        for prop_type, plist in global_props.items():
+            l_props = local_props.get(prop_type)
+            if l_props is None:
+                results[prop_type] = 'failed'
+                continue
+
+            with metrics.time('mcadmin_merge_seconds', type=prop_type):
+                merged = plist.merge(l_props)
+                content = plist.dump(merged).encode()
+            metrics.inc('mcadmin_merge_entries_total', len(merged), type=prop_type)
+            target = os.path.join(instance_dir, '{}.json'.format(prop_type))
+            try:
+                with open(target, 'rb') as fp:
+                    current = hashlib.sha1(fp.read()).hexdigest()
+            except FileNotFoundError:
+                current = None
+
+            if current == hashlib.sha1(content).hexdigest():
+                results[prop_type] = 'unchanged'
+                continue
+            try:
+                mcfs.atomic_write(target, content)
+                results[prop_type] = 'updated'
+            except Exception as ex:
+                error_msg("Failed to write [{}]: {}", target, str(ex))
+                results[prop_type] = 'failed'
+
+        for prop_type, result in results.items():
+            metrics.inc('mcadmin_merges_total', type=prop_type, result=result)
+        return results
+
+    @log.timing('sync_properties', mclog.INFO)
+    def sync_properties(self, instances=None, workers=MCADMIN_SYNC_WORKERS, resolve=True):
+        """
+        Merge the global property lists in conf/ into every instance under
+        worlds/ (or just the given instances), in parallel. The global lists
+        are parsed, indexed and serialized once; an instance file is only
+        rewritten when its merged content changed. With resolve, entries
+        added by name only get their uuid looked up first. Returns a
+        per-instance mapping of property type to 'updated', 'unchanged' or
+        'failed'.
+        """
+        import concurrent.futures
+        loaded = {}
+        for prop_type in mcpropmerge.PROP_FILES:
+            path = os.path.join(self.get_config_dir(), '{}.json'.format(prop_type))
+            props = mcpropmerge.load_props(path) if os.path.exists(path) else []
+            if props is None:
+                error_msg("Cannot sync with unreadable global properties [{}]", path)
+                return None
+            loaded[prop_type] = props
+        if resolve:
+            loaded = self._resolve_missing_uuids(loaded)
+        global_props = {prop_type: mcpropmerge.PropList(props, prop_type) for prop_type, props in loaded.items()}
+
+        if instances is None:
+            instances = self.get_instances()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            summary = dict(zip(instances, pool.map(lambda instance: self._sync_instance(instance, global_props, resolve), instances)))
+
+        for instance, results in summary.items():
+            updated = [prop_type for prop_type, result in results.items() if result == 'updated']
+            failed = [prop_type for prop_type, result in results.items() if result == 'failed']
+            info_msg("{}: {} updated{}{}", instance, len(updated), ' ({})'.format(', '.join(updated)) if updated else '',
+                                                 '; failed: {}'.format(', '.join(failed)) if failed else '')
+        return summary
+
+    def clear_cache(self, pinned=False):
+        info_msg("Clearing cache [{}]...", self.get_cache_dir())
+        return self.get_cache().clear(pinned)
 
     def is_file_cached(self, filename):
-        path = self.get_cache_path(filename)
-        cached = os.path.exists(path) and os.path.isfile(path)
-        debug_msg("File [{}] is {}cached".format(filename, '' if cached else 'not '))
+        cached = self.get_cache().lookup(filename)
+        debug_msg("File [{}] is {}cached", filename, '' if cached else 'not ')
         return cached
 
+    def get_lock_path(self, name):
+        lock_dir = self.get_cache_path('.locks')
+        make_dirs(lock_dir)
+        return os.path.join(lock_dir, '{}.lock'.format(name))
+
+    def lock_resource(self, key):
+        """
+        Exclusive lock on a named resource, shared by every thread and mcadmin
+        process using this working directory. Keys hash onto a fixed set of
+        lock files, so unrelated keys may occasionally share a lock; callers
+        must not hold one resource lock while taking another.
+        """
+        stripe = zlib.crc32(key.encode()) % MCADMIN_LOCK_STRIPES
+        return mcfs.file_lock(self.get_lock_path('{:02x}'.format(stripe)))
+
+    def get_cache_meta_path(self, filename):
+        return self.get_cache_path(filename + '.meta.json')
+
+    def cache_load_meta(self, filename):
+        path = self.get_cache_meta_path(filename)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'r') as fp:
+                return json.load(fp)
+        except Exception as ex:
+            warn_msg("Ignoring unreadable cache metadata [{}]: {}", path, str(ex))
+            return None
+
+    def cache_save_meta(self, filename, meta):
+        try:
+            mcfs.atomic_write(self.get_cache_meta_path(filename), json.dumps(meta, indent=4).encode())
+        except Exception as ex:
+            error_msg("Failed to save cache metadata [{}]: {}", filename, str(ex))
+            return False
+        return True
+
     def get_cache_timestamp(self, filename):
+        """Time the cached file was last fetched or revalidated, or None if unknown"""
+        meta = self.cache_load_meta(filename)
+        if meta is not None and 'fetched' in meta:
+            return meta['fetched']
+        if self.get_cache().contains(filename):
+            return os.path.getmtime(self.get_cache_path(filename))
         return None
 
-    def cache_save(self, filename, content):
+    def cache_save(self, filename, content, meta=None):
+        """Cache content as filename, along with its metadata if given"""
         try:
-            with open(self.get_cache_path(filename), 'wb') as fp:
-                fp.write(content)
+            mcfs.atomic_write(self.get_cache_path(filename), content)
         except Exception as ex:
-            error_msg("Failed to save cache file [{}]: {}".format(filename, str(ex)))
+            error_msg("Failed to save cache file [{}]: {}", filename, str(ex))
             return False
-        return True
+        if meta is not None:
+            self.cache_save_meta(filename, meta)
+        return self.get_cache().add(filename, len(content))
 
     def cache_load(self, filename):
         try:
             with open(self.get_cache_path(filename), 'rb') as fp:
                 return fp.read()
         except Exception as ex:
-            error_msg("Failed to load cache file [{}]: {}".format(filename, str(ex)))
+            error_msg("Failed to load cache file [{}]: {}", filename, str(ex))
             return None
 
-    def get_url_and_cache(self, url, local, timeout=None):
-        refresh = False
-
-        debug_msg("Get url [{}] and cache as [{}]".format(url, local))
-        if timeout is True:
-            debug_msg("Caller forced cache refresh")
-            refresh = True
-        elif not self.is_file_cached(local):
+    def _cache_lookup(self, local, timeout, requested, count=True):
+        """
+        Return (content, meta) for local if the cached copy is usable under
+        timeout, or (None, meta) if it must be (re)fetched. A forced
+        revalidation (timeout True) is satisfied by a copy fetched or
+        revalidated after requested.
+        """
+        cached = self.is_file_cached(local) if count else self.get_cache().contains(local)
+        if not cached:
             debug_msg("File is not yet cached")
-            refresh = True
-        elif timeout is not None and timeout is not True:
-            debug_msg("Evaluate cache timeout...")
-            # TODO - evaluate cache expiry
-            refresh = False
-
-        if refresh:
-            debug_msg("Retrieving [{}]...".format(url))
-            r = requests.get(url)
-            if r.status_code != 200:
-                error_msg("Failed to retrieve url[{}]: http status {}".format(url, r.status_code))
+            return None, None
+
+        meta = self.cache_load_meta(local)
+        if timeout is not None:
+            fetched = meta.get('fetched') if meta is not None else None
+            if timeout is True:
+                if fetched is None or fetched < requested:
+                    return None, meta
+            else:
+                if fetched is None:
+                    fetched = os.path.getmtime(self.get_cache_path(local))
+                age = time.time() - fetched
+                debug_msg("Evaluate cache timeout: age {} of {} seconds", age, timeout)
+                if age >= timeout:
+                    return None, meta
+
+        content = self.cache_load(local)
+        if content is None:
+            return None, meta
+        if meta is not None and meta.get('sha1') is not None and hashlib.sha1(content).hexdigest() != meta['sha1']:
+            warn_msg("Cached file [{}] does not match its recorded hash; refreshing", local)
+            self.get_cache().evict(local)
+            return None, None
+        return content, meta
+
+    def _cache_refresh(self, url, local, meta):
+        headers = {}
+        if meta is not None and meta.get('url') == url:
+            if meta.get('etag') is not None:
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified') is not None:
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        debug_msg("Retrieving [{}]{}...", url, ' (conditional)' if headers else '')
+        started = time.perf_counter()
+        try:
+            r = self.get_session().get(url, headers=headers, timeout=MCADMIN_HTTP_TIMEOUT)
+        except Exception as ex:
+            r = None
+            error_msg("Failed to retrieve url[{}]: {}", url, str(ex))
+        metrics.observe('mcadmin_cache_fetch_seconds', time.perf_counter() - started)
+        if headers and r is not None and r.status_code in (200, 304):
+            metrics.inc('mcadmin_cache_revalidations_total', result='not_modified' if r.status_code == 304 else 'modified')
+
+        if r is not None and r.status_code == 304 and meta is not None:
+            debug_msg("Cached [{}] is still current", local)
+            content = self.cache_load(local)
+            if content is None:
                 return False
+            meta['fetched'] = time.time()
+            self.cache_save_meta(local, meta)
+        elif r is not None and r.status_code == 200:
             content = r.content
-            if not self.cache_save(local, content):
+            metrics.inc('mcadmin_cache_fetch_bytes_total', len(content))
+            if not self.cache_save(local, content, {'url': url,
+                                                    'fetched': time.time(),
+                                                    'etag': r.headers.get('ETag'),
+                                                    'last_modified': r.headers.get('Last-Modified'),
+                                                    'sha1': hashlib.sha1(content).hexdigest(),
+                                                    'size': len(content)}):
                 return False
         else:
-            debug_msg("From cache [{}]".format(local))
+            if r is not None:
+                error_msg("Failed to retrieve url[{}]: http status {}", url, r.status_code)
+            stale = self.get_cache().contains(local)
+            metrics.inc('mcadmin_cache_fetch_errors_total', stale='true' if stale else 'false')
+            if not stale:
+                return False
+            warn_msg("Using stale cached copy of [{}]", local)
             content = self.cache_load(local)
             if content is None:
                 return False
 
         return content
 
-    def get_version_manifest(self):
+    def get_url_and_cache(self, url, local, timeout=None):
+        """
+        Return the content of url, served from the local cache when possible.
+        timeout is the cache lifetime in seconds: None never expires, True
+        revalidates the cached copy now, whatever its age. Once expired, the
+        cached copy is revalidated with a conditional request, so an
+        unchanged resource costs a 304.
+
+        Fetches are single-flight: concurrent callers (threads or mcadmin
+        processes) that miss on the same file serialize on a lock, and only
+        the first one downloads; the rest read what it cached.
+        """
+        requested = time.time()
+        debug_msg("Get url [{}] and cache as [{}]", url, local)
+        with log.timed('get_url_and_cache', file=local) as op:
+            content, meta = self._cache_lookup(local, timeout, requested)
+            if content is not None:
+                debug_msg("From cache [{}]", local)
+                op.fields['source'] = 'cache'
+                metrics.inc('mcadmin_cache_requests_total', result='hit')
+                return content
+
+            with self.lock_resource(local):
+                content, meta = self._cache_lookup(local, timeout, requested, count=False)
+                if content is not None:
+                    debug_msg("Fetched concurrently; from cache [{}]", local)
+                    op.fields['source'] = 'concurrent'
+                    metrics.inc('mcadmin_cache_requests_total', result='coalesced')
+                    return content
+                op.fields['source'] = 'network'
+                metrics.inc('mcadmin_cache_requests_total', result='miss')
+                return self._cache_refresh(url, local, meta)
+
+    def get_version_manifest(self, offline=False):
+        """
+        The Mojang version manifest, revalidated once it is older than
+        MCADMIN_VERSION_MANIFEST_EXPIRY. offline serves the cached copy as
+        is, without any network access.
+        """
+        if offline:
+            if not self.get_cache().contains('version_manifest.json'):
+                error_msg("No cached version manifest; run 'mcadmin versions --refresh' first")
+                return None
+            return self.cache_load('version_manifest.json')
         return self.get_url_and_cache(MOJANG_VERSION_MANIFEST_URL, 'version_manifest.json', MCADMIN_VERSION_MANIFEST_EXPIRY)
 
-    def get_versions(self):
+    def get_versions(self, offline=False):
         if self._versions is None:
-            self._versions = MCVersions(self, self.get_version_manifest())
+            self._versions = MCVersions(self, self.get_version_manifest(offline) or None)
         return self._versions
 
 
@@ -577,33 +2615,472 @@ class MCWorld(object):
             last = c
         return out
 
-    def verify(self):
-        pass
+    def get_world_dir(self):
+        return self._admin.get_worlds_dir(self._name)
 
+    def verify(self, workers=None):
+        """
+        Check every region file of the instance for corrupt headers and
+        chunks, one region per worker process. Returns the mcregion report,
+        or None if the instance does not exist.
+        """
+        import mcregion
+        world_dir = self.get_world_dir()
+        if not os.path.isdir(world_dir):
+            error_msg("No world instance [{}]", self._name)
+            return None
+        self._valid = True
 
+        regions = mcregion.find_regions(world_dir)
+        progress = MCProgress("Verify [{}]".format(self._name), len(regions))
+        report = mcregion.verify_world(world_dir, workers,
+                                       lambda result: progress.update(failed=bool(result['error'] or result['errors'])), regions)
+        progress.finish()
+        mcregion.log_report(report)
+        return report
 
+    def get_level_name(self):
+        """Directory of the world save, from the level-name of server.properties"""
+        try:
+            with open(os.path.join(self.get_world_dir(), 'server.properties'), 'r') as fp:
+                for line in fp:
+                    key, sep, value = line.strip().partition('=')
+                    if sep and key.strip() == 'level-name' and value.strip():
+                        return value.strip()
+        except OSError:
+            pass
+        return 'world'
+
+    def render(self, release, dimension='overworld', workers=None, force=False):
+        """
+        Render a top-down tile map of a dimension with the textures of
+        release (an MCVersion) into maps/<instance>/<dimension>. Returns
+        the render summary, or None on failure.
+        """
+        import mcrender
+        if not os.path.isdir(self.get_world_dir()):
+            error_msg("No world instance [{}]", self._name)
+            return None
+        region_dir = os.path.join(self.get_world_dir(), self.get_level_name(), mcrender.DIMENSIONS[dimension], 'region')
+        if not os.path.isdir(region_dir):
+            error_msg("No region directory [{}]", region_dir)
+            return None
+        if not release.extract_textures():
+            return None
+        out_dir = os.path.join(self._admin.get_maps_dir(self._name), dimension)
+        regions = mcrender.find_regions(region_dir)
+        progress = MCProgress("Render [{}]".format(self._name), len(regions))
+        summary = mcrender.render_world(region_dir, release.get_texture_path(), out_dir, workers, force,
+                                        lambda name, skipped, failed: progress.update(skipped=skipped, failed=failed), regions)
+        progress.finish()
+        return summary
+
+    def prune(self, max_inhabited=0, min_age=0, dry_run=False, workers=None):
+        """
+        Drop the chunks of every dimension that players spent at most
+        max_inhabited ticks near (and, if min_age, that were last saved at
+        least min_age ticks of game time ago), rewriting the region files
+        compact. Returns the mcprune report, or None on failure.
+        """
+        import mcprune
+        level_dir = os.path.join(self.get_world_dir(), self.get_level_name())
+        if not os.path.isdir(level_dir):
+            error_msg("No world save [{}]", level_dir)
+            return None
+        progress = MCProgress("Prune [{}]".format(self._name), len(mcprune.find_terrain_regions(level_dir)))
+        report = mcprune.prune_world(level_dir, max_inhabited, min_age, dry_run, workers,
+                                     lambda result: progress.update(failed=bool(result['error'])))
+        progress.finish()
+        if report is not None:
+            mcprune.log_report(report)
+        return report
+
+    def get_index(self, refresh=True):
+        """The mcindex.WorldIndex of the instance, brought up to date unless refresh is False"""
+        import mcindex
+        index = mcindex.WorldIndex(self.get_world_dir(), self._admin.get_index_path(self._name))
+        if refresh and os.path.isdir(self.get_world_dir()):
+            index.refresh()
+        return index
+
+    def get_backup(self):
+        import mcbackup
+        return mcbackup.MCBackup(self._admin.get_backups_dir(self._name))
+
+    def backup(self, full=False):
+        """Take an incremental snapshot of the instance; returns its manifest, or None"""
+        world_dir = self.get_world_dir()
+        if not os.path.isdir(world_dir):
+            error_msg("No world instance [{}]", self._name)
+            return None
+        return self.get_backup().snapshot(world_dir, full)
+
+    def restore(self, dest_dir, at=None):
+        """Restore the latest snapshot taken at or before unix time at (default: the latest) to dest_dir"""
+        backup = self.get_backup()
+        snapshot = backup.find_snapshot(at)
+        if snapshot is None:
+            error_msg("No snapshot of [{}] to restore", self._name)
+            return False
+        return backup.restore(snapshot['id'], dest_dir)
+
+
+
+
+def resolve_version_arg(registry, version):
+    """Accept 'latest' and 'latest-snapshot' wherever a version id is expected"""
+    if version == 'latest':
+        return registry.get_latest_version(MCVersions.RELEASE)
+    if version == 'latest-snapshot':
+        return registry.get_latest_version(MCVersions.SNAPSHOT)
+    return version
+
+
+def get_registry(admin, offline=False):
+    registry = admin.get_versions(offline)
+    if not registry._valid:
+        error_msg("No usable version manifest")
+        return None
+    return registry
 
-if __name__ == '__main__':
-    #manifest = MCManifest()
-    #manifest.download()
-    #manifest.dump()
-    #manifest.latest()
-    #print(manifest.versions(MCManifest.RELEASE))
-    #get_url(manifest.version_url(manifest.latest()[MCVersions.RELEASE]))
-
-    #register = MCVersions()
-    #register.dump_version_manifest(register.get_latest_version())
-    #register.get_client_jar(register.get_latest_version())
-    #register.get_server_jar(register.get_latest_version())
-    #register.extract_textures(register.get_latest_version())
 
+def cmd_init(admin, args):
+    if not admin.init_env():
+        return False
+    info_msg("Initialized MCAdmin in [{}]", admin.get_working_dir())
+    return True
+
+
+def cmd_versions(admin, args):
+    registry = get_registry(admin, offline=not args.refresh and admin.get_cache().contains('version_manifest.json'))
+    if registry is None:
+        return False
+    if args.latest:
+        for vtype in ([args.type] if args.type else [MCVersions.RELEASE, MCVersions.SNAPSHOT]):
+            print(registry.get_latest_version(vtype) if args.type else '{} {}'.format(vtype, registry.get_latest_version(vtype)))
+        return True
+    if args.newer_than:
+        versions = registry.get_releases_newer_than(args.newer_than)
+    elif args.type == MCVersions.SNAPSHOT:
+        versions = registry.get_snapshot_list()
+    else:
+        versions = registry.get_release_list()
+    for version in versions:
+        print(version)
+    return True
+
+
+def cmd_manifest(admin, args):
+    registry = get_registry(admin)
+    if registry is None:
+        return False
+    release = registry.get_version(resolve_version_arg(registry, args.version))
+    if release is None:
+        return False
+    release.dump_manifest()
+    return True
+
+
+def cmd_fetch(admin, args):
+    registry = get_registry(admin)
+    if registry is None:
+        return False
+    artifacts = ['manifest'] + [name for name in ('server', 'client') if getattr(args, name)]
+    if len(artifacts) == 1 and not args.manifest_only:
+        artifacts.append('server')
+    return admin.prefetch([resolve_version_arg(registry, version) for version in args.versions], artifacts, args.jobs)
+
+
+def cmd_purge(admin, args):
+    registry = get_registry(admin)
+    if registry is None:
+        return False
+    ok = True
+    for version in args.versions:
+        release = registry.get_version(resolve_version_arg(registry, version))
+        ok = release is not None and release.purge_version_cache() and ok
+    return ok
+
+
+def cmd_textures(admin, args):
+    registry = get_registry(admin)
+    if registry is None:
+        return False
+    release = registry.get_version(resolve_version_arg(registry, args.version))
+    return release is not None and release.extract_textures(args.jobs)
+
+
+def cmd_mirror(admin, args):
+    registry = get_registry(admin)
+    if registry is None:
+        return False
+    return admin.mirror([resolve_version_arg(registry, version) for version in args.versions], args.jobs, args.verify)
+
+
+def cmd_poll(admin, args):
+    delta = admin.poll_versions(prefetch=tuple(args.prefetch) if args.prefetch else None)
+    if delta is None:
+        return False
+    delta.dump()
+    return True
+
+
+def cmd_sync(admin, args):
+    summary = admin.sync_properties(args.instances or None, args.jobs, resolve=not args.no_resolve)
+    return summary is not None and not any('failed' in results.values() for results in summary.values())
+
+
+def cmd_resolve(admin, args):
+    uuids = admin.resolve_names(args.names)
+    for name in args.names:
+        print('{} {}'.format(name, uuids.get(name) or '-'))
+    return all(uuids.get(name) for name in args.names)
+
+
+def cmd_cache(admin, args):
+    if args.action == 'clear':
+        return admin.clear_cache(args.pinned)
+    for stat, value in sorted(admin.get_cache_stats().items()):
+        print('{}: {}'.format(stat, value))
+    return True
+
+
+def cmd_verify(admin, args):
+    instances = args.instances or admin.get_instances()
+    reports = {}
+    for instance in instances:
+        reports[instance] = MCWorld(admin, instance).verify(args.jobs)
+    if args.json:
+        print(json.dumps(reports, indent=2, sort_keys=True))
+    return all(report is not None and not report['damaged'] for report in reports.values())
+
+
+def cmd_render(admin, args):
+    registry = get_registry(admin)
+    if registry is None:
+        return False
+    release = registry.get_version(resolve_version_arg(registry, args.version))
+    if release is None:
+        return False
+    return MCWorld(admin, args.instance).render(release, args.dimension, args.jobs, args.force) is not None
+
+
+def cmd_backup(admin, args):
+    import mcbackup
+    world = MCWorld(admin, args.instance)
+    if args.action == 'create':
+        return world.backup(args.full) is not None
+    if args.action == 'list':
+        for snapshot in world.get_backup().list_snapshots():
+            stats = snapshot['stats']
+            print('{} {} files, {} regions, {}/{} chunks changed, {} bytes stored'.format(snapshot['id'],
+                  stats['files'], stats['regions'], stats['changed_chunks'], stats['chunks'], stats['stored_bytes']))
+        return True
+    if not args.to:
+        error_msg("restore needs a destination directory (--to)")
+        return False
+    try:
+        at = mcbackup.parse_time(args.at) if args.at else None
+    except ValueError:
+        error_msg("Invalid time [{}]", args.at)
+        return False
+    return world.restore(args.to, at)
+
+
+def cmd_prune(admin, args):
+    import mcprune
+    report = MCWorld(admin, args.instance).prune(int(args.inhabited * mcprune.TICKS_PER_SECOND),
+                                                 int(args.min_age * mcprune.TICKS_PER_SECOND), args.dry_run, args.jobs)
+    if report is not None and args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    return report is not None and not report['failed']
+
+
+def cmd_index(admin, args):
+    for instance in args.instances or admin.get_instances():
+        world = MCWorld(admin, instance)
+        if not os.path.isdir(world.get_world_dir()):
+            error_msg("No world instance [{}]", instance)
+            return False
+        index = world.get_index()
+        data = index.get()
+        print('{}: {} worlds, {} players, {} regions, {} chunks'.format(instance, len(data['worlds']), len(data['players']),
+              len(data['regions']), sum(index.get_chunk_counts().values())))
+    return True
+
+
+def cmd_where(admin, args):
+    found = admin.find_player(args.player)
+    for instance, player in found:
+        pos = ' '.join('{:.1f}'.format(coord) for coord in player['pos']) if player['pos'] else '-'
+        print('{} {}/{} {} {} {}'.format(player['name'] or player['uuid'], instance, player['world'],
+              player['dimension'] or '-', pos, '{} items'.format(len(player['inventory']))))
+        if args.inventory:
+            for item in player['inventory']:
+                print('    {} {} x{}'.format(item['slot'], item['id'], item['count']))
+    if not found:
+        error_msg("No player [{}] in any instance", args.player)
+    return bool(found)
+
+
+def cmd_worlds(admin, args):
+    for instance, world, level in admin.find_worlds(args.version):
+        print('{}/{} {} seed {}'.format(instance, world, level.get('version') or '-', level.get('seed')))
+    return True
+
+
+def cmd_metrics(admin, args):
+    if args.reset:
+        return admin.reset_metrics()
+    snapshot = admin.get_metrics()
+    if args.prometheus:
+        sys.stdout.write(mcmetrics.render_prometheus(snapshot))
+    else:
+        print(json.dumps(mcmetrics.export_json(snapshot), indent=2, sort_keys=True))
+    return True
+
+
+def cmd_gc(admin, args):
+    if args.verify:
+        admin.get_store().verify()
+    admin.gc_store()
+    return True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='mcadmin', description="Minecraft server management tools.")
+    parser.add_argument('--work-dir', help="working directory (default: ${}, or ~/mcadmin)".format(MCADMIN_WORKDIR_ENV_VAR))
+    mclog.add_arguments(parser)
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    cmd = commands.add_parser('init', help="create the working directory layout")
+    cmd.set_defaults(func=cmd_init, needs_init=False)
+
+    cmd = commands.add_parser('versions', help="list versions; answered from the cached manifest unless --refresh")
+    cmd.add_argument('--latest', action='store_true', help="only the latest release and snapshot")
+    cmd.add_argument('--type', choices=[MCVersions.RELEASE, MCVersions.SNAPSHOT], help="only this version type")
+    cmd.add_argument('--newer-than', metavar='VERSION', help="only releases newer than VERSION")
+    cmd.add_argument('--refresh', action='store_true', help="revalidate the version manifest first")
+    cmd.set_defaults(func=cmd_versions)
+
+    cmd = commands.add_parser('manifest', help="print the manifest of a version")
+    cmd.add_argument('version')
+    cmd.set_defaults(func=cmd_manifest)
+
+    cmd = commands.add_parser('fetch', help="download version jars (the server jar by default)")
+    cmd.add_argument('versions', nargs='+', metavar='version', help="version id, 'latest' or 'latest-snapshot'")
+    cmd.add_argument('--server', action='store_true', help="fetch the server jar")
+    cmd.add_argument('--client', action='store_true', help="fetch the client jar")
+    cmd.add_argument('--manifest-only', action='store_true', help="only fetch the version manifests")
+    cmd.add_argument('--jobs', type=int, default=MCADMIN_PREFETCH_WORKERS, help="concurrent downloads")
+    cmd.set_defaults(func=cmd_fetch)
+
+    cmd = commands.add_parser('purge', help="remove the cached jars and textures of versions")
+    cmd.add_argument('versions', nargs='+', metavar='version')
+    cmd.set_defaults(func=cmd_purge)
+
+    cmd = commands.add_parser('textures', help="extract the textures of a version")
+    cmd.add_argument('version')
+    cmd.add_argument('--jobs', type=int, default=MCADMIN_EXTRACT_WORKERS, help="extraction threads")
+    cmd.set_defaults(func=cmd_textures)
+
+    cmd = commands.add_parser('mirror', help="mirror the assets and libraries of versions")
+    cmd.add_argument('versions', nargs='+', metavar='version')
+    cmd.add_argument('--verify', action='store_true', help="re-hash files already mirrored")
+    cmd.add_argument('--jobs', type=int, default=MCADMIN_MIRROR_WORKERS, help="concurrent downloads")
+    cmd.set_defaults(func=cmd_mirror)
+
+    cmd = commands.add_parser('poll', help="refresh the version manifest and report what changed")
+    cmd.add_argument('--prefetch', nargs='+', choices=['manifest', 'server', 'client'], help="fetch these for new versions")
+    cmd.set_defaults(func=cmd_poll)
+
+    cmd = commands.add_parser('sync', help="merge the global property lists into server instances")
+    cmd.add_argument('instances', nargs='*', metavar='instance', help="instances to sync (default: all)")
+    cmd.add_argument('--no-resolve', action='store_true', help="do not look up missing player uuids")
+    cmd.add_argument('--jobs', type=int, default=MCADMIN_SYNC_WORKERS, help="instances merged in parallel")
+    cmd.set_defaults(func=cmd_sync)
+
+    cmd = commands.add_parser('resolve', help="look up the uuids of player names")
+    cmd.add_argument('names', nargs='+', metavar='name')
+    cmd.set_defaults(func=cmd_resolve)
+
+    cmd = commands.add_parser('verify', help="check the region files of server instances for corruption")
+    cmd.add_argument('instances', nargs='*', metavar='instance', help="instances to verify (default: all)")
+    cmd.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per cpu)")
+    cmd.add_argument('--json', action='store_true', help="print the reports as JSON")
+    cmd.set_defaults(func=cmd_verify)
+
+    cmd = commands.add_parser('render', help="render a top-down tile map of a server instance")
+    cmd.add_argument('instance')
+    cmd.add_argument('--version', default='latest', help="version whose textures to use (default: latest)")
+    cmd.add_argument('--dimension', choices=['overworld', 'nether', 'end'], default='overworld')
+    cmd.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per cpu)")
+    cmd.add_argument('--force', action='store_true', help="render every region, changed or not")
+    cmd.set_defaults(func=cmd_render)
+
+    cmd = commands.add_parser('backup', help="take, list or restore incremental snapshots of a server instance")
+    cmd.add_argument('action', choices=['create', 'list', 'restore'])
+    cmd.add_argument('instance')
+    cmd.add_argument('--full', action='store_true', help="create: re-read every chunk and file")
+    cmd.add_argument('--at', help="restore: the latest snapshot taken at or before this time or snapshot id (default: the latest)")
+    cmd.add_argument('--to', metavar='DIR', help="restore: directory to restore into; must not exist")
+    cmd.set_defaults(func=cmd_backup)
+
+    cmd = commands.add_parser('prune', help="drop never-inhabited chunks from the region files of a server instance")
+    cmd.add_argument('instance')
+    cmd.add_argument('--inhabited', type=float, default=0,
+                     help="prune chunks players spent at most this many seconds near (default: 0, never)")
+    cmd.add_argument('--min-age', type=float, default=0,
+                     help="only prune chunks last saved at least this many seconds of game time ago")
+    cmd.add_argument('--dry-run', action='store_true', help="only report what would be pruned and the space saved")
+    cmd.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per cpu)")
+    cmd.add_argument('--json', action='store_true', help="print the report as JSON")
+    cmd.set_defaults(func=cmd_prune)
+
+    cmd = commands.add_parser('index', help="refresh and summarize the world indexes of server instances")
+    cmd.add_argument('instances', nargs='*', metavar='instance', help="instances to index (default: all)")
+    cmd.set_defaults(func=cmd_index)
+
+    cmd = commands.add_parser('where', help="show where a player is, in every server instance")
+    cmd.add_argument('player', help="player name or uuid")
+    cmd.add_argument('--inventory', action='store_true', help="also list the player's inventory")
+    cmd.set_defaults(func=cmd_where)
+
+    cmd = commands.add_parser('worlds', help="list the world saves of all server instances")
+    cmd.add_argument('--version', help="only the worlds last saved by this version")
+    cmd.set_defaults(func=cmd_worlds)
+
+    cmd = commands.add_parser('cache', help="show cache statistics or clear the cache")
+    cmd.add_argument('action', nargs='?', choices=['stats', 'clear'], default='stats')
+    cmd.add_argument('--pinned', action='store_true', help="also clear pinned entries")
+    cmd.set_defaults(func=cmd_cache)
+
+    cmd = commands.add_parser('metrics', help="show the metrics recorded in this working directory")
+    cmd.add_argument('--prometheus', action='store_true', help="in the Prometheus text format instead of JSON")
+    cmd.add_argument('--reset', action='store_true', help="discard the recorded metrics")
+    cmd.set_defaults(func=cmd_metrics)
+
+    cmd = commands.add_parser('gc', help="remove unreferenced objects from the artifact store")
+    cmd.add_argument('--verify', action='store_true', help="re-hash stored objects first, dropping corrupt ones")
+    cmd.set_defaults(func=cmd_gc)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    mclog.configure_from_args(args)
     admin = MCAdmin()
-    #admin.set_working_dir("/woot/woot/shnoo")
-    admin.is_init()
-    #admin.init_env()
-    manifest = admin.get_url_and_cache(MOJANG_VERSION_MANIFEST_URL, 'version_manifest.json')
-    if manifest is False:
-        error_msg("Failed to get the manifest")
-    admin.get_versions().dump_latest()
-    admin.get_versions().dump_manifest()
-    #admin.get_versions().get_version(admin.get_versions().get_latest_version(MCVersions.RELEASE)).dump_manifest()
+    if args.work_dir:
+        admin.set_working_dir(args.work_dir)
+    if getattr(args, 'needs_init', True) and not admin.is_init():
+        return 1
+    try:
+        return 0 if args.func(admin, args) else 1
+    finally:
+        admin.close()
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,514 @@
+##############################################################################
+#
+# Incremental, chunk-level deduplicated world backups
+#
+# A backup directory holds the snapshots of one server instance:
+#
+#     packs/<snapshot>.pack     objects first stored by that snapshot,
+#                               concatenated
+#     packs/<snapshot>.idx      (sha1, offset, length) of each object in the
+#                               pack, sorted by sha1
+#     snapshots/<snapshot>.json the snapshot manifest, written last
+#
+# Objects are addressed by their SHA-1 and stored once across all
+# snapshots. Plain files are stored whole. A region file is stored as a
+# table object listing the timestamp and object of each of its 1024 chunks,
+# each chunk object being the chunk's compression type and compressed data
+# exactly as found in the region. A chunk whose record cannot be read is
+# stored as the raw sectors its location points to, listed under 'raw' in
+# the region's manifest entry, and restored byte for byte. A snapshot only
+# reads the regions whose file changed, and in those only the chunks whose
+# header timestamp changed, so its I/O follows what changed in the world
+# rather than its size.
+#
+# Snapshots should be taken while the server is stopped or saving is
+# disabled (save-off / save-all), as with any copy of a live world.
+#
+##############################################################################
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import struct
+import time
+
+import mcfs
+import mclog
+import mcregion
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Paths of the instance never backed up, relative to its directory
+DEFAULT_EXCLUDES = ['logs', 'crash-reports']
+
+SNAPSHOT_ID_FORMAT = '%Y%m%dT%H%M%SZ'
+
+INDEX_ENTRY = struct.Struct('>20sQI')
+TABLE_ENTRY = struct.Struct('>I20s')
+NO_OBJECT = b'\0' * 20
+
+
+log = mclog.get_logger('mcbackup')
+debug_msg = log.debug
+info_msg = log.info
+warn_msg = log.warn
+error_msg = log.error
+
+
+def pack_table(entries):
+    """Table object of a region from its 1024 (timestamp, sha1 digest or None) entries"""
+    return b''.join(TABLE_ENTRY.pack(timestamp, digest or NO_OBJECT) for timestamp, digest in entries)
+
+
+def unpack_table(data):
+    return [(timestamp, digest if digest != NO_OBJECT else None) for timestamp, digest in TABLE_ENTRY.iter_unpack(data)]
+
+
+def parse_time(value):
+    """Unix time from a snapshot id, an ISO 8601 date/time (local time unless it has an offset) or a number"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.strptime(value, SNAPSHOT_ID_FORMAT).replace(tzinfo=datetime.timezone.utc).timestamp()
+    except ValueError:
+        pass
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+class PackWriter(object):
+    """Appends the objects of one snapshot to a new pack file"""
+
+    def __init__(self, backup, name):
+        self._backup = backup
+        self.name = name
+        self.path = backup.get_pack_path(name)
+        self._fp = None
+        self._index = []
+        self.bytes = 0
+
+    def _open(self):
+        if self._fp is None:
+            self._fp = open(self.path + '.tmp', 'wb')
+        return self._fp
+
+    def add(self, parts):
+        """
+        Store the object made of the concatenated parts (bytes-like),
+        unless an identical one is already stored; returns its digest.
+        """
+        sha1 = hashlib.sha1()
+        for part in parts:
+            sha1.update(part)
+        digest = sha1.digest()
+        if self._backup.has_object(digest):
+            return digest
+        fp = self._open()
+        offset = fp.tell()
+        for part in parts:
+            fp.write(part)
+        self._register(digest, offset, fp.tell() - offset)
+        return digest
+
+    def add_file(self, path):
+        """Store a file's content, streaming it into the pack; returns its digest"""
+        fp = self._open()
+        offset = fp.tell()
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as src:
+            for block in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                sha1.update(block)
+                fp.write(block)
+        digest = sha1.digest()
+        if self._backup.has_object(digest):
+            # Already stored: drop the copy just appended
+            fp.seek(offset)
+            fp.truncate()
+            return digest
+        self._register(digest, offset, fp.tell() - offset)
+        return digest
+
+    def _register(self, digest, offset, length):
+        self._index.append((digest, offset, length))
+        self._backup._objects[digest] = (self.name, offset, length)
+        self.bytes += length
+
+    def commit(self):
+        """Make the pack and its index permanent; False if nothing was stored"""
+        if self._fp is None:
+            return False
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._fp.close()
+        self._fp = None
+        os.replace(self.path + '.tmp', self.path)
+        mcfs.atomic_write(self._backup.get_index_path(self.name),
+                          b''.join(INDEX_ENTRY.pack(*entry) for entry in sorted(self._index)))
+        return True
+
+    def abort(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+            os.remove(self.path + '.tmp')
+        for digest, _, _ in self._index:
+            self._backup._objects.pop(digest, None)
+        self._index = []
+
+
+class MCBackup(object):
+    """Snapshots of one server instance directory, kept in a backup directory"""
+
+    def __init__(self, backup_dir, excludes=None):
+        self.backup_dir = backup_dir
+        self.excludes = excludes if excludes is not None else DEFAULT_EXCLUDES
+        self._objects = None
+        self._packs = {}
+
+    def get_pack_dir(self):
+        return os.path.join(self.backup_dir, 'packs')
+
+    def get_pack_path(self, name):
+        return os.path.join(self.get_pack_dir(), '{}.pack'.format(name))
+
+    def get_index_path(self, name):
+        return os.path.join(self.get_pack_dir(), '{}.idx'.format(name))
+
+    def get_snapshot_dir(self):
+        return os.path.join(self.backup_dir, 'snapshots')
+
+    def get_snapshot_path(self, snapshot_id):
+        return os.path.join(self.get_snapshot_dir(), '{}.json'.format(snapshot_id))
+
+    def _load_objects(self):
+        if self._objects is not None:
+            return
+        self._objects = {}
+        if not os.path.isdir(self.get_pack_dir()):
+            return
+        for filename in sorted(os.listdir(self.get_pack_dir())):
+            if not filename.endswith('.idx'):
+                continue
+            name = filename[:-len('.idx')]
+            with open(os.path.join(self.get_pack_dir(), filename), 'rb') as fp:
+                for digest, offset, length in INDEX_ENTRY.iter_unpack(fp.read()):
+                    self._objects.setdefault(digest, (name, offset, length))
+
+    def has_object(self, digest):
+        self._load_objects()
+        return digest in self._objects
+
+    def read_object(self, digest):
+        """Content of a stored object, checked against its digest"""
+        self._load_objects()
+        name, offset, length = self._objects[digest]
+        fp = self._packs.get(name)
+        if fp is None:
+            fp = self._packs[name] = open(self.get_pack_path(name), 'rb')
+        fp.seek(offset)
+        data = fp.read(length)
+        if len(data) != length or hashlib.sha1(data).digest() != digest:
+            raise ValueError("object [{}] in pack [{}] is corrupt".format(digest.hex(), name))
+        return data
+
+    def close(self):
+        for fp in self._packs.values():
+            fp.close()
+        self._packs = {}
+
+    def list_snapshots(self):
+        """Manifests of all snapshots, oldest first"""
+        snapshots = []
+        if not os.path.isdir(self.get_snapshot_dir()):
+            return snapshots
+        for filename in sorted(os.listdir(self.get_snapshot_dir())):
+            if filename.endswith('.json'):
+                snapshot = self.load_snapshot(filename[:-len('.json')])
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        snapshots.sort(key=lambda snapshot: snapshot['time'])
+        return snapshots
+
+    def load_snapshot(self, snapshot_id):
+        try:
+            with open(self.get_snapshot_path(snapshot_id), 'r') as fp:
+                return json.load(fp)
+        except Exception as ex:
+            error_msg("Failed to load snapshot [{}]: {}", snapshot_id, str(ex))
+            return None
+
+    def find_snapshot(self, at=None):
+        """The latest snapshot taken at or before unix time at (default: the latest); None if there is none"""
+        found = None
+        for snapshot in self.list_snapshots():
+            if at is None or snapshot['time'] <= at:
+                found = snapshot
+        return found
+
+    def _walk(self, source_dir):
+        """(relative path, full path, is region) of every file to back up, sorted"""
+        excludes = set(os.path.normpath(path) for path in self.excludes)
+        for root, dirs, files in os.walk(source_dir):
+            rel_root = os.path.relpath(root, source_dir)
+            dirs[:] = sorted(d for d in dirs if os.path.normpath(os.path.join(rel_root, d)) not in excludes)
+            in_region_dir = os.path.basename(root) in mcregion.REGION_DIRS
+            for name in sorted(files):
+                rel = os.path.normpath(os.path.join(rel_root, name))
+                if rel in excludes:
+                    continue
+                if in_region_dir and name.endswith('.mcc'):
+                    # Stored with the chunk of the region referring to it
+                    continue
+                yield rel, os.path.join(root, name), in_region_dir and mcregion.REGION_FILE_RE.match(name) is not None
+
+    def _snapshot_region(self, pack, path, previous, full, stats):
+        """
+        (table digest, indexes of the chunks stored as raw sectors) of a
+        region file; None if it is not readable as a region
+        """
+        old_table = None
+        if previous is not None and not full:
+            old_table = unpack_table(self.read_object(bytes.fromhex(previous['table'])))
+            # Unreadable chunks are read again, in case they were repaired since
+            for index in previous.get('raw', ()):
+                old_table[index] = (0, None)
+
+        try:
+            region = mcregion.RegionFile(path)
+        except (OSError, ValueError) as ex:
+            warn_msg("Failed to open region [{}]: {}", path, str(ex))
+            return None
+        with region:
+            if region.size < mcregion.HEADER_SIZE:
+                return None
+            entries = [(0, None)] * mcregion.CHUNKS_PER_REGION
+            raw = []
+            for index, _, _, timestamp in region.chunks():
+                stats['chunks'] += 1
+                if old_table is not None and old_table[index][1] is not None and old_table[index][0] == timestamp:
+                    entries[index] = old_table[index]
+                    continue
+                try:
+                    compression, data = region.read_chunk(index)
+                except ValueError as ex:
+                    warn_msg("Storing unreadable chunk {},{} of [{}] as raw sectors: {}",
+                             *mcregion.chunk_coords(index, region.coords), path, str(ex))
+                    with region.read_sectors(index) as sectors:
+                        entries[index] = (timestamp, pack.add([sectors]))
+                    raw.append(index)
+                    stats['raw_chunks'] += 1
+                    continue
+                with data:
+                    if compression & mcregion.COMPRESSION_EXTERNAL:
+                        with open(region.get_external_path(index), 'rb') as fp:
+                            digest = pack.add([bytes([compression]), fp.read()])
+                    else:
+                        digest = pack.add([bytes([compression]), data])
+                entries[index] = (timestamp, digest)
+                stats['changed_chunks'] += 1
+        return pack.add([pack_table(entries)]), raw
+
+    @log.timing('backup_snapshot', mclog.INFO)
+    def snapshot(self, source_dir, full=False):
+        """
+        Take a snapshot of source_dir. Files and regions whose mtime and size
+        match the previous snapshot are carried over without being read;
+        in changed regions, only chunks with a new timestamp are read. With
+        full, every chunk and file is read and hashed again (objects are
+        still only stored once). Returns the new snapshot's manifest, or None.
+        """
+        if not os.path.isdir(source_dir):
+            error_msg("No such directory [{}]", source_dir)
+            return None
+        try:
+            os.makedirs(self.get_pack_dir(), exist_ok=True)
+            os.makedirs(self.get_snapshot_dir(), exist_ok=True)
+        except Exception as ex:
+            error_msg("Failed to create backup directory [{}]: {}", self.backup_dir, str(ex))
+            return None
+
+        with mcfs.file_lock(os.path.join(self.backup_dir, '.lock')):
+            try:
+                self._objects = None
+                self._load_objects()
+                parent = self.find_snapshot()
+                # Whole seconds, so a snapshot's id parses back to its exact time
+                now = int(time.time())
+                snapshot_id = time.strftime(SNAPSHOT_ID_FORMAT, time.gmtime(now))
+                if parent is not None and parent['id'] >= snapshot_id:
+                    error_msg("A snapshot [{}] was already taken this second", parent['id'])
+                    return None
+
+                stats = dict.fromkeys(['files', 'changed_files', 'regions', 'changed_regions',
+                                       'chunks', 'changed_chunks', 'raw_chunks', 'stored_bytes'], 0)
+                manifest = {'id': snapshot_id, 'time': now, 'source': os.path.abspath(source_dir),
+                            'parent': parent['id'] if parent is not None else None, 'files': {}, 'regions': {}}
+                pack = PackWriter(self, snapshot_id)
+                try:
+                    for rel, path, is_region in self._walk(source_dir):
+                        try:
+                            st = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        section = None
+                        if parent is not None:
+                            section = 'regions' if rel in parent['regions'] else 'files' if rel in parent['files'] else None
+                        previous = parent[section][rel] if section is not None else None
+                        if not full and previous is not None and previous['mtime_ns'] == st.st_mtime_ns and previous['size'] == st.st_size:
+                            manifest[section][rel] = previous
+                            stats[section] += 1
+                            continue
+
+                        entry = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'mode': st.st_mode & 0o7777}
+                        region = None
+                        if is_region:
+                            region = self._snapshot_region(pack, path, previous if section == 'regions' else None, full, stats)
+                        if region is not None:
+                            section = 'regions'
+                            entry['table'] = region[0].hex()
+                            if region[1]:
+                                entry['raw'] = region[1]
+                        else:
+                            # Plain files, and region files too short to have a header
+                            section = 'files'
+                            entry['sha1'] = pack.add_file(path).hex()
+                        manifest[section][rel] = entry
+                        stats[section] += 1
+                        stats['changed_' + section] += 1
+                    stats['stored_bytes'] = pack.bytes
+                    pack.commit()
+                    manifest['stats'] = stats
+                    mcfs.atomic_write(self.get_snapshot_path(snapshot_id), json.dumps(manifest, indent=1, sort_keys=True).encode())
+                except Exception as ex:
+                    pack.abort()
+                    error_msg("Failed to snapshot [{}]: {}", source_dir, str(ex))
+                    return None
+            finally:
+                self.close()
+
+        info_msg("Snapshot [{}] of [{}]: {} of {} files and {} of {} regions changed, {} of {} chunks read, {} bytes stored",
+                 snapshot_id, source_dir, stats['changed_files'], stats['files'], stats['changed_regions'], stats['regions'],
+                 stats['changed_chunks'], stats['chunks'], stats['stored_bytes'])
+        return manifest
+
+    def _restore_region(self, entry, dest):
+        entries = unpack_table(self.read_object(bytes.fromhex(entry['table'])))
+        raw = set(entry.get('raw', ()))
+        locations = [0] * mcregion.CHUNKS_PER_REGION
+        timestamps = [0] * mcregion.CHUNKS_PER_REGION
+        sector = mcregion.HEADER_SIZE // mcregion.SECTOR_SIZE
+        with open(dest, 'wb') as fp:
+            fp.seek(mcregion.HEADER_SIZE)
+            for index, (timestamp, digest) in enumerate(entries):
+                if digest is None:
+                    continue
+                record = self.read_object(digest)
+                if index in raw:
+                    # Written back as found, unreadable record and all
+                    count = (len(record) + mcregion.SECTOR_SIZE - 1) // mcregion.SECTOR_SIZE
+                    fp.write(record)
+                    fp.write(b'\0' * (count * mcregion.SECTOR_SIZE - len(record)))
+                    locations[index] = (sector << 8) | count
+                    timestamps[index] = timestamp
+                    sector += count
+                    continue
+                compression = record[0]
+                if compression & mcregion.COMPRESSION_EXTERNAL:
+                    x, z = mcregion.chunk_coords(index, mcregion.region_coords(dest) or (0, 0))
+                    with open(os.path.join(os.path.dirname(dest), 'c.{}.{}.mcc'.format(x, z)), 'wb') as external:
+                        external.write(memoryview(record)[1:])
+                    record = record[:1]
+                count = (len(record) + 4 + mcregion.SECTOR_SIZE - 1) // mcregion.SECTOR_SIZE
+                fp.write(struct.pack('>I', len(record)))
+                fp.write(record)
+                fp.write(b'\0' * (count * mcregion.SECTOR_SIZE - len(record) - 4))
+                locations[index] = (sector << 8) | count
+                timestamps[index] = timestamp
+                sector += count
+            fp.seek(0)
+            fp.write(mcregion.HEADER.pack(*(locations + timestamps)))
+
+    @log.timing('backup_restore', mclog.INFO)
+    def restore(self, snapshot_id, dest_dir):
+        """
+        Recreate the instance directory as it was in a snapshot, at
+        dest_dir, which must not exist yet. Region files are rewritten
+        compactly, chunk for chunk. Returns True on success.
+        """
+        if os.path.exists(dest_dir):
+            error_msg("Restore destination [{}] already exists", dest_dir)
+            return False
+        manifest = self.load_snapshot(snapshot_id)
+        if manifest is None:
+            return False
+
+        tmp_dir = '{}.partial'.format(dest_dir.rstrip(os.sep))
+        if os.path.exists(tmp_dir):
+            # Left by an interrupted restore; its files may not be in this snapshot
+            warn_msg("Removing partial restore [{}]", tmp_dir)
+            shutil.rmtree(tmp_dir)
+        try:
+            self._objects = None
+            for section in ('files', 'regions'):
+                for rel, entry in sorted(manifest[section].items()):
+                    dest = os.path.join(tmp_dir, rel)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    if section == 'regions':
+                        self._restore_region(entry, dest)
+                    else:
+                        with open(dest, 'wb') as fp:
+                            fp.write(self.read_object(bytes.fromhex(entry['sha1'])))
+                    os.chmod(dest, entry['mode'])
+                    os.utime(dest, ns=(entry['mtime_ns'], entry['mtime_ns']))
+            os.replace(tmp_dir, dest_dir)
+        except Exception as ex:
+            error_msg("Failed to restore snapshot [{}] to [{}]: {}", snapshot_id, dest_dir, str(ex))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+        finally:
+            self.close()
+
+        info_msg("Restored snapshot [{}] to [{}]", snapshot_id, dest_dir)
+        return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Take and restore deduplicated snapshots of a server instance.")
+    parser.add_argument('backup_dir', help="backup directory of the instance")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    cmd = commands.add_parser('create', help="snapshot an instance directory")
+    cmd.add_argument('source', help="instance directory")
+    cmd.add_argument('--full', action='store_true', help="re-read every chunk and file")
+    commands.add_parser('list', help="list the snapshots")
+    cmd = commands.add_parser('restore', help="restore a snapshot to a new directory")
+    cmd.add_argument('dest', help="directory to create")
+    cmd.add_argument('--at', help="restore the latest snapshot taken at or before this time (default: the latest)")
+    mclog.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    mclog.configure_from_args(args)
+    backup = MCBackup(args.backup_dir)
+
+    if args.command == 'create':
+        exit(0 if backup.snapshot(args.source, args.full) is not None else 1)
+
+    if args.command == 'list':
+        for snapshot in backup.list_snapshots():
+            print('{} {} files, {} regions, {} bytes stored'.format(snapshot['id'], len(snapshot['files']),
+                  len(snapshot['regions']), snapshot['stats']['stored_bytes']))
+        exit(0)
+
+    snapshot = backup.find_snapshot(parse_time(args.at) if args.at else None)
+    if snapshot is None:
+        error_msg("No snapshot to restore")
+        exit(1)
+    exit(0 if backup.restore(snapshot['id'], args.dest) else 1)
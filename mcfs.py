@@ -0,0 +1,85 @@
+##############################################################################
+#
+# File helpers shared by the mc-server-tools scripts
+#
+# atomic_open() and atomic_write() replace a file through a uniquely named
+# temporary file in the same directory and a rename, so readers see either
+# the old or the new content, never a partial file, and a failed write
+# leaves neither a changed file nor a temporary file behind:
+#
+#     with mcfs.atomic_open(path, 'w') as fp:
+#         json.dump(data, fp)
+#
+# file_lock() serializes the processes and threads sharing a directory on a
+# lock file.
+#
+##############################################################################
+
+import contextlib
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class Discard(Exception):
+    """Raised in an atomic_open() block to drop what was written and leave the file as it was"""
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='wb', encoding=None, sync=True):
+    """
+    Open a temporary file next to path for writing; when the block completes
+    it is flushed, synced to disk unless sync is False, and renamed over
+    path. If the block raises, the temporary file is removed and the
+    exception propagates, except for Discard, which is swallowed.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.{}.'.format(os.path.basename(path)), suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as fp:
+            yield fp
+            fp.flush()
+            if sync:
+                os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except Discard:
+        os.remove(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write(path, content, sync=True):
+    """Replace the file at path with content (bytes) in one step; see atomic_open()"""
+    with atomic_open(path, 'wb', sync=sync) as fp:
+        fp.write(content)
+
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on path. Threads in this process serialize on an
+    in-process lock; other processes on flock(), where it is available.
+    """
+    with _local_locks_guard:
+        local = _local_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with local:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
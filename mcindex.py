@@ -0,0 +1,211 @@
+##############################################################################
+#
+# Per-instance index of world and player data
+#
+# Keeps what admin queries need from the NBT files of a server instance in
+# one JSON file, so that they are answered without decompressing and
+# parsing those files again:
+#
+#     worlds     seed, version, spawn... of each world save (level.dat)
+#     players    position, dimension and inventory of each player
+#                (<world>/playerdata/<uuid>.dat)
+#     regions    chunk count of each region file
+#     names      player names by uuid, from usercache.json
+#
+# Entries are keyed by the path of their file relative to the instance and
+# carry its mtime and size; refresh() only reads the files whose mtime or
+# size changed since the last refresh, and drops entries of removed files.
+#
+##############################################################################
+
+import json
+import os
+import time
+
+import mcfs
+import mclog
+import mcnbt
+import mcregion
+
+
+INDEX_FORMAT = 1
+
+# Dimension names of the numeric ids used before 1.16
+LEGACY_DIMENSIONS = {0: 'minecraft:overworld', -1: 'minecraft:the_nether', 1: 'minecraft:the_end'}
+
+
+log = mclog.get_logger('mcindex')
+debug_msg = log.debug
+info_msg = log.info
+warn_msg = log.warn
+error_msg = log.error
+
+
+def _items(items):
+    result = []
+    for item in items or ():
+        # Count became an int named count in 1.20.5
+        result.append({'slot': item.get('Slot'), 'id': item.get('id'), 'count': item.get('Count', item.get('count', 1))})
+    return result
+
+
+def read_level(path):
+    data = mcnbt.load(path)['Data']
+    seed = data.get('RandomSeed')
+    if seed is None and 'WorldGenSettings' in data:
+        seed = data['WorldGenSettings'].get('seed')
+    version = data.get('Version')
+    return {
+        'name': data.get('LevelName'),
+        'seed': seed,
+        'version': version.get('Name') if version is not None else None,
+        'data_version': data.get('DataVersion'),
+        'last_played': data.get('LastPlayed', 0) / 1000.0,
+        'spawn': [data.get('SpawnX'), data.get('SpawnY'), data.get('SpawnZ')],
+        'game_type': data.get('GameType'),
+        'hardcore': bool(data.get('hardcore', 0)),
+    }
+
+
+def read_player(path):
+    root = mcnbt.load(path)
+    dimension = root.get('Dimension')
+    if isinstance(dimension, int):
+        dimension = LEGACY_DIMENSIONS.get(dimension, str(dimension))
+    return {
+        'uuid': os.path.splitext(os.path.basename(path))[0],
+        'pos': list(root['Pos']) if 'Pos' in root else None,
+        'dimension': dimension,
+        'health': root.get('Health'),
+        'xp_level': root.get('XpLevel'),
+        'game_type': root.get('playerGameType'),
+        'inventory': _items(root.get('Inventory')),
+        'ender_items': _items(root.get('EnderItems')),
+    }
+
+
+def read_region(path):
+    with mcregion.RegionFile(path) as region:
+        return {'chunks': sum(1 for _ in region.chunks())}
+
+
+def read_names(path):
+    with open(path, 'r') as fp:
+        return {'names': {entry['uuid']: entry['name'] for entry in json.load(fp) if 'uuid' in entry and 'name' in entry}}
+
+
+class WorldIndex(object):
+    """The index of one server instance directory, persisted at index_path"""
+
+    SECTIONS = ('worlds', 'players', 'regions', 'names')
+
+    def __init__(self, instance_dir, index_path):
+        self.instance_dir = instance_dir
+        self.index_path = index_path
+        self.data = None
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as fp:
+                data = json.load(fp)
+            if data.get('format') == INDEX_FORMAT:
+                return data
+        except (OSError, ValueError):
+            pass
+        return {'format': INDEX_FORMAT, 'updated': 0, **{section: {} for section in self.SECTIONS}}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with mcfs.atomic_open(self.index_path, 'w') as fp:
+            json.dump(self.data, fp, sort_keys=True)
+
+    def _files(self):
+        """{section: {relative path: reader}} of the files currently in the instance"""
+        files = {section: {} for section in self.SECTIONS}
+        if os.path.isfile(os.path.join(self.instance_dir, 'usercache.json')):
+            files['names']['usercache.json'] = read_names
+        for world in sorted(os.listdir(self.instance_dir)):
+            world_dir = os.path.join(self.instance_dir, world)
+            if not os.path.isfile(os.path.join(world_dir, 'level.dat')):
+                continue
+            files['worlds'][os.path.join(world, 'level.dat')] = read_level
+            player_dir = os.path.join(world_dir, 'playerdata')
+            if os.path.isdir(player_dir):
+                for name in sorted(os.listdir(player_dir)):
+                    if name.endswith('.dat'):
+                        files['players'][os.path.join(world, 'playerdata', name)] = read_player
+            for path in mcregion.find_regions(world_dir):
+                files['regions'][os.path.relpath(path, self.instance_dir)] = read_region
+        return files
+
+    @log.timing('index_refresh')
+    def refresh(self):
+        """Bring the index up to date with the instance's files; returns the number of files read"""
+        self.data = self._load()
+        read = removed = 0
+        for section, files in self._files().items():
+            entries = self.data[section]
+            for rel in list(entries):
+                if rel not in files:
+                    del entries[rel]
+                    removed += 1
+            for rel, reader in files.items():
+                path = os.path.join(self.instance_dir, rel)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    if entries.pop(rel, None) is not None:
+                        removed += 1
+                    continue
+                entry = entries.get(rel)
+                if entry is not None and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+                    continue
+                try:
+                    entry = reader(path)
+                except Exception as ex:
+                    warn_msg("Failed to index [{}]: {}", path, str(ex))
+                    entry = {'error': str(ex)}
+                entry['mtime_ns'] = st.st_mtime_ns
+                entry['size'] = st.st_size
+                entries[rel] = entry
+                read += 1
+        if read or removed or not os.path.isfile(self.index_path):
+            self.data['updated'] = time.time()
+            self._save()
+        debug_msg("Index of [{}]: {} files read, {} removed", self.instance_dir, read, removed)
+        return read
+
+    def get(self):
+        if self.data is None:
+            self.refresh()
+        return self.data
+
+    def get_names(self):
+        names = {}
+        for entry in self.get()['names'].values():
+            names.update(entry.get('names', {}))
+        return names
+
+    def get_worlds(self):
+        """{world directory: level entry}"""
+        return {os.path.dirname(rel): entry for rel, entry in self.get()['worlds'].items()}
+
+    def get_players(self):
+        """Player entries, each with its 'world' and 'name' (None if unknown)"""
+        names = self.get_names()
+        players = []
+        for rel, entry in sorted(self.get()['players'].items()):
+            if 'error' in entry:
+                continue
+            players.append(dict(entry, world=rel.split(os.sep)[0], name=names.get(entry['uuid'])))
+        return players
+
+    def find_player(self, ident):
+        """Entries of a player, by uuid or (case-insensitive) name"""
+        ident = ident.lower()
+        return [player for player in self.get_players()
+                if player['uuid'].lower() == ident or (player['name'] or '').lower() == ident]
+
+    def get_chunk_counts(self):
+        """{region path: chunk count}"""
+        return {rel: entry.get('chunks', 0) for rel, entry in self.get()['regions'].items()}
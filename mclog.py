@@ -0,0 +1,206 @@
+##############################################################################
+#
+# Logging for the mc-server-tools scripts
+#
+# Messages are format strings with their arguments passed separately, and
+# are only formatted when their level is enabled:
+#
+#     log = mclog.get_logger('mcadmin')
+#     log.debug("Fetched [{}] in {} tries", url, tries)
+#
+# The level and output format come from configure(), which the command line
+# tools call with their flags, or from the environment:
+#
+#     MCADMIN_LOG_LEVEL=debug|info|warn|error     (default: info)
+#     MCADMIN_LOG_FORMAT=text|json                (default: text)
+#
+# Text output keeps the 'INFO : message' layout; JSON output writes one
+# object per line with the time, level, logger, thread, message and any
+# structured fields given as keyword arguments.
+#
+##############################################################################
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+
+LOG_LEVEL_ENV_VAR = 'MCADMIN_LOG_LEVEL'
+LOG_FORMAT_ENV_VAR = 'MCADMIN_LOG_FORMAT'
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warn': WARN, 'warning': WARN, 'error': ERROR}
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARN: 'warn', ERROR: 'error'}
+LEVEL_PREFIXES = {DEBUG: 'DEBUG:', INFO: 'INFO :', WARN: 'WARN :', ERROR: 'ERROR:'}
+# Timing fields already spelled out in the text of timing records
+TEXT_HIDDEN_FIELDS = ('operation', 'elapsed_ms')
+
+_level = INFO
+_json = False
+_stream = None
+_lock = threading.Lock()
+_unknown_levels = set()
+
+
+def parse_level(value):
+    """Level from a name ('debug', 'info', ...) or number; None if it is neither"""
+    if isinstance(value, int):
+        return value
+    value = str(value).strip().lower()
+    if value.isdigit():
+        return int(value)
+    return LEVELS.get(value)
+
+
+def configure(level=None, json_format=None, stream=None):
+    """
+    Set the level and output format. Anything not given is taken from the
+    environment, or left at its default.
+    """
+    global _level, _json, _stream
+    if level is None:
+        level = os.environ.get(LOG_LEVEL_ENV_VAR, 'info')
+    parsed = parse_level(level)
+    if parsed is None:
+        parsed = INFO
+        if level not in _unknown_levels:
+            _unknown_levels.add(level)
+            _write(WARN, 'mclog', "Unknown log level [{}]; using info".format(level), {})
+    if json_format is None:
+        json_format = os.environ.get(LOG_FORMAT_ENV_VAR, 'text').strip().lower() == 'json'
+    _level = parsed
+    _json = json_format
+    _stream = stream
+
+
+def is_enabled(level):
+    return level >= _level
+
+
+def _format_time(now):
+    return '{}.{:03d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)), int(now % 1 * 1000))
+
+
+def _write(level, name, message, fields):
+    if _json:
+        record = {'time': _format_time(time.time()),
+                  'level': LEVEL_NAMES.get(level, str(level)),
+                  'logger': name,
+                  'thread': threading.current_thread().name,
+                  'message': message}
+        record.update(fields)
+        line = json.dumps(record, default=str)
+    else:
+        line = '{} {}'.format(LEVEL_PREFIXES.get(level, 'LOG{}:'.format(level)), message)
+        shown = ['{}={}'.format(key, value) for key, value in fields.items() if key not in TEXT_HIDDEN_FIELDS]
+        if shown:
+            line += ' ({})'.format(', '.join(shown))
+
+    stream = _stream if _stream is not None else sys.stderr
+    # One write per record, so lines from concurrent threads never interleave
+    with _lock:
+        stream.write(line + '\n')
+        stream.flush()
+
+
+class Logger(object):
+    def __init__(self, name):
+        self.name = name
+
+    def log(self, level, msg, *args, **fields):
+        if level >= _level:
+            _write(level, self.name, msg.format(*args) if args else msg, fields)
+
+    def debug(self, msg, *args, **fields):
+        if DEBUG >= _level:
+            _write(DEBUG, self.name, msg.format(*args) if args else msg, fields)
+
+    def info(self, msg, *args, **fields):
+        if INFO >= _level:
+            _write(INFO, self.name, msg.format(*args) if args else msg, fields)
+
+    def warn(self, msg, *args, **fields):
+        if WARN >= _level:
+            _write(WARN, self.name, msg.format(*args) if args else msg, fields)
+
+    def error(self, msg, *args, **fields):
+        if ERROR >= _level:
+            _write(ERROR, self.name, msg.format(*args) if args else msg, fields)
+
+    def timed(self, operation, level=DEBUG, **fields):
+        """
+        Context manager logging how long operation took, as an elapsed_ms
+        field. Fields can be added to the record while the operation runs,
+        through the 'fields' attribute of the returned timer.
+        """
+        return Timer(self, operation, level, fields)
+
+    def timing(self, operation, level=DEBUG):
+        """Decorator form of timed(), timing every call of a function"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with Timer(self, operation, level, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+
+class Timer(object):
+    __slots__ = ('logger', 'operation', 'level', 'fields', 'start')
+
+    def __init__(self, logger, operation, level, fields):
+        self.logger = logger
+        self.operation = operation
+        self.level = level
+        self.fields = fields
+        self.start = None
+
+    def __enter__(self):
+        if self.level >= _level:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.start is None:
+            return False
+        self.fields['operation'] = self.operation
+        self.fields['elapsed_ms'] = round((time.perf_counter() - self.start) * 1000, 3)
+        if exc_type is not None:
+            self.fields['error'] = str(exc)
+        self.logger.log(self.level, "{} took {:.1f}ms", self.operation, self.fields['elapsed_ms'], **self.fields)
+        return False
+
+
+_loggers = {}
+
+
+def get_logger(name):
+    if name not in _loggers:
+        _loggers[name] = Logger(name)
+    return _loggers[name]
+
+
+def add_arguments(parser):
+    """Add the common logging flags to an argparse parser"""
+    parser.add_argument('-v', '--verbose', action='store_const', dest='log_level', const='debug',
+                        help="log debug messages")
+    parser.add_argument('-q', '--quiet', action='store_const', dest='log_level', const='warn',
+                        help="only log warnings and errors")
+    parser.add_argument('--log-level', choices=sorted(LEVELS), help="log level (default: ${}, or info)".format(LOG_LEVEL_ENV_VAR))
+    parser.add_argument('--log-json', action='store_true', default=None,
+                        help="log one JSON object per line (default: ${}=json)".format(LOG_FORMAT_ENV_VAR))
+
+
+def configure_from_args(args):
+    configure(level=getattr(args, 'log_level', None), json_format=getattr(args, 'log_json', None))
+
+
+configure()
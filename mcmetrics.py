@@ -0,0 +1,248 @@
+##############################################################################
+#
+# Counters, gauges and histograms for the mc-server-tools scripts
+#
+# Each process records into the in-memory REGISTRY; flush() merges what was
+# recorded into a JSON file shared by every process using the same working
+# directory, so short lived CLI runs add up. The file can be rendered in the
+# Prometheus text exposition format or exported as JSON.
+#
+##############################################################################
+
+import json
+import os
+import threading
+import time
+
+import mcfs
+
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+METRICS_FILE = 'metrics.json'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'mcadmin_cache_requests_total': (COUNTER, "get_url_and_cache calls, by result: hit, coalesced (fetched by a concurrent caller) or miss", None),
+    'mcadmin_cache_revalidations_total': (COUNTER, "Conditional requests for expired cache entries, by result: not_modified or modified", None),
+    'mcadmin_cache_fetch_bytes_total': (COUNTER, "Bytes received by get_url_and_cache", None),
+    'mcadmin_cache_fetch_seconds': (HISTOGRAM, "Latency of get_url_and_cache network requests", LATENCY_BUCKETS),
+    'mcadmin_cache_fetch_errors_total': (COUNTER, "Failed get_url_and_cache requests, by whether a stale copy was served", None),
+    'mcadmin_downloads_total': (COUNTER, "File downloads, by result: ok, failed or verify_failed", None),
+    'mcadmin_download_bytes_total': (COUNTER, "Bytes transferred by file downloads", None),
+    'mcadmin_download_seconds': (HISTOGRAM, "Duration of successful file downloads", LATENCY_BUCKETS),
+    'mcadmin_download_throughput_bytes_per_second': (GAUGE, "Throughput of the most recent successful download", None),
+    'mcadmin_merges_total': (COUNTER, "Property list merges, by type and result: updated, unchanged or failed", None),
+    'mcadmin_merge_entries_total': (COUNTER, "Entries in merged property lists, by type", None),
+    'mcadmin_merge_seconds': (HISTOGRAM, "Duration of property list merges, by type", LATENCY_BUCKETS),
+    'mcadmin_texture_files_total': (COUNTER, "Texture files processed, by result: extracted, linked or unchanged", None),
+    'mcadmin_texture_bytes_total': (COUNTER, "Bytes inflated by texture extraction", None),
+    'mcadmin_texture_extract_seconds': (HISTOGRAM, "Duration of texture extraction runs", LATENCY_BUCKETS),
+    'mcservice_lookups_total': (COUNTER, "Lookups served, by kind (player or ip) and result (banned or clear)", None),
+    'mcservice_reloads_total': (COUNTER, "Property list reloads, by list and result", None),
+}
+
+
+def _label_key(labels):
+    return json.dumps(sorted(labels.items())) if labels else ''
+
+
+def _parse_label_key(key):
+    return dict(json.loads(key)) if key else {}
+
+
+def _buckets(name):
+    spec = METRICS.get(name)
+    return spec[2] if spec is not None and spec[2] is not None else LATENCY_BUCKETS
+
+
+def empty_snapshot():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def merge_snapshots(into, other):
+    """Add the counters and histograms of other into into; gauges take other's value"""
+    for name, series in other.get('counters', {}).items():
+        target = into['counters'].setdefault(name, {})
+        for key, value in series.items():
+            target[key] = target.get(key, 0) + value
+    for name, series in other.get('gauges', {}).items():
+        into['gauges'].setdefault(name, {}).update(series)
+    for name, series in other.get('histograms', {}).items():
+        target = into['histograms'].setdefault(name, {})
+        for key, value in series.items():
+            if key not in target or len(target[key]['buckets']) != len(value['buckets']):
+                target[key] = {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                continue
+            hist = target[key]
+            hist['buckets'] = [a + b for a, b in zip(hist['buckets'], value['buckets'])]
+            hist['sum'] += value['sum']
+            hist['count'] += value['count']
+    return into
+
+
+class MCMetrics(object):
+    """Thread-safe metric values recorded by this process since the last flush"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = empty_snapshot()
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._data['counters'].setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._data['gauges'].setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        buckets = _buckets(name)
+        with self._lock:
+            series = self._data['histograms'].setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {'buckets': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+            n = 0
+            while n < len(buckets) and value > buckets[n]:
+                n += 1
+            hist['buckets'][n] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def time(self, name, **labels):
+        """Context manager observing the duration of a block, in seconds"""
+        return _Timer(self, name, labels)
+
+    def snapshot(self, reset=False):
+        with self._lock:
+            data = json.loads(json.dumps(self._data))
+            if reset:
+                self._data = empty_snapshot()
+        return data
+
+    def is_empty(self):
+        with self._lock:
+            return not any(self._data.values())
+
+    def flush(self, path):
+        """Merge what was recorded into the metrics file at path, then start over"""
+        if self.is_empty() or not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            return True
+        data = self.snapshot(reset=True)
+        try:
+            with mcfs.file_lock(path + '.lock'):
+                merged = merge_snapshots(load(path), data)
+                mcfs.atomic_write(path, json.dumps(merged, sort_keys=True).encode())
+        except Exception:
+            # Keep the values for the next flush
+            with self._lock:
+                self._data = merge_snapshots(data, self._data)
+            raise
+        return True
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'name', 'labels', 'start')
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+def load(path):
+    """The metrics recorded in the file at path; empty if there are none or it is unreadable"""
+    try:
+        with open(path, 'r') as fp:
+            data = json.load(fp)
+    except (OSError, ValueError):
+        return empty_snapshot()
+    return merge_snapshots(empty_snapshot(), data)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        escaped.append('{}="{}"'.format(key, value))
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus(snapshot):
+    """Render a snapshot in the Prometheus text exposition format"""
+    lines = []
+    families = []
+    for kind, section in ((COUNTER, 'counters'), (GAUGE, 'gauges'), (HISTOGRAM, 'histograms')):
+        for name, series in snapshot.get(section, {}).items():
+            families.append((name, kind, series))
+
+    for name, kind, series in sorted(families):
+        spec = METRICS.get(name)
+        if spec is not None:
+            lines.append('# HELP {} {}'.format(name, spec[1]))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for key in sorted(series):
+            labels = _parse_label_key(key)
+            if kind != HISTOGRAM:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(series[key])))
+                continue
+            hist = series[key]
+            bounds = list(_buckets(name))[:len(hist['buckets']) - 1] + [float('inf')]
+            cumulative = 0
+            for bound, count in zip(bounds, hist['buckets']):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(dict(labels, le=_format_value(float(bound)))), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(float(hist['sum']))))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), hist['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def export_json(snapshot):
+    """A snapshot as {name: {'type', 'help', 'samples': [...]}} with plain label dicts"""
+    out = {}
+    for kind, section in ((COUNTER, 'counters'), (GAUGE, 'gauges'), (HISTOGRAM, 'histograms')):
+        for name, series in snapshot.get(section, {}).items():
+            spec = METRICS.get(name)
+            samples = []
+            for key in sorted(series):
+                sample = {'labels': _parse_label_key(key)}
+                if kind == HISTOGRAM:
+                    hist = series[key]
+                    bounds = list(_buckets(name))[:len(hist['buckets']) - 1] + ['+Inf']
+                    sample.update({'count': hist['count'], 'sum': hist['sum'],
+                                   'buckets': dict(zip([str(bound) for bound in bounds], hist['buckets']))})
+                else:
+                    sample['value'] = series[key]
+                samples.append(sample)
+            out[name] = {'type': kind, 'help': spec[1] if spec is not None else '', 'samples': samples}
+    return out
+
+
+REGISTRY = MCMetrics()
@@ -0,0 +1,418 @@
+##############################################################################
+#
+# NBT (Named Binary Tag) decoder
+#
+# Reads the big endian NBT used by level.dat, playerdata and region chunks
+# lazily, straight out of a bytes-like buffer through memoryview slices:
+#
+#     root = mcnbt.parse(data)[1]
+#     root['Data']['Version']['Name']
+#
+# A compound only records where its entries start, the first time one of
+# them is asked for; entries never asked for are skipped over without
+# being decoded. Lists decode their items on access, and the byte/int/long
+# array tags are NBTArray views of the big endian data, which numpy reads
+# in place (numpy.frombuffer(value.raw, value.dtype)) without a copy.
+#
+# The buffer must stay unchanged while values decoded from it are in use.
+#
+##############################################################################
+
+import array
+import collections.abc
+import gzip
+import struct
+import sys
+import zlib
+
+
+TAG_END = 0
+TAG_BYTE = 1
+TAG_SHORT = 2
+TAG_INT = 3
+TAG_LONG = 4
+TAG_FLOAT = 5
+TAG_DOUBLE = 6
+TAG_BYTE_ARRAY = 7
+TAG_STRING = 8
+TAG_LIST = 9
+TAG_COMPOUND = 10
+TAG_INT_ARRAY = 11
+TAG_LONG_ARRAY = 12
+
+SCALARS = {
+    TAG_BYTE: struct.Struct('>b'),
+    TAG_SHORT: struct.Struct('>h'),
+    TAG_INT: struct.Struct('>i'),
+    TAG_LONG: struct.Struct('>q'),
+    TAG_FLOAT: struct.Struct('>f'),
+    TAG_DOUBLE: struct.Struct('>d'),
+}
+# Array tag: array.array typecode, item size and numpy dtype
+ARRAYS = {
+    TAG_BYTE_ARRAY: ('b', 1, '>i1'),
+    TAG_INT_ARRAY: ('i', 4, '>i4'),
+    TAG_LONG_ARRAY: ('q', 8, '>i8'),
+}
+
+LENGTH = struct.Struct('>i')
+STRING_LENGTH = struct.Struct('>H')
+
+
+class NBTError(ValueError):
+    pass
+
+
+def _string_end(data, pos):
+    return pos + 2 + STRING_LENGTH.unpack_from(data, pos)[0]
+
+
+def _read_string(data, pos):
+    end = _string_end(data, pos)
+    if end > len(data):
+        raise NBTError("string past the end of the data")
+    return str(data[pos + 2:end], 'utf-8', errors='surrogateescape'), end
+
+
+# Payload sizes of the fixed size tags
+SIZES = {tag: scalar.size for tag, scalar in SCALARS.items()}
+# Item sizes of the array tags
+ITEM_SIZES = {tag: spec[1] for tag, spec in ARRAYS.items()}
+
+
+def _length(data, pos):
+    """Item count of a list or array tag at pos"""
+    count = LENGTH.unpack_from(data, pos)[0]
+    if count < 0:
+        raise NBTError("negative length {} at offset {}".format(count, pos))
+    return count
+
+
+def _skip(data, pos, tag):
+    """
+    Offset just past a payload of type tag at pos, without decoding it.
+    A header cut short raises IndexError or struct.error, which callers
+    turn into NBTError.
+    """
+    size = SIZES.get(tag)
+    if size is not None:
+        end = pos + size
+    elif tag == TAG_STRING:
+        end = pos + 2 + (data[pos] << 8 | data[pos + 1])
+    elif tag == TAG_COMPOUND:
+        while True:
+            # Indexing past the end raises, so a compound never ends beyond the data
+            child = data[pos]
+            if child == TAG_END:
+                return pos + 1
+            pos += 3 + (data[pos + 1] << 8 | data[pos + 2])
+            size = SIZES.get(child)
+            pos = pos + size if size is not None else _skip(data, pos, child)
+    elif tag == TAG_LIST:
+        child = data[pos]
+        count = _length(data, pos + 1)
+        pos += 5
+        size = SIZES.get(child)
+        if size is None:
+            for _ in range(count):
+                pos = _skip(data, pos, child)
+            return pos
+        end = pos + count * size
+    elif tag in ITEM_SIZES:
+        end = pos + 4 + _length(data, pos) * ITEM_SIZES[tag]
+    else:
+        raise NBTError("unknown tag type {} at offset {}".format(tag, pos))
+    if end > len(data):
+        raise NBTError("tag type {} at offset {} runs past the end of the data".format(tag, pos))
+    return end
+
+
+def _read(data, pos, tag):
+    """Value of a payload of type tag at pos; compounds, lists and arrays are lazy views"""
+    try:
+        scalar = SCALARS.get(tag)
+        if scalar is not None:
+            return scalar.unpack_from(data, pos)[0]
+        if tag == TAG_STRING:
+            return _read_string(data, pos)[0]
+        if tag == TAG_COMPOUND:
+            return Compound(data, pos)
+        if tag == TAG_LIST:
+            return List(data, pos)
+        if tag in ARRAYS:
+            return NBTArray(data, pos, tag)
+    except (struct.error, IndexError) as ex:
+        raise NBTError("truncated NBT data: {}".format(str(ex)))
+    raise NBTError("unknown tag type {} at offset {}".format(tag, pos))
+
+
+class NBTArray(collections.abc.Sequence):
+    """A byte, int or long array tag: a view of its big endian items"""
+
+    __slots__ = ('raw', 'typecode', 'dtype', '_struct', '_count')
+
+    def __init__(self, data, pos, tag):
+        typecode, size, dtype = ARRAYS[tag]
+        count = _length(data, pos)
+        end = pos + 4 + count * size
+        if end > len(data):
+            raise NBTError("array of {} items past the end of the data".format(count))
+        self.raw = memoryview(data)[pos + 4:end]
+        self.typecode = typecode
+        self.dtype = dtype
+        self._struct = struct.Struct('>' + typecode)
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("array index out of range")
+        return self._struct.unpack_from(self.raw, index * self._struct.size)[0]
+
+    def __iter__(self):
+        return (value for (value,) in self._struct.iter_unpack(self.raw))
+
+    def to_array(self):
+        """The items as an array.array in native byte order (a copy)"""
+        values = array.array(self.typecode)
+        values.frombytes(self.raw)
+        if self._struct.size > 1 and sys.byteorder == 'little':
+            values.byteswap()
+        return values
+
+
+class List(collections.abc.Sequence):
+    """A list tag, decoding its items on access"""
+
+    __slots__ = ('_data', '_start', 'tag', '_count', '_offsets')
+
+    def __init__(self, data, pos):
+        self._data = data
+        self.tag = data[pos]
+        self._count = _length(data, pos + 1)
+        self._start = pos + 5
+        scalar = SCALARS.get(self.tag)
+        if scalar is not None and self._start + self._count * scalar.size > len(data):
+            raise NBTError("list of {} items past the end of the data".format(self._count))
+        self._offsets = None
+
+    def __len__(self):
+        return self._count
+
+    def _offset(self, index):
+        scalar = SCALARS.get(self.tag)
+        if scalar is not None:
+            return self._start + index * scalar.size
+        if self._offsets is None:
+            offsets = []
+            pos = self._start
+            try:
+                for _ in range(self._count):
+                    offsets.append(pos)
+                    pos = _skip(self._data, pos, self.tag)
+            except (struct.error, IndexError) as ex:
+                raise NBTError("truncated NBT data: {}".format(str(ex)))
+            self._offsets = offsets
+        return self._offsets[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("list index out of range")
+        return _read(self._data, self._offset(index), self.tag)
+
+    def __iter__(self):
+        if self._offsets is not None or self.tag in SCALARS:
+            for index in range(self._count):
+                yield _read(self._data, self._offset(index), self.tag)
+            return
+        pos = self._start
+        for _ in range(self._count):
+            yield _read(self._data, pos, self.tag)
+            try:
+                pos = _skip(self._data, pos, self.tag)
+            except (struct.error, IndexError) as ex:
+                raise NBTError("truncated NBT data: {}".format(str(ex)))
+
+
+class Compound(collections.abc.Mapping):
+    """
+    A compound tag. Entries are located by scanning forward only as far as
+    the entry asked for, skipping the values passed over, and decoded on
+    demand; iterating or taking the length scans to the end.
+    """
+
+    __slots__ = ('_data', '_start', '_entries', '_scan')
+
+    def __init__(self, data, pos):
+        self._data = data
+        self._start = pos
+        self._entries = {}
+        # Offset of the next entry to scan; None once the end was reached
+        self._scan = pos
+
+    def _scan_to(self, wanted=None):
+        """Scan entries until wanted (or, if None, all of them) is found"""
+        data = self._data
+        entries = self._entries
+        pos = self._scan
+        try:
+            while pos is not None:
+                tag = data[pos]
+                if tag == TAG_END:
+                    pos = None
+                    break
+                name, value_pos = _read_string(data, pos + 1)
+                entries[name] = (tag, value_pos)
+                pos = _skip(data, value_pos, tag)
+                if name == wanted:
+                    break
+        except (struct.error, IndexError) as ex:
+            raise NBTError("truncated NBT data: {}".format(str(ex)))
+        finally:
+            self._scan = pos
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is None and self._scan is not None:
+            self._scan_to(name)
+            entry = self._entries.get(name)
+        return entry
+
+    def __getitem__(self, name):
+        entry = self._entry(name)
+        if entry is None:
+            raise KeyError(name)
+        return _read(self._data, entry[1], entry[0])
+
+    def __iter__(self):
+        if self._scan is not None:
+            self._scan_to()
+        return iter(self._entries)
+
+    def __len__(self):
+        if self._scan is not None:
+            self._scan_to()
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return self._entry(name) is not None
+
+    def get_tag(self, name):
+        """Tag type of an entry; None if there is no such entry"""
+        entry = self._entry(name)
+        return entry[0] if entry is not None else None
+
+
+def _decode(data, pos, tag):
+    """(value, end offset) of a payload, decoded eagerly into plain values"""
+    scalar = SCALARS.get(tag)
+    if scalar is not None:
+        return scalar.unpack_from(data, pos)[0], pos + scalar.size
+    if tag == TAG_STRING:
+        return _read_string(data, pos)
+    if tag == TAG_COMPOUND:
+        value = {}
+        while True:
+            child = data[pos]
+            if child == TAG_END:
+                return value, pos + 1
+            name, pos = _read_string(data, pos + 1)
+            value[name], pos = _decode(data, pos, child)
+    if tag == TAG_LIST:
+        child = data[pos]
+        count = _length(data, pos + 1)
+        pos += 5
+        scalar = SCALARS.get(child)
+        if scalar is not None:
+            end = pos + count * scalar.size
+            if end > len(data):
+                raise NBTError("list of {} items past the end of the data".format(count))
+            return [value for (value,) in scalar.iter_unpack(data[pos:end])], end
+        items = []
+        for _ in range(count):
+            item, pos = _decode(data, pos, child)
+            items.append(item)
+        return items, pos
+    if tag in ARRAYS:
+        array_value = NBTArray(data, pos, tag)
+        return list(array_value), pos + 4 + len(array_value.raw)
+    raise NBTError("unknown tag type {} at offset {}".format(tag, pos))
+
+
+def unwrap(value):
+    """Fully decode a value into plain dicts, lists and numbers"""
+    try:
+        if isinstance(value, Compound):
+            return _decode(value._data, value._start, TAG_COMPOUND)[0]
+        if isinstance(value, List):
+            return _decode(value._data, value._start - 5, TAG_LIST)[0]
+    except (struct.error, IndexError) as ex:
+        raise NBTError("truncated NBT data: {}".format(str(ex)))
+    if isinstance(value, NBTArray):
+        return list(value)
+    return value
+
+
+def parse(data):
+    """(name, root compound) of uncompressed NBT data"""
+    if not isinstance(data, bytes):
+        # Indexing bytes is faster, but any other buffer is read in place
+        data = memoryview(data)
+    try:
+        if data[0] != TAG_COMPOUND:
+            raise NBTError("root tag is not a compound")
+        name, pos = _read_string(data, 1)
+        root = Compound(data, pos)
+    except (struct.error, IndexError) as ex:
+        raise NBTError("truncated NBT data: {}".format(str(ex)))
+    return name, root
+
+
+def decompress(data):
+    """Inflate gzip or zlib compressed NBT; data that is neither is returned as is"""
+    if data[:2] == b'\x1f\x8b':
+        return gzip.decompress(data)
+    if data[:1] == b'\x78':
+        return zlib.decompress(data)
+    return data
+
+
+def load(path):
+    """Root compound of an NBT file such as level.dat, compressed or not"""
+    with open(path, 'rb') as fp:
+        return parse(decompress(fp.read()))[1]
+
+
+def read_chunk(region, index):
+    """Root compound of a chunk of an open mcregion.RegionFile; None if it is not present"""
+    import mcregion
+    if not region.locations[index]:
+        return None
+    compression, data = region.read_chunk(index)
+    with data:
+        if compression & mcregion.COMPRESSION_EXTERNAL:
+            with open(region.get_external_path(index), 'rb') as fp:
+                payload = fp.read()
+            compression &= ~mcregion.COMPRESSION_EXTERNAL
+        else:
+            payload = data
+        if compression == mcregion.COMPRESSION_ZLIB:
+            raw = zlib.decompress(payload)
+        elif compression == mcregion.COMPRESSION_GZIP:
+            raw = gzip.decompress(payload)
+        elif compression == mcregion.COMPRESSION_NONE:
+            # Copied: views into the region's mapping would outlive it
+            raw = bytes(payload)
+        else:
+            raise NBTError("unsupported chunk compression type {}".format(compression))
+    return parse(raw)[1]
@@ -10,22 +10,49 @@
 #
 ##############################################################################
 
+import argparse
+import atexit
 import json
 import sys
 import os
-import pprint
 
+import mcfs
+import mclog
 
-def eprint(*args, **kwargs):
-    print(*args, file=sys.stderr, **kwargs)
 
+PROP_FILES = ['banned-ips', 'banned-players', 'ops', 'whitelist']
 
-def error_msg(*args, **kwargs):
-    eprint("ERROR:", *args, **kwargs)
+# Fields identifying duplicate entries, per property file type. An entry
+# matching an existing one on any of its keys is a duplicate.
+PROP_KEYS = {
+    'banned-ips': ('ip',),
+    'banned-players': ('uuid', 'name'),
+    'ops': ('uuid',),
+    'whitelist': ('uuid', 'name'),
+}
+DEFAULT_PROP_KEYS = ('uuid',)
 
+STREAM_CHUNK_SIZE = 64 * 1024
 
-def info_msg(*args, **kwargs):
-    eprint("INFO :", *args, **kwargs)
+# Field deciding which of two duplicate entries wins; the higher value is kept
+PROP_PRECEDENCE = {
+    'ops': 'level',
+}
+
+
+log = mclog.get_logger('mcpropmerge')
+error_msg = log.error
+info_msg = log.info
+
+
+def get_prop_type(filename):
+    """Property file type from a path, e.g. 'conf/ops.json' or 'local.ops.json' -> 'ops'"""
+    name = os.path.basename(filename)
+    if name.endswith('.json'):
+        name = name[:-len('.json')]
+    if name.startswith('local.'):
+        name = name[len('local.'):]
+    return name
 
 
 def load_props(filename):
@@ -34,69 +61,442 @@ def load_props(filename):
         with open(filename, 'rb') as fp:
             props = json.load(fp)
     except Exception as ex:
-        error_msg("Failed to read properties from [{}]: {}".format(filename, str(ex)))
+        error_msg("Failed to read properties from [{}]: {}", filename, str(ex))
         return None
 
     if type(props) != type([]):
-        error_msg("Expected top level array, found [{}] instead".format(type(props)))
+        error_msg("Expected top level array, found [{}] instead", type(props))
         return None
 
     return props
 
 
-def prop_merge(global_filename, local_filename):
+def prop_keys(entry, prop_type):
+    """Hashable dedup keys for an entry; empty if it cannot be matched"""
+    if type(entry) != type({}):
+        return []
+    keys = []
+    for field in PROP_KEYS.get(prop_type, DEFAULT_PROP_KEYS):
+        value = entry.get(field)
+        if isinstance(value, str) and value:
+            keys.append((field, value.lower()))
+    return keys
+
+
+def build_index(props, prop_type):
+    """Map each dedup key of a property list to the position of its entry"""
+    index = {}
+    for pos, entry in enumerate(props):
+        for key in prop_keys(entry, prop_type):
+            index.setdefault(key, pos)
+    return index
+
+
+def _outranks(entry, existing, prop_type):
+    field = PROP_PRECEDENCE.get(prop_type)
+    if field is None:
+        return False
+    try:
+        return int(entry.get(field, 0)) > int(existing.get(field, 0))
+    except (TypeError, ValueError):
+        return False
+
+
+def merge_props(g_props, l_props, prop_type, g_index=None):
+    """
+    Merge local entries into a copy of the global list. Global entries come
+    first and win over local duplicates, unless the file type has a
+    precedence field (ops 'level') and the local entry ranks higher. Pass a
+    prebuilt g_index to merge many local lists against the same globals;
+    neither g_props nor g_index is modified.
+    """
+    if g_index is None:
+        g_index = build_index(g_props, prop_type)
+
+    merged = list(g_props)
+    added = {}
+    for entry in l_props:
+        keys = prop_keys(entry, prop_type)
+        if not keys:
+            merged.append(entry)
+            continue
+
+        pos = None
+        for key in keys:
+            pos = g_index.get(key, added.get(key))
+            if pos is not None:
+                break
+
+        if pos is None:
+            for key in keys:
+                added[key] = len(merged)
+            merged.append(entry)
+        elif _outranks(entry, merged[pos], prop_type):
+            merged[pos] = entry
+
+    return merged
+
+
+def missing_uuid_names(props, prop_type):
+    """Names of the entries that have a name but no uuid, for lists keyed on uuid"""
+    if 'uuid' not in PROP_KEYS.get(prop_type, DEFAULT_PROP_KEYS):
+        return []
+    names = []
+    for entry in props:
+        if type(entry) == type({}) and not entry.get('uuid') and isinstance(entry.get('name'), str) and entry['name']:
+            names.append(entry['name'])
+    return names
+
+
+def fill_uuids(props, prop_type, resolve):
+    """
+    Copy of props where entries with a name but no uuid get the uuid that
+    resolve() finds for the name. resolve takes a list of names and returns
+    a mapping of name to uuid (None when unknown). Unresolved entries are
+    kept unchanged.
+    """
+    names = missing_uuid_names(props, prop_type)
+    if not names:
+        return props
+    uuids = resolve(names)
+    filled = []
+    for entry in props:
+        if type(entry) == type({}) and not entry.get('uuid') and uuids.get(entry.get('name')):
+            # Put the uuid first, where the server writes it
+            resolved = {'uuid': uuids[entry['name']]}
+            resolved.update((key, value) for key, value in entry.items() if key != 'uuid')
+            entry = resolved
+        filled.append(entry)
+    return filled
+
+
+def prop_merge(global_filename, local_filename, resolve=None):
     g_props = load_props(global_filename)
     l_props = load_props(local_filename)
 
     if g_props is None or l_props is None:
         return None
 
-    for entry in l_props:
-        if type(entry) == type({}) and 'uuid' in entry:
-            # only merge if uuid is not already in global
-            merge = True
-            for check in g_props:
-                if type(check) == type({}) and 'uuid' in check:
-                    if entry['uuid'] == check['uuid']:
-                        merge = False
-                        break
-            if merge:
-                g_props.append(entry)
+    prop_type = get_prop_type(local_filename)
+    if resolve is not None:
+        g_props = fill_uuids(g_props, prop_type, resolve)
+        l_props = fill_uuids(l_props, prop_type, resolve)
+    return merge_props(g_props, l_props, prop_type)
+
+
+def dump_entry(entry):
+    """Serialize one list entry exactly as json.dumps(props, indent=2) lays it out"""
+    if type(entry) == type({}) and entry and not any(isinstance(value, (dict, list)) for value in entry.values()):
+        # Flat objects (every vanilla entry) can use the C encoder; only separators differ
+        return '  {\n    ' + json.dumps(entry, separators=(',\n    ', ': '))[1:-1] + '\n  }'
+    return '  ' + json.dumps(entry, indent=2).replace('\n', '\n  ')
+
+
+def dump_entries(chunks):
+    if not chunks:
+        return '[]\n'
+    return '[\n' + ',\n'.join(chunks) + '\n]\n'
+
+
+def dump_props(props):
+    """Serialize a property list the way the server writes these files"""
+    return dump_entries([dump_entry(entry) for entry in props])
+
+
+class PropList(object):
+    """
+    A global property list that is parsed, indexed and serialized once, so
+    it can be merged into any number of local lists cheaply.
+    """
+
+    def __init__(self, props, prop_type):
+        self.props = props
+        self.prop_type = prop_type
+        self.index = build_index(props, prop_type)
+        self._dumped = [dump_entry(entry) for entry in props]
+        self._joined = ',\n'.join(self._dumped)
+
+    def merge(self, l_props):
+        return merge_props(self.props, l_props, self.prop_type, self.index)
+
+    def dump(self, merged):
+        """Serialize a list returned by merge(), reusing the serialized global entries"""
+        count = len(self.props)
+        if count and all(merged[pos] is self.props[pos] for pos in range(count)):
+            # Globals untouched: emit them as one pre-joined block
+            chunks = [self._joined]
         else:
-            g_props.append(entry)
+            count = 0
+            chunks = []
+        for pos in range(count, len(merged)):
+            if pos < len(self.props) and merged[pos] is self.props[pos]:
+                chunks.append(self._dumped[pos])
+            else:
+                chunks.append(dump_entry(merged[pos]))
+        return dump_entries(chunks)
+
+
+def write_props(filename, props):
+    try:
+        with mcfs.atomic_open(filename, 'w') as fp:
+            fp.write(dump_props(props))
+    except Exception as ex:
+        error_msg("Failed to write properties to [{}]: {}", filename, str(ex))
+        return False
+    return True
+
+
+def iter_props(fp, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Incrementally parse a top-level JSON array from a text stream, yielding
+    one entry at a time; only the entry being decoded is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+    seen = False
+
+    def fill(buf, pos):
+        chunk = fp.read(chunk_size)
+        return buf[pos:] + chunk, 0, not chunk
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise ValueError("unexpected end of array")
+            buf, pos, eof = fill(buf, pos)
+            continue
+
+        c = buf[pos]
+        if not started:
+            if c != '[':
+                raise ValueError("expected top level array")
+            started = True
+            expect_value = True
+            pos += 1
+            continue
+        if c == ']':
+            if expect_value and seen:
+                raise ValueError("unexpected ']' at offset {}".format(pos))
+            return
+        if c == ',':
+            if expect_value:
+                raise ValueError("unexpected ',' at offset {}".format(pos))
+            expect_value = True
+            pos += 1
+            continue
+        if not expect_value:
+            raise ValueError("expected ',' or ']' at offset {}".format(pos))
 
-    return g_props
+        try:
+            entry, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            buf, pos, eof = fill(buf, pos)
+            continue
+        if end >= len(buf) and not eof:
+            # A scalar cut off at the chunk boundary may decode short; read on and retry
+            buf, pos, eof = fill(buf, pos)
+            continue
+        yield entry
+        seen = True
+        expect_value = False
+        pos = end
 
 
-def usage():
-    eprint("{} <global-props.json> <local-props.json>".format(os.path.basename(sys.argv[0])))
+class PropWriter(object):
+    """Write a property list incrementally, in the same layout as dump_props()"""
+
+    def __init__(self, fp):
+        self._fp = fp
+        self._count = 0
+
+    def write(self, entry):
+        self._fp.write('[\n' if self._count == 0 else ',\n')
+        self._fp.write(dump_entry(entry))
+        self._count += 1
+
+    def close(self):
+        self._fp.write('\n]\n' if self._count else '[]\n')
+        return self._count
+
+
+def stream_merge(global_filename, local_filename, out, prop_type=None, resolve=None):
+    """
+    Merge like prop_merge(), but stream the global list from disk to out
+    entry by entry, so memory use depends on the local list only. Only the
+    local entries are indexed. Where a file type has a precedence field, it
+    is applied at the first global entry sharing a key with the local entry.
+    With resolve, missing uuids are filled in on the local list only.
+    Returns the number of entries written, or None on error.
+    """
+    if prop_type is None:
+        prop_type = get_prop_type(local_filename)
+
+    l_props = load_props(local_filename)
+    if l_props is None:
+        return None
+    if resolve is not None:
+        l_props = fill_uuids(l_props, prop_type, resolve)
+    l_index = {}
+    for pos, entry in enumerate(l_props):
+        for key in prop_keys(entry, prop_type):
+            l_index.setdefault(key, []).append(pos)
+
+    consumed = set()
+    writer = PropWriter(out)
+    try:
+        with open(global_filename, 'r', encoding='utf-8') as fp:
+            for entry in iter_props(fp):
+                best = entry
+                for key in prop_keys(entry, prop_type):
+                    for pos in l_index.get(key, ()):
+                        if pos in consumed:
+                            continue
+                        consumed.add(pos)
+                        if _outranks(l_props[pos], best, prop_type):
+                            best = l_props[pos]
+                writer.write(best)
+    except Exception as ex:
+        error_msg("Failed to stream properties from [{}]: {}", global_filename, str(ex))
+        return None
+
+    # Local entries not in the global list, deduplicated among themselves
+    remaining = [entry for pos, entry in enumerate(l_props) if pos not in consumed]
+    for entry in merge_props([], remaining, prop_type):
+        writer.write(entry)
+    return writer.close()
+
+
+def stream_merge_to_file(global_filename, local_filename, filename, prop_type=None, resolve=None):
+    count = None
+    try:
+        with mcfs.atomic_open(filename, 'w', encoding='utf-8') as fp:
+            count = stream_merge(global_filename, local_filename, fp, prop_type, resolve)
+            if count is None:
+                raise mcfs.Discard()
+    except Exception as ex:
+        error_msg("Failed to write properties to [{}]: {}", filename, str(ex))
+        return False
+    return count is not None
+
+
+def load_props_or_empty(filename):
+    if not os.path.exists(filename):
+        info_msg("No properties at [{}]; treating as empty", filename)
+        return []
+    return load_props(filename)
+
+
+def batch_merge(global_dir, instance_dir, prop_files=PROP_FILES, stream=False, resolve=None):
+    """
+    Merge every property file for a server instance in one pass: for each
+    type, <global_dir>/<type>.json and <instance_dir>/local.<type>.json are
+    merged into <instance_dir>/<type>.json. Missing inputs count as empty.
+    With stream, global lists are streamed rather than loaded. With
+    resolve, missing uuids are filled in before merging (see fill_uuids).
+    """
+    ok = True
+    for prop_type in prop_files:
+        info_msg("Merging {}...", prop_type)
+        if stream:
+            g_path = os.path.join(global_dir, '{}.json'.format(prop_type))
+            l_path = os.path.join(instance_dir, 'local.{}.json'.format(prop_type))
+            if os.path.exists(g_path) and os.path.exists(l_path):
+                if not stream_merge_to_file(g_path, l_path, os.path.join(instance_dir, '{}.json'.format(prop_type)), prop_type, resolve):
+                    ok = False
+                continue
+        g_props = load_props_or_empty(os.path.join(global_dir, '{}.json'.format(prop_type)))
+        l_props = load_props_or_empty(os.path.join(instance_dir, 'local.{}.json'.format(prop_type)))
+        if g_props is None or l_props is None:
+            ok = False
+            continue
+        if resolve is not None:
+            g_props = fill_uuids(g_props, prop_type, resolve)
+            l_props = fill_uuids(l_props, prop_type, resolve)
+        merged = merge_props(g_props, l_props, prop_type)
+        if not write_props(os.path.join(instance_dir, '{}.json'.format(prop_type)), merged):
+            ok = False
+    return ok
 
 
 def verify_path(path):
     if not os.path.exists(path):
-        error_msg("The file [{}] does not exist.".format(path))
+        error_msg("The file [{}] does not exist.", path)
         return False
 
     if not os.path.isfile(path):
-        error_msg("The path [{}] is not a file.".format(path))
+        error_msg("The path [{}] is not a file.", path)
+        return False
+
+    return True
+
+
+def verify_dir(path):
+    if not os.path.isdir(path):
+        error_msg("The path [{}] is not a directory.", path)
         return False
 
     return True
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge global Minecraft server property lists into local ones.",
+                                     epilog="With --batch, the arguments are the global config directory and the "
+                                            "instance directory, and all of {} are merged.".format(', '.join(PROP_FILES)))
+    parser.add_argument('--batch', action='store_true', help="merge every property file for an instance")
+    parser.add_argument('--stream', action='store_true', help="stream the global list instead of loading it; "
+                                                              "memory use then depends on the local list only")
+    parser.add_argument('--resolve', action='store_true', help="look up missing player uuids by name "
+                                                               "(uses the mcadmin working directory's cache)")
+    mclog.add_arguments(parser)
+    parser.add_argument('global_path', help="global property file (or directory with --batch)")
+    parser.add_argument('local_path', help="local property file (or instance directory with --batch)")
+    return parser.parse_args()
+
+
+def get_admin():
+    """The mcadmin instance whose profile resolver looks up names, or None if mcadmin is not set up"""
+    import mcadmin
+    admin = mcadmin.MCAdmin()
+    if not admin.is_init():
+        return None
+    return admin
+
+
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        usage()
-        exit(1)
+    args = parse_args()
+    mclog.configure_from_args(args)
+
+    resolve = None
+    if args.resolve:
+        admin = get_admin()
+        if admin is None:
+            exit(2)
+        # Saves the resolver's cache updates and metrics whichever way the merge exits
+        atexit.register(admin.close)
+        resolve = admin.resolve_names
 
-    if not verify_path(sys.argv[1]) or not verify_path(sys.argv[2]):
+    if args.batch:
+        if not verify_dir(args.global_path) or not verify_dir(args.local_path):
+            exit(2)
+        exit(0 if batch_merge(args.global_path, args.local_path, stream=args.stream, resolve=resolve) else 3)
+
+    if not verify_path(args.global_path) or not verify_path(args.local_path):
         exit(2)
 
-    result = prop_merge(sys.argv[1], sys.argv[2])
+    if args.stream:
+        exit(0 if stream_merge(args.global_path, args.local_path, sys.stdout, resolve=resolve) is not None else 3)
+
+    result = prop_merge(args.global_path, args.local_path, resolve)
     if result is None:
         exit(3)
 
-    pp = pprint.PrettyPrinter(indent=4)
-    pp.pprint(result)
+    sys.stdout.write(dump_props(result))
 
     exit(0)
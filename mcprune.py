@@ -0,0 +1,311 @@
+##############################################################################
+#
+# World pruning: drop chunks that were generated but never inhabited
+#
+# Every terrain chunk records in InhabitedTime how many ticks players have
+# spent near it, and in LastUpdate the game tick it was last saved at. A
+# chunk whose InhabitedTime is at most max_inhabited (and, optionally, whose
+# LastUpdate is at least min_age ticks behind the world's game time) is
+# dropped from its region file, together with the same chunk in the
+# entities and poi region files of the dimension. The game generates it
+# again the next time a player comes near.
+#
+# Region files are rewritten compact: the kept chunks are copied as they
+# are (no recompression) into consecutive sectors after the header, so the
+# free space left by the dropped chunks and by earlier chunk growth is
+# reclaimed. Each file is written to a temporary file and renamed over the
+# original, and a region left without chunks is removed.
+#
+# The server must be stopped while a world is pruned.
+#
+##############################################################################
+
+import argparse
+import json
+import os
+import struct
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import mcfs
+import mclog
+import mcnbt
+import mcregion
+
+
+TICKS_PER_SECOND = 20
+
+# Region directories holding per-chunk data that goes with the terrain chunk,
+# checked and pruned before it (see prune_region())
+COMPANION_DIRS = ['entities', 'poi']
+
+
+log = mclog.get_logger('mcprune')
+debug_msg = log.debug
+info_msg = log.info
+warn_msg = log.warn
+error_msg = log.error
+
+
+def chunk_activity(root):
+    """(InhabitedTime, LastUpdate) of a chunk, from the root compound or, before 1.18, its Level"""
+    level = root['Level'] if 'Level' in root else root
+    return level.get('InhabitedTime', 0), level.get('LastUpdate', 0)
+
+
+def select_chunks(region, max_inhabited=0, before=None):
+    """
+    Indexes of the chunks of an open terrain RegionFile to prune, and the
+    number of chunks that could not be read (which are always kept).
+    before, if given, is the game tick a chunk must be last saved at or
+    before to be pruned.
+    """
+    selected = []
+    errors = 0
+    for index, _, _, _ in region.chunks():
+        try:
+            inhabited, updated = chunk_activity(mcnbt.read_chunk(region, index))
+        except (ValueError, KeyError, TypeError, OSError, struct.error, zlib.error) as ex:
+            debug_msg("Keeping unreadable chunk {},{} of [{}]: {}", *mcregion.chunk_coords(index, region.coords),
+                      region.path, str(ex))
+            errors += 1
+            continue
+        if inhabited <= max_inhabited and (before is None or updated <= before):
+            selected.append(index)
+    return selected, errors
+
+
+def _is_external(region, index):
+    try:
+        compression, data = region.read_chunk(index)
+    except ValueError:
+        return False
+    data.release()
+    return bool(compression & mcregion.COMPRESSION_EXTERNAL)
+
+
+def _record_sectors(length):
+    return (length + 4 + mcregion.SECTOR_SIZE - 1) // mcregion.SECTOR_SIZE
+
+
+def compact_region(path, drop, dry_run=False):
+    """
+    Rewrite a region file without the chunk indexes in drop and without
+    free sectors. Returns {'chunks', 'dropped', 'bytes_before',
+    'bytes_after', 'rewritten', 'removed'}; bytes count the region file
+    and the external chunk files of dropped chunks. Raises ValueError,
+    leaving the file untouched, if a kept chunk cannot be copied.
+    """
+    result = {'chunks': 0, 'dropped': 0, 'bytes_before': 0, 'bytes_after': 0, 'rewritten': False, 'removed': False}
+    external = []
+    with mcregion.RegionFile(path) as region:
+        result['bytes_before'] = region.size
+        kept = []
+        for index, offset, _, timestamp in region.chunks():
+            result['chunks'] += 1
+            if index in drop:
+                result['dropped'] += 1
+                external_path = region.get_external_path(index)
+                if os.path.isfile(external_path) and _is_external(region, index):
+                    external.append(external_path)
+                    result['bytes_before'] += os.path.getsize(external_path)
+                continue
+            # Raises ValueError if the record is out of bounds, before anything is written
+            _, data = region.read_chunk(index)
+            with data:
+                kept.append((index, offset * mcregion.SECTOR_SIZE, len(data) + 1, timestamp))
+
+        if kept:
+            result['bytes_after'] = mcregion.HEADER_SIZE + \
+                sum(_record_sectors(length) for _, _, length, _ in kept) * mcregion.SECTOR_SIZE
+        if not result['dropped'] and result['bytes_after'] >= result['bytes_before']:
+            # Nothing to drop and already compact
+            result['bytes_after'] = result['bytes_before']
+            return result
+        if dry_run:
+            return result
+        if kept:
+            _write_compact(region, kept)
+            result['rewritten'] = True
+
+    if not kept:
+        os.remove(path)
+        result['removed'] = True
+    for external_path in external:
+        os.remove(external_path)
+    return result
+
+
+def _write_compact(region, kept):
+    locations = [0] * mcregion.CHUNKS_PER_REGION
+    timestamps = [0] * mcregion.CHUNKS_PER_REGION
+    sector = mcregion.HEADER_SIZE // mcregion.SECTOR_SIZE
+    with mcfs.atomic_open(region.path) as fp:
+        fp.seek(mcregion.HEADER_SIZE)
+        for index, start, length, timestamp in kept:
+            count = _record_sectors(length)
+            fp.write(region._view[start:start + 4 + length])
+            fp.write(b'\0' * (count * mcregion.SECTOR_SIZE - length - 4))
+            locations[index] = (sector << 8) | count
+            timestamps[index] = timestamp
+            sector += count
+        fp.seek(0)
+        fp.write(mcregion.HEADER.pack(*(locations + timestamps)))
+
+
+def prune_region(path, max_inhabited=0, before=None, dry_run=False):
+    """
+    Prune a terrain region file and its companions in the entities and poi
+    directories of the dimension. Returns {'path', 'chunks', 'pruned',
+    'bytes_before', 'bytes_after', 'unreadable', 'error'}, bytes summed
+    over all the files.
+    """
+    report = {'path': path, 'chunks': 0, 'pruned': 0, 'bytes_before': 0, 'bytes_after': 0, 'unreadable': 0, 'error': None}
+    try:
+        with mcregion.RegionFile(path) as region:
+            selected, report['unreadable'] = select_chunks(region, max_inhabited, before)
+        drop = frozenset(selected)
+
+        dimension_dir = os.path.dirname(os.path.dirname(path))
+        paths = [os.path.join(dimension_dir, name, os.path.basename(path)) for name in COMPANION_DIRS]
+        # A crash between two files then leaves terrain whose entities or
+        # points of interest are gone, rather than entities and points of
+        # interest duplicated into a regenerated chunk
+        paths = [companion for companion in paths if os.path.isfile(companion)] + [path]
+        # Check every file can be compacted before any is rewritten, so that
+        # a region reported as failed is left untouched
+        results = [compact_region(region_path, drop, dry_run=True) for region_path in paths]
+        if not dry_run:
+            results = [compact_region(region_path, drop) for region_path in paths]
+        for region_path, result in zip(paths, results):
+            if region_path == path:
+                report['chunks'] = result['chunks']
+                report['pruned'] = result['dropped']
+            report['bytes_before'] += result['bytes_before']
+            report['bytes_after'] += result['bytes_after']
+    except (OSError, ValueError) as ex:
+        report['error'] = str(ex)
+    return report
+
+
+def _prune_task(task):
+    return prune_region(*task)
+
+
+def find_terrain_regions(directory):
+    """Paths of the terrain region files of every dimension of the world save at directory"""
+    return [path for path in mcregion.find_regions(directory) if os.path.basename(os.path.dirname(path)) == 'region']
+
+
+def is_locked(directory):
+    """True if a running server holds the session.lock of the world save at directory"""
+    lock_path = os.path.join(directory, 'session.lock')
+    if fcntl is None or not os.path.isfile(lock_path):
+        return False
+    with open(lock_path, 'a') as fp:
+        try:
+            fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.lockf(fp, fcntl.LOCK_UN)
+    return False
+
+
+def get_game_time(directory):
+    """The game time in ticks of the world save at directory, from its level.dat"""
+    return mcnbt.load(os.path.join(directory, 'level.dat'))['Data']['Time']
+
+
+@log.timing('prune_world', mclog.INFO)
+def prune_world(directory, max_inhabited=0, min_age=0, dry_run=False, workers=None, progress=None):
+    """
+    Prune every dimension of the world save at directory, one region per
+    task in a process pool. max_inhabited and min_age are in ticks.
+    progress, if given, is called with each region's report as it
+    completes. Returns the world report, or None if the world cannot be
+    pruned:
+
+        {'path', 'dry_run', 'regions', 'chunks', 'pruned_chunks',
+         'bytes_before', 'bytes_after',
+         'failed': [region reports with an error, path relative to directory]}
+    """
+    import concurrent.futures
+    if not dry_run and is_locked(directory):
+        error_msg("World [{}] is in use by a running server", directory)
+        return None
+    before = None
+    if min_age:
+        try:
+            before = get_game_time(directory) - min_age
+        except (OSError, ValueError, KeyError) as ex:
+            error_msg("Cannot read the game time of [{}]: {}", directory, str(ex))
+            return None
+
+    paths = find_terrain_regions(directory)
+    report = {'path': directory, 'dry_run': dry_run, 'regions': len(paths), 'chunks': 0, 'pruned_chunks': 0,
+              'bytes_before': 0, 'bytes_after': 0, 'failed': []}
+    if not paths:
+        return report
+
+    tasks = [(path, max_inhabited, before, dry_run) for path in paths]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(_prune_task, tasks):
+            for key in ('chunks', 'bytes_before', 'bytes_after'):
+                report[key] += result[key]
+            report['pruned_chunks'] += result['pruned']
+            if result['error']:
+                result['path'] = os.path.relpath(result['path'], directory)
+                report['failed'].append(result)
+            if progress is not None:
+                progress(result)
+    return report
+
+
+def log_report(report):
+    """Log a world report's failed regions, then its summary; True if no region failed"""
+    for region in report['failed']:
+        error_msg("Region [{}]: {}", region['path'], region['error'])
+    log_fn = info_msg if not report['failed'] else warn_msg
+    log_fn("{} [{}]: {} of {} chunks in {} regions, {} -> {} bytes, {} failed regions",
+           'Would prune' if report['dry_run'] else 'Pruned', report['path'], report['pruned_chunks'], report['chunks'],
+           report['regions'], report['bytes_before'], report['bytes_after'], len(report['failed']))
+    return not report['failed']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Drop never-inhabited chunks from Minecraft worlds.")
+    parser.add_argument('paths', nargs='+', metavar='path', help="world save directory (holding level.dat)")
+    parser.add_argument('--inhabited', type=float, default=0,
+                        help="prune chunks players spent at most this many seconds near (default: 0, never)")
+    parser.add_argument('--min-age', type=float, default=0,
+                        help="only prune chunks last saved at least this many seconds of game time ago")
+    parser.add_argument('--dry-run', action='store_true', help="only report what would be pruned")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument('--json', action='store_true', help="print the reports as JSON")
+    mclog.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    mclog.configure_from_args(args)
+
+    reports = []
+    for path in args.paths:
+        if not os.path.isdir(path):
+            error_msg("No such directory [{}]", path)
+            exit(2)
+        report = prune_world(path, int(args.inhabited * TICKS_PER_SECOND), int(args.min_age * TICKS_PER_SECOND),
+                             args.dry_run, args.jobs)
+        if report is None:
+            exit(1)
+        reports.append(report)
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    clean = all([log_report(report) for report in reports])
+    exit(0 if clean else 1)
@@ -0,0 +1,355 @@
+##############################################################################
+#
+# Anvil region file (.mca) reader and verifier
+#
+# A region file holds the chunks of a 32x32 chunk area:
+#
+#     0x0000  1024 big endian location entries, one per chunk: the sector
+#             offset (3 bytes) and sector count (1 byte) of its data, or 0
+#             if the chunk has not been generated
+#     0x1000  1024 big endian last-modified timestamps
+#     0x2000  chunk data in 4 KiB sectors: a 4 byte length, a 1 byte
+#             compression type, then length - 1 bytes of compressed NBT
+#
+# Chunks too large for 255 sectors keep their data in a c.<x>.<z>.mcc file
+# next to the region file, flagged by adding 128 to the compression type.
+#
+##############################################################################
+
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import zlib
+
+import mclog
+
+
+SECTOR_SIZE = 4096
+HEADER_SIZE = 2 * SECTOR_SIZE
+REGION_WIDTH = 32
+CHUNKS_PER_REGION = REGION_WIDTH * REGION_WIDTH
+
+COMPRESSION_GZIP = 1
+COMPRESSION_ZLIB = 2
+COMPRESSION_NONE = 3
+COMPRESSION_LZ4 = 4
+COMPRESSION_EXTERNAL = 128
+COMPRESSION_NAMES = {
+    COMPRESSION_GZIP: 'gzip',
+    COMPRESSION_ZLIB: 'zlib',
+    COMPRESSION_NONE: 'none',
+    COMPRESSION_LZ4: 'lz4',
+}
+
+# Header of the LZ4 block stream (lz4-java framing) used by compression type 4
+LZ4_MAGIC = b'LZ4Block'
+# Every chunk is an NBT compound
+TAG_COMPOUND = 10
+
+# Directories of a world holding region format files
+REGION_DIRS = ['region', 'entities', 'poi']
+REGION_FILE_RE = re.compile(r'^r\.(-?\d+)\.(-?\d+)\.mca$')
+
+HEADER = struct.Struct('>{}I'.format(2 * CHUNKS_PER_REGION))
+CHUNK_HEADER = struct.Struct('>IB')
+
+
+log = mclog.get_logger('mcregion')
+error_msg = log.error
+warn_msg = log.warn
+info_msg = log.info
+
+
+def region_coords(path):
+    """Region (x, z) from a region file name, e.g. 'r.-1.2.mca' -> (-1, 2); None if it is not one"""
+    match = REGION_FILE_RE.match(os.path.basename(path))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def chunk_coords(index, region=None):
+    """Chunk (x, z) of a header index, absolute when the region's (x, z) is given"""
+    x, z = index % REGION_WIDTH, index // REGION_WIDTH
+    if region is not None:
+        x += region[0] * REGION_WIDTH
+        z += region[1] * REGION_WIDTH
+    return x, z
+
+
+def read_header(buf):
+    """
+    (locations, timestamps) of the 1024 chunks of a region, unpacked
+    straight out of buf (typically an mmap) without copying the header.
+    """
+    values = HEADER.unpack_from(buf, 0)
+    return values[:CHUNKS_PER_REGION], values[CHUNKS_PER_REGION:]
+
+
+class RegionFile(object):
+    """
+    A memory-mapped region file. Chunk data is handed out as memoryview
+    slices of the mapping, which must be released before close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.coords = region_coords(path)
+        self.size = 0
+        self.locations = (0,) * CHUNKS_PER_REGION
+        self.timestamps = (0,) * CHUNKS_PER_REGION
+        self._mm = None
+        self._view = None
+        with open(path, 'rb') as fp:
+            self.size = os.fstat(fp.fileno()).st_size
+            if self.size == 0:
+                # Created but never written to: a region without chunks
+                return
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+        if self.size >= HEADER_SIZE:
+            self.locations, self.timestamps = read_header(self._mm)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    @property
+    def sectors(self):
+        return (self.size + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+    def chunks(self):
+        """(index, sector offset, sector count, timestamp) of every present chunk"""
+        for index, location in enumerate(self.locations):
+            if location:
+                yield index, location >> 8, location & 0xff, self.timestamps[index]
+
+    def get_external_path(self, index):
+        x, z = chunk_coords(index, self.coords or (0, 0))
+        return os.path.join(os.path.dirname(self.path), 'c.{}.{}.mcc'.format(x, z))
+
+    def read_chunk(self, index):
+        """
+        (compression type, data) of a chunk, data being a memoryview of the
+        compressed payload; the type keeps its external flag, in which case
+        data is empty and the payload is in get_external_path(). Raises
+        ValueError if the chunk's header or bounds are invalid.
+        """
+        location = self.locations[index]
+        if not location:
+            raise ValueError("chunk is not present")
+        start = (location >> 8) * SECTOR_SIZE
+        if start + CHUNK_HEADER.size > self.size:
+            raise ValueError("chunk header past the end of the file")
+        length, compression = CHUNK_HEADER.unpack_from(self._mm, start)
+        if length == 0:
+            raise ValueError("zero chunk length")
+        if length + 4 > (location & 0xff) * SECTOR_SIZE:
+            raise ValueError("chunk length {} overruns its {} sectors".format(length, location & 0xff))
+        if start + 4 + length > self.size:
+            raise ValueError("chunk data truncated at the end of the file")
+        return compression, self._view[start + CHUNK_HEADER.size:start + 4 + length]
+
+    def read_sectors(self, index):
+        """
+        The sectors a chunk's location points to, as a memoryview of the
+        mapping, cut short at the end of the file; read as they are,
+        without checking the record they hold.
+        """
+        location = self.locations[index]
+        start = min((location >> 8) * SECTOR_SIZE, self.size)
+        return self._view[start:min(start + (location & 0xff) * SECTOR_SIZE, self.size)]
+
+
+def check_payload(compression, data):
+    """Error message if compressed chunk data is not a valid stream of its type, else None"""
+    if compression in (COMPRESSION_GZIP, COMPRESSION_ZLIB):
+        wbits = 16 + zlib.MAX_WBITS if compression == COMPRESSION_GZIP else zlib.MAX_WBITS
+        inflater = zlib.decompressobj(wbits)
+        try:
+            head = inflater.decompress(data)
+        except zlib.error as ex:
+            return "corrupt {} stream: {}".format(COMPRESSION_NAMES[compression], str(ex))
+        if not inflater.eof:
+            return "truncated {} stream".format(COMPRESSION_NAMES[compression])
+        if head[:1] != bytes([TAG_COMPOUND]):
+            return "chunk is not an NBT compound"
+        return None
+    if compression == COMPRESSION_NONE:
+        if data[:1] != bytes([TAG_COMPOUND]):
+            return "chunk is not an NBT compound"
+        return None
+    if compression == COMPRESSION_LZ4:
+        # The block stream itself is only decodable with an lz4 library
+        if data[:len(LZ4_MAGIC)] != LZ4_MAGIC:
+            return "bad lz4 block header"
+        return None
+    return "unknown compression type {}".format(compression)
+
+
+def _check_chunk(region, index):
+    try:
+        compression, data = region.read_chunk(index)
+    except ValueError as ex:
+        return str(ex)
+    with data:
+        if not compression & COMPRESSION_EXTERNAL:
+            return check_payload(compression, data)
+    path = region.get_external_path(index)
+    try:
+        with open(path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return "empty external chunk file [{}]".format(os.path.basename(path))
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    return check_payload(compression & ~COMPRESSION_EXTERNAL, view)
+    except FileNotFoundError:
+        return "missing external chunk file [{}]".format(os.path.basename(path))
+
+
+def verify_region(path):
+    """
+    Check the header and every chunk of a region file. Returns a report
+    {'path', 'chunks', 'errors': [{'x', 'z', 'error'}], 'error'}; 'error'
+    is set when the file as a whole is unreadable.
+    """
+    report = {'path': path, 'chunks': 0, 'errors': [], 'error': None}
+    try:
+        region = RegionFile(path)
+    except (OSError, ValueError) as ex:
+        report['error'] = str(ex)
+        return report
+
+    with region:
+        if region.size == 0:
+            return report
+        if region.size < HEADER_SIZE:
+            report['error'] = "truncated header ({} bytes)".format(region.size)
+            return report
+
+        problems = {}
+        owners = [None] * region.sectors
+        for index, offset, count, _ in region.chunks():
+            report['chunks'] += 1
+            if offset < HEADER_SIZE // SECTOR_SIZE:
+                problems[index] = "sector {} is inside the header".format(offset)
+            elif count == 0:
+                problems[index] = "zero sector count"
+            elif offset + count > region.sectors:
+                problems[index] = "sectors {}-{} out of bounds of {}".format(offset, offset + count - 1, region.sectors)
+            else:
+                for sector in range(offset, offset + count):
+                    other = owners[sector]
+                    if other is not None:
+                        problems.setdefault(index, "sector {} overlaps chunk {},{}".format(sector, *chunk_coords(other, region.coords)))
+                        problems.setdefault(other, "sector {} overlaps chunk {},{}".format(sector, *chunk_coords(index, region.coords)))
+                    else:
+                        owners[sector] = index
+
+        for index, _, _, _ in region.chunks():
+            if index not in problems:
+                problem = _check_chunk(region, index)
+                if problem is not None:
+                    problems[index] = problem
+
+    for index in sorted(problems):
+        x, z = chunk_coords(index, region.coords)
+        report['errors'].append({'x': x, 'z': z, 'error': problems[index]})
+    return report
+
+
+def find_regions(directory):
+    """Paths of all region files in the region directories under directory, sorted"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        if os.path.basename(root) in REGION_DIRS:
+            paths.extend(os.path.join(root, name) for name in sorted(files) if REGION_FILE_RE.match(name))
+    return paths
+
+
+def verify_world(directory, workers=None, progress=None, paths=None):
+    """
+    Verify every region file under directory (or just paths) in a process
+    pool, one region per task. progress, if given, is called with each region's report as
+    it completes. Returns the world report:
+
+        {'path', 'regions', 'chunks', 'corrupt_chunks',
+         'damaged': [region reports with errors, path relative to directory]}
+    """
+    import concurrent.futures
+    if paths is None:
+        paths = find_regions(directory)
+    report = {'path': directory, 'regions': len(paths), 'chunks': 0, 'corrupt_chunks': 0, 'damaged': []}
+    if not paths:
+        return report
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(verify_region, paths):
+            report['chunks'] += result['chunks']
+            report['corrupt_chunks'] += len(result['errors'])
+            if result['error'] or result['errors']:
+                result['path'] = os.path.relpath(result['path'], directory)
+                report['damaged'].append(result)
+            if progress is not None:
+                progress(result)
+    return report
+
+
+def log_report(report):
+    """Log a world report's damaged regions and chunks, then its summary; True if it is clean"""
+    for region in report['damaged']:
+        if region['error']:
+            error_msg("Region [{}]: {}", region['path'], region['error'])
+        for chunk in region['errors']:
+            error_msg("Region [{}] chunk {},{}: {}", region['path'], chunk['x'], chunk['z'], chunk['error'])
+    log_fn = info_msg if not report['damaged'] else warn_msg
+    log_fn("Verified [{}]: {} regions, {} chunks, {} corrupt chunks, {} damaged regions", report['path'],
+           report['regions'], report['chunks'], report['corrupt_chunks'], len(report['damaged']))
+    return not report['damaged']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verify the region files of Minecraft worlds.")
+    parser.add_argument('paths', nargs='+', metavar='path', help="world directory, or region file")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument('--json', action='store_true', help="print the reports as JSON")
+    mclog.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    mclog.configure_from_args(args)
+
+    reports = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            reports.append(verify_world(path, args.jobs))
+        elif os.path.isfile(path):
+            result = verify_region(path)
+            damaged = [result] if result['error'] or result['errors'] else []
+            reports.append({'path': path, 'regions': 1, 'chunks': result['chunks'],
+                            'corrupt_chunks': len(result['errors']), 'damaged': damaged})
+        else:
+            error_msg("No such file or directory [{}]", path)
+            exit(2)
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    clean = all([log_report(report) for report in reports])
+    exit(0 if clean else 1)
@@ -0,0 +1,624 @@
+##############################################################################
+#
+# Top-down map renderer
+#
+# Renders the region files of a world into a pyramid of 512x512 PNG tiles,
+# one pixel per block, laid out for static serving:
+#
+#     <out>/0/<x>/<z>.png       region r.<x>.<z>.mca at full resolution
+#     <out>/-1/<x>/<z>.png      2x2 tiles of the level above, halved
+#     ...                       down to at most 2x2 tiles covering the world
+#     <out>/render.json         state of the last run
+#
+# which is the tile layout of a Leaflet CRS.Simple map with a tile size of
+# 512 and a maximum zoom of 0.
+#
+# Block colors are the average colors of the textures extracted from the
+# client jar (MCVersion.extract_textures), tinted per biome through the
+# grass and foliage colormaps. Chunks are decoded and composited as numpy
+# arrays, one region per worker process. A region is only rendered again
+# when its header (chunk locations and timestamps) changed since the last
+# run, and only the tiles above a changed region are rebuilt.
+#
+##############################################################################
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import zlib
+
+import numpy
+from PIL import Image
+
+import mcfs
+import mclog
+import mcnbt
+import mcregion
+
+
+TILE_SIZE = 512
+# Zoomed out levels kept at most, each halving the resolution
+MAX_ZOOM_OUT = 10
+STATE_FILE = 'render.json'
+
+AIR_BLOCKS = ['air', 'cave_air', 'void_air']
+# Rendered as water, blended with what lies below it
+WATER_BLOCKS = ['water', 'bubble_column', 'kelp', 'kelp_plant', 'seagrass', 'tall_seagrass']
+GRASS_TINTED = ['grass_block', 'grass', 'short_grass', 'tall_grass', 'fern', 'large_fern', 'potted_fern']
+FOLIAGE_TINTED = ['oak_leaves', 'jungle_leaves', 'acacia_leaves', 'dark_oak_leaves', 'mangrove_leaves', 'vine']
+FIXED_COLORS = {
+    'birch_leaves': (128, 167, 85),
+    'spruce_leaves': (97, 153, 97),
+    'lily_pad': (32, 128, 48),
+    'lava': (207, 92, 20),
+}
+WATER_COLOR = (63, 118, 228)
+UNKNOWN_COLOR = (128, 128, 128)
+# Texture name suffixes of blocks drawn with the texture of another block
+SHAPE_SUFFIXES = ['_stairs', '_slab', '_wall', '_fence_gate', '_fence', '_pressure_plate', '_button',
+                  '_wall_sign', '_sign', '_door', '_trapdoor', '_carpet', '_pane']
+
+TINT_NONE = 0
+TINT_GRASS = 1
+TINT_FOLIAGE = 2
+TINT_WATER = 3
+
+# Biome: (temperature, downfall), the colormap coordinates
+BIOME_CLIMATE = {
+    'plains': (0.8, 0.4), 'sunflower_plains': (0.8, 0.4), 'snowy_plains': (0.0, 0.5), 'ice_spikes': (0.0, 0.5),
+    'desert': (2.0, 0.0), 'swamp': (0.8, 0.9), 'mangrove_swamp': (0.8, 0.9), 'forest': (0.7, 0.8),
+    'flower_forest': (0.7, 0.8), 'birch_forest': (0.6, 0.6), 'old_growth_birch_forest': (0.6, 0.6),
+    'dark_forest': (0.7, 0.8), 'taiga': (0.25, 0.8), 'snowy_taiga': (-0.5, 0.4), 'old_growth_pine_taiga': (0.3, 0.8),
+    'old_growth_spruce_taiga': (0.25, 0.8), 'windswept_hills': (0.2, 0.3), 'windswept_forest': (0.2, 0.3),
+    'windswept_gravelly_hills': (0.2, 0.3), 'savanna': (2.0, 0.0), 'savanna_plateau': (2.0, 0.0),
+    'windswept_savanna': (2.0, 0.0), 'jungle': (0.95, 0.9), 'sparse_jungle': (0.95, 0.8), 'bamboo_jungle': (0.95, 0.9),
+    'badlands': (2.0, 0.0), 'eroded_badlands': (2.0, 0.0), 'wooded_badlands': (2.0, 0.0), 'meadow': (0.5, 0.8),
+    'cherry_grove': (0.5, 0.8), 'grove': (-0.2, 0.8), 'snowy_slopes': (-0.3, 0.9), 'frozen_peaks': (-0.7, 0.9),
+    'jagged_peaks': (-0.7, 0.9), 'stony_peaks': (1.0, 0.3), 'river': (0.5, 0.5), 'frozen_river': (0.0, 0.5),
+    'beach': (0.8, 0.4), 'snowy_beach': (0.05, 0.3), 'stony_shore': (0.2, 0.3), 'mushroom_fields': (0.9, 1.0),
+    'ocean': (0.5, 0.5), 'deep_ocean': (0.5, 0.5), 'warm_ocean': (0.5, 0.5), 'lukewarm_ocean': (0.5, 0.5),
+    'deep_lukewarm_ocean': (0.5, 0.5), 'cold_ocean': (0.5, 0.5), 'deep_cold_ocean': (0.5, 0.5),
+    'frozen_ocean': (0.0, 0.5), 'deep_frozen_ocean': (0.5, 0.5), 'dripstone_caves': (0.8, 0.4),
+    'lush_caves': (0.5, 0.5), 'deep_dark': (0.8, 0.4),
+}
+DEFAULT_BIOME = 'plains'
+# Numeric biome ids of worlds saved before 1.18, by their current name
+LEGACY_BIOMES = {
+    0: 'ocean', 1: 'plains', 2: 'desert', 3: 'windswept_hills', 4: 'forest', 5: 'taiga', 6: 'swamp', 7: 'river',
+    10: 'frozen_ocean', 11: 'frozen_river', 12: 'snowy_plains', 14: 'mushroom_fields', 16: 'beach', 21: 'jungle',
+    23: 'sparse_jungle', 24: 'deep_ocean', 25: 'stony_shore', 26: 'snowy_beach', 27: 'birch_forest',
+    29: 'dark_forest', 30: 'snowy_taiga', 32: 'old_growth_pine_taiga', 34: 'windswept_forest', 35: 'savanna',
+    36: 'savanna_plateau', 37: 'badlands', 38: 'wooded_badlands', 44: 'warm_ocean', 45: 'lukewarm_ocean',
+    46: 'cold_ocean', 47: 'deep_warm_ocean', 48: 'deep_lukewarm_ocean', 49: 'deep_cold_ocean',
+    50: 'deep_frozen_ocean', 129: 'sunflower_plains', 132: 'flower_forest', 140: 'ice_spikes',
+    155: 'old_growth_birch_forest', 160: 'old_growth_spruce_taiga', 165: 'eroded_badlands', 168: 'bamboo_jungle',
+}
+# Per-biome grass colors not taken from the colormap
+FIXED_GRASS = {'swamp': (106, 112, 57), 'mangrove_swamp': (106, 112, 57), 'badlands': (144, 129, 77),
+               'eroded_badlands': (144, 129, 77), 'wooded_badlands': (144, 129, 77)}
+# Chunk statuses of fully generated chunks
+FULL_STATUSES = ['full', 'minecraft:full', 'postprocessed', 'fullchunk']
+# DataVersion from which block states no longer span two longs (1.16)
+NO_SPAN_DATA_VERSION = 2529
+# Height of columns without any block
+NO_HEIGHT = -1 << 15
+
+DIMENSIONS = {'overworld': '', 'nether': 'DIM-1', 'end': 'DIM1'}
+
+
+log = mclog.get_logger('mcrender')
+debug_msg = log.debug
+info_msg = log.info
+warn_msg = log.warn
+error_msg = log.error
+
+
+def short_name(name):
+    return name[len('minecraft:'):] if name.startswith('minecraft:') else name
+
+
+def texture_candidates(name):
+    """Texture names to try, in order, for the top face of a block"""
+    candidates = [name + '_top', name]
+    base = name.replace('_wood', '_log').replace('_hyphae', '_stem')
+    if base != name:
+        candidates += [base + '_top', base]
+    for suffix in SHAPE_SUFFIXES:
+        if name.endswith(suffix):
+            base = name[:-len(suffix)]
+            if suffix == '_carpet':
+                candidates.append(base + '_wool')
+            candidates += [base + '_top', base, base + 's', base + '_planks', base + '_block']
+            break
+    if name.startswith('potted_'):
+        candidates.append(name[len('potted_'):])
+    return candidates
+
+
+def average_color(path):
+    """Alpha weighted average (r, g, b) of the first frame of a texture; None if it is fully transparent"""
+    with Image.open(path) as image:
+        pixels = numpy.asarray(image.convert('RGBA'), dtype=numpy.float64)
+    # Animated textures are a vertical strip of square frames
+    pixels = pixels[:pixels.shape[1]]
+    alpha = pixels[:, :, 3]
+    if alpha.sum() == 0:
+        return None
+    return tuple(int(round(value)) for value in (pixels[:, :, :3] * alpha[:, :, None]).sum(axis=(0, 1)) / alpha.sum())
+
+
+class BlockColors(object):
+    """
+    Colors of block states and biomes, each given a small integer id so that
+    chunks can be colored with numpy lookups. Block id 0 is air.
+    """
+
+    def __init__(self, texture_dir):
+        self.texture_dir = texture_dir
+        self.block_dir = None
+        for name in ('block', 'blocks'):
+            if os.path.isdir(os.path.join(texture_dir, name)):
+                self.block_dir = os.path.join(texture_dir, name)
+                break
+        self.block_ids = {}
+        self.rgb = [(0, 0, 0)]
+        self.tint = [TINT_NONE]
+        for name in AIR_BLOCKS:
+            self.block_ids[name] = 0
+
+        self.biome_ids = {}
+        self.grass = []
+        self.foliage = []
+        self.grass_map = self._load_colormap('grass')
+        self.foliage_map = self._load_colormap('foliage')
+        self.unknown = set()
+        self._arrays = None
+
+    def _load_colormap(self, name):
+        path = os.path.join(self.texture_dir, 'colormap', '{}.png'.format(name))
+        try:
+            with Image.open(path) as image:
+                return numpy.asarray(image.convert('RGB'))
+        except Exception as ex:
+            warn_msg("No {} colormap [{}]: {}", name, path, str(ex))
+            return None
+
+    def _block_color(self, name):
+        if name in FIXED_COLORS:
+            return FIXED_COLORS[name], TINT_NONE
+        if name in WATER_BLOCKS:
+            return WATER_COLOR, TINT_WATER
+        tint = TINT_GRASS if name in GRASS_TINTED else TINT_FOLIAGE if name in FOLIAGE_TINTED else TINT_NONE
+        if self.block_dir is not None:
+            for candidate in texture_candidates(name):
+                path = os.path.join(self.block_dir, candidate + '.png')
+                if os.path.isfile(path):
+                    try:
+                        color = average_color(path)
+                    except Exception as ex:
+                        warn_msg("Unreadable texture [{}]: {}", path, str(ex))
+                        continue
+                    if color is not None:
+                        return color, tint
+        self.unknown.add(name)
+        return UNKNOWN_COLOR, tint
+
+    def block_id(self, name):
+        name = short_name(name)
+        block_id = self.block_ids.get(name)
+        if block_id is None:
+            rgb, tint = self._block_color(name)
+            block_id = self.block_ids[name] = len(self.rgb)
+            self.rgb.append(rgb)
+            self.tint.append(tint)
+            self._arrays = None
+        return block_id
+
+    def _colormap_color(self, colormap, biome):
+        temperature, downfall = BIOME_CLIMATE.get(biome, BIOME_CLIMATE[DEFAULT_BIOME])
+        if colormap is None:
+            return (255, 255, 255)
+        temperature = min(max(temperature, 0.0), 1.0)
+        downfall = min(max(downfall, 0.0), 1.0) * temperature
+        return tuple(int(value) for value in colormap[int((1.0 - downfall) * 255), int((1.0 - temperature) * 255)])
+
+    def biome_id(self, biome):
+        if isinstance(biome, int):
+            biome = LEGACY_BIOMES.get(biome, DEFAULT_BIOME)
+        biome = short_name(biome)
+        biome_id = self.biome_ids.get(biome)
+        if biome_id is None:
+            biome_id = self.biome_ids[biome] = len(self.grass)
+            self.grass.append(FIXED_GRASS.get(biome) or self._colormap_color(self.grass_map, biome))
+            self.foliage.append(self._colormap_color(self.foliage_map, biome))
+            self._arrays = None
+        return biome_id
+
+    def arrays(self):
+        """(rgb, tint, grass, foliage) lookup tables as numpy arrays"""
+        if self._arrays is None:
+            self._arrays = (numpy.array(self.rgb, dtype=numpy.float32), numpy.array(self.tint, dtype=numpy.uint8),
+                            numpy.array(self.grass or [(255, 255, 255)], dtype=numpy.float32),
+                            numpy.array(self.foliage or [(255, 255, 255)], dtype=numpy.float32))
+        return self._arrays
+
+
+def unpack_indices(longs, bits, count, spanning):
+    """Unpack count bits-wide values from packed longs (an mcnbt.NBTArray), as an int array"""
+    words = numpy.frombuffer(longs.raw, dtype=longs.dtype).view('>u8')
+    if spanning:
+        # One continuous little endian bit stream
+        stream = numpy.unpackbits(words.astype('<u8').view(numpy.uint8), bitorder='little')
+        stream = stream[:count * bits].reshape(count, bits).astype(numpy.int64)
+        return stream.dot(1 << numpy.arange(bits, dtype=numpy.int64))
+    per_word = 64 // bits
+    shifts = numpy.arange(per_word, dtype=numpy.uint64) * numpy.uint64(bits)
+    values = (words[:, None] >> shifts[None, :]) & numpy.uint64((1 << bits) - 1)
+    return values.reshape(-1)[:count].astype(numpy.int64)
+
+
+def _palette_ids(palette, lookup):
+    return numpy.array([lookup(entry) for entry in palette], dtype=numpy.int32)
+
+
+def chunk_columns(root, colors):
+    """
+    Surface of a chunk as (block ids, water depth, floor block ids, heights,
+    biome ids), each a 16x16 array indexed [z, x]; None if the chunk is not
+    fully generated or has no blocks.
+    """
+    level = root.get('Level', root)
+    status = level.get('Status', level.get('status'))
+    if status is not None and status not in FULL_STATUSES:
+        return None
+    spanning = root.get('DataVersion', 0) < NO_SPAN_DATA_VERSION
+    sections = level.get('sections', level.get('Sections')) or []
+
+    layers = {}
+    biome_layers = {}
+    for section in sections:
+        y = section.get('Y')
+        if y is None:
+            continue
+        if 'block_states' in section:
+            palette = section['block_states'].get('palette')
+            data = section['block_states'].get('data')
+        else:
+            palette = section.get('Palette')
+            data = section.get('BlockStates')
+        if palette:
+            ids = _palette_ids(palette, lambda entry: colors.block_id(entry.get('Name', 'air')))
+            if len(palette) == 1 or data is None:
+                layers[y] = numpy.full((16, 16, 16), ids[0], dtype=numpy.int32)
+            else:
+                bits = max(4, (len(palette) - 1).bit_length())
+                layers[y] = ids[unpack_indices(data, bits, 4096, spanning)].reshape(16, 16, 16)
+        if 'biomes' in section and section['biomes'].get('palette'):
+            palette = section['biomes']['palette']
+            ids = _palette_ids(palette, colors.biome_id)
+            data = section['biomes'].get('data')
+            if len(palette) == 1 or data is None:
+                biome_layers[y] = numpy.full((4, 4, 4), ids[0], dtype=numpy.int32)
+            else:
+                bits = (len(palette) - 1).bit_length()
+                biome_layers[y] = ids[unpack_indices(data, bits, 64, False)].reshape(4, 4, 4)
+    if not layers:
+        return None
+
+    bottom = min(layers)
+    height = (max(layers) - bottom + 1) * 16
+    volume = numpy.zeros((height, 16, 16), dtype=numpy.int32)
+    for y, layer in layers.items():
+        volume[(y - bottom) * 16:(y - bottom + 1) * 16] = layer
+
+    rgb, tint, _, _ = colors.arrays()
+    solid = volume != 0
+    water = tint[volume] == TINT_WATER
+    floor = solid & ~water
+    zz, xx = numpy.mgrid[0:16, 0:16]
+
+    top = height - 1 - numpy.argmax(solid[::-1], axis=0)
+    top_floor = height - 1 - numpy.argmax(floor[::-1], axis=0)
+    has_block = solid.any(axis=0)
+    has_floor = floor.any(axis=0)
+    top = numpy.where(has_block, top, 0)
+    surface = numpy.where(has_block, volume[top, zz, xx], 0)
+    floor_ids = numpy.where(has_floor, volume[top_floor, zz, xx], 0)
+    depth = numpy.where(has_floor, top - top_floor, 16)
+    depth = numpy.where(tint[surface] == TINT_WATER, depth, 0)
+
+    # Biome at the surface block of each column
+    world_y = top + bottom * 16
+    if biome_layers:
+        biome_volume = numpy.zeros(((max(biome_layers) - min(biome_layers) + 1) * 4, 4, 4), dtype=numpy.int32)
+        biome_bottom = min(biome_layers)
+        for y, layer in biome_layers.items():
+            biome_volume[(y - biome_bottom) * 4:(y - biome_bottom + 1) * 4] = layer
+        by = numpy.clip((world_y - biome_bottom * 16) // 4, 0, biome_volume.shape[0] - 1)
+        biomes = biome_volume[by, zz // 4, xx // 4]
+    else:
+        legacy = level.get('Biomes')
+        default = colors.biome_id(DEFAULT_BIOME)
+        if legacy is not None and len(legacy) == 256:
+            biomes = _palette_ids(legacy, colors.biome_id).reshape(16, 16)
+        elif legacy is not None and len(legacy) == 1024:
+            # 4x4x4 cells from the world bottom: [y][z][x]
+            cells = _palette_ids(legacy, colors.biome_id).reshape(64, 4, 4)
+            biomes = cells[numpy.clip(world_y // 4, 0, 63), zz // 4, xx // 4]
+        else:
+            biomes = numpy.full((16, 16), default, dtype=numpy.int32)
+
+    heights = numpy.where(has_block, world_y, NO_HEIGHT)
+    return surface, depth, floor_ids, heights, biomes
+
+
+def shade(colors, surface, depth, floor_ids, heights, biomes, present):
+    """RGBA image of the surface arrays of a region"""
+    rgb, tint, grass, foliage = colors.arrays()
+    color = rgb[surface].copy()
+    kinds = tint[surface]
+    color[kinds == TINT_GRASS] *= grass[biomes[kinds == TINT_GRASS]] / 255.0
+    color[kinds == TINT_FOLIAGE] *= foliage[biomes[kinds == TINT_FOLIAGE]] / 255.0
+
+    # Water: blend with the floor, more opaque the deeper it is
+    is_water = kinds == TINT_WATER
+    floor = rgb[floor_ids]
+    floor_kinds = tint[floor_ids]
+    floor[floor_kinds == TINT_GRASS] *= grass[biomes[floor_kinds == TINT_GRASS]] / 255.0
+    floor[floor_kinds == TINT_FOLIAGE] *= foliage[biomes[floor_kinds == TINT_FOLIAGE]] / 255.0
+    opacity = numpy.clip(0.5 + depth * 0.05, 0.5, 0.9)[:, :, None]
+    color = numpy.where(is_water[:, :, None], color * opacity + floor * (1 - opacity), color)
+
+    # Relief: lighter where a column is higher than the one north of it
+    north = numpy.vstack([heights[:1], heights[:-1]])
+    slope = numpy.where((heights != NO_HEIGHT) & (north != NO_HEIGHT), heights - north, 0)
+    color *= numpy.clip(1.0 + slope * 0.06, 0.75, 1.25)[:, :, None]
+
+    image = numpy.zeros(surface.shape + (4,), dtype=numpy.uint8)
+    image[:, :, :3] = numpy.clip(color, 0, 255).astype(numpy.uint8)
+    image[:, :, 3] = numpy.where(present, 255, 0)
+    return image
+
+
+def render_region(path, colors):
+    """RGBA image (512x512 numpy array) of a region file and the number of chunks rendered and failed"""
+    size = mcregion.REGION_WIDTH * 16
+    surface = numpy.zeros((size, size), dtype=numpy.int32)
+    depth = numpy.zeros((size, size), dtype=numpy.int32)
+    floor_ids = numpy.zeros((size, size), dtype=numpy.int32)
+    heights = numpy.full((size, size), NO_HEIGHT, dtype=numpy.int32)
+    biomes = numpy.zeros((size, size), dtype=numpy.int32)
+    present = numpy.zeros((size, size), dtype=bool)
+    rendered = failed = 0
+
+    with mcregion.RegionFile(path) as region:
+        for index, _, _, _ in region.chunks():
+            try:
+                root = mcnbt.read_chunk(region, index)
+                columns = chunk_columns(root, colors)
+            except (ValueError, KeyError, IndexError, TypeError, OSError, struct.error, zlib.error) as ex:
+                debug_msg("Skipping chunk {},{} of [{}]: {}", *mcregion.chunk_coords(index, region.coords), path, str(ex))
+                failed += 1
+                continue
+            if columns is None:
+                continue
+            x, z = mcregion.chunk_coords(index)
+            cell = (slice(z * 16, z * 16 + 16), slice(x * 16, x * 16 + 16))
+            surface[cell], depth[cell], floor_ids[cell], heights[cell], biomes[cell] = columns
+            present[cell] = True
+            rendered += 1
+    return shade(colors, surface, depth, floor_ids, heights, biomes, present), rendered, failed
+
+
+def get_tile_path(out_dir, zoom, x, z):
+    return os.path.join(out_dir, str(zoom), str(x), '{}.png'.format(z))
+
+
+def _save_tile(image, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with mcfs.atomic_open(path) as fp:
+        Image.fromarray(image, 'RGBA').save(fp, format='PNG')
+
+
+def _remove_tile(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_worker_colors = None
+
+
+def _init_worker(texture_dir):
+    global _worker_colors
+    _worker_colors = BlockColors(texture_dir)
+
+
+def _render_task(path, tile_path):
+    image, rendered, failed = render_region(path, _worker_colors)
+    if rendered:
+        _save_tile(image, tile_path)
+    else:
+        _remove_tile(tile_path)
+    return path, rendered, failed, sorted(_worker_colors.unknown)
+
+
+def region_stamp(path):
+    """Digest of a region's header, which changes whenever any of its chunks is saved"""
+    with open(path, 'rb') as fp:
+        return hashlib.sha1(fp.read(mcregion.HEADER_SIZE)).hexdigest()
+
+
+def texture_stamp(texture_dir):
+    try:
+        with open(os.path.join(texture_dir, '.manifest.json'), 'rb') as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+    except OSError:
+        return os.path.abspath(texture_dir)
+
+
+def build_parent(out_dir, zoom, x, z):
+    """Render tile (x, z) of zoom from its four children at zoom + 1; False if none of them exist"""
+    half = TILE_SIZE // 2
+    image = numpy.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=numpy.uint8)
+    found = False
+    for dz in (0, 1):
+        for dx in (0, 1):
+            path = get_tile_path(out_dir, zoom + 1, 2 * x + dx, 2 * z + dz)
+            if not os.path.isfile(path):
+                continue
+            with Image.open(path) as child:
+                pixels = numpy.asarray(child.convert('RGBA'), dtype=numpy.uint16)
+            # Halve by averaging 2x2 blocks
+            pixels = pixels.reshape(half, 2, half, 2, 4).sum(axis=(1, 3)) // 4
+            image[dz * half:(dz + 1) * half, dx * half:(dx + 1) * half] = pixels.astype(numpy.uint8)
+            found = True
+    path = get_tile_path(out_dir, zoom, x, z)
+    if found:
+        _save_tile(image, path)
+    else:
+        _remove_tile(path)
+    return found
+
+
+def _zoom_levels(coords):
+    """
+    Number of zoomed out levels needed for the tiles at coords to fit in 2x2
+    tiles; halving never brings negative and positive coordinates together.
+    """
+    if not coords:
+        return 0
+    xs = [x for x, _ in coords]
+    zs = [z for _, z in coords]
+    levels = 0
+    while levels < MAX_ZOOM_OUT and ((max(xs) >> levels) - (min(xs) >> levels) > 1 or (max(zs) >> levels) - (min(zs) >> levels) > 1):
+        levels += 1
+    return levels
+
+
+def find_regions(region_dir):
+    """Names of the region files in region_dir, sorted"""
+    if not os.path.isdir(region_dir):
+        return []
+    return sorted(name for name in os.listdir(region_dir) if mcregion.REGION_FILE_RE.match(name))
+
+
+def render_world(region_dir, texture_dir, out_dir, workers=None, force=False, progress=None, names=None):
+    """
+    Render the region files in region_dir (names, default: all of them)
+    into the tile pyramid at out_dir, skipping regions whose header is
+    unchanged since the last run unless force. progress, if given, is
+    called once per region with its name, whether it was skipped and
+    whether it failed. Returns a summary dict, or None on failure.
+    """
+    import concurrent.futures
+    state_path = os.path.join(out_dir, STATE_FILE)
+    try:
+        with open(state_path, 'r') as fp:
+            state = json.load(fp)
+    except (OSError, ValueError):
+        state = {}
+    textures = texture_stamp(texture_dir)
+    if state.get('textures') != textures:
+        force = True
+    previous = {} if force else state.get('regions', {})
+
+    if names is None:
+        names = find_regions(region_dir)
+    regions = {}
+    for name in names:
+        coords = mcregion.region_coords(name)
+        if coords is None:
+            continue
+        try:
+            regions[name] = (coords, region_stamp(os.path.join(region_dir, name)))
+        except OSError as ex:
+            warn_msg("Skipping region [{}]: {}", name, str(ex))
+            if progress is not None:
+                progress(name, False, True)
+
+    changed = [name for name, (_, stamp) in regions.items() if previous.get(name) != stamp]
+    if progress is not None:
+        for name in regions:
+            if previous.get(name) == regions[name][1]:
+                progress(name, True, False)
+    removed = [name for name in state.get('regions', {}) if name not in regions]
+    summary = {'regions': len(regions), 'rendered': 0, 'removed': len(removed), 'chunks': 0, 'failed': 0}
+    if not changed and not removed and not force and state.get('regions') is not None:
+        info_msg("Map [{}] is up to date", out_dir)
+        return summary
+
+    os.makedirs(out_dir, exist_ok=True)
+    dirty = set()
+    unknown = set()
+    if changed:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(texture_dir,)) as pool:
+            futures = []
+            for name in changed:
+                x, z = regions[name][0]
+                futures.append(pool.submit(_render_task, os.path.join(region_dir, name), get_tile_path(out_dir, 0, x, z)))
+            for future, name in zip(futures, changed):
+                try:
+                    _, rendered, failed, missing = future.result()
+                except Exception as ex:
+                    error_msg("Failed to render region [{}]: {}", name, str(ex))
+                    summary['failed'] += 1
+                    regions[name] = (regions[name][0], None)
+                    if progress is not None:
+                        progress(name, False, True)
+                    continue
+                summary['rendered'] += 1
+                summary['chunks'] += rendered
+                summary['failed'] += failed
+                unknown.update(missing)
+                dirty.add(regions[name][0])
+                if progress is not None:
+                    progress(name, False, False)
+    for name in removed:
+        coords = mcregion.region_coords(name)
+        _remove_tile(get_tile_path(out_dir, 0, *coords))
+        dirty.add(coords)
+    if unknown:
+        debug_msg("No texture for blocks: {}", ', '.join(sorted(unknown)))
+
+    levels = _zoom_levels([coords for coords, _ in regions.values()])
+    old_levels = state.get('levels', 0) if not force else 0
+    for level in range(levels + 1, max(state.get('levels', 0), levels) + 1):
+        shutil.rmtree(os.path.join(out_dir, str(-level)), ignore_errors=True)
+    level_coords = set(coords for coords, _ in regions.values())
+    for level in range(1, levels + 1):
+        level_coords = set((x >> 1, z >> 1) for x, z in level_coords)
+        dirty = set((x >> 1, z >> 1) for x, z in dirty)
+        # A new level has no tiles yet
+        for x, z in (level_coords if level > old_levels else dirty):
+            build_parent(out_dir, -level, x, z)
+
+    state = {'textures': textures, 'levels': levels,
+             'regions': {name: stamp for name, (_, stamp) in regions.items() if stamp is not None}}
+    with mcfs.atomic_open(state_path, 'w') as fp:
+        json.dump(state, fp, indent=1, sort_keys=True)
+    summary['levels'] = levels
+    info_msg("Rendered [{}]: {} of {} regions, {} chunks, {} failed, {} zoom levels", out_dir, summary['rendered'],
+             len(regions), summary['chunks'], summary['failed'], levels + 1)
+    return summary
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render a top-down map of a Minecraft world as a tile pyramid.")
+    parser.add_argument('region_dir', help="region directory of the world dimension")
+    parser.add_argument('texture_dir', help="textures extracted from the client jar")
+    parser.add_argument('out_dir', help="directory to write the tiles to")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument('--force', action='store_true', help="render every region, changed or not")
+    mclog.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    mclog.configure_from_args(args)
+    exit(0 if render_world(args.region_dir, args.texture_dir, args.out_dir, args.jobs, args.force) is not None else 1)
@@ -0,0 +1,380 @@
+##############################################################################
+#
+# Ban / whitelist lookup service
+# Serves "is this player or IP banned, whitelisted or an op" queries from
+# indexed copies of the property lists, reloading a list whenever its file
+# changes on disk:
+#
+#     conf/<list>.json                  global lists (default)
+#     worlds/<instance>/<list>.json     merged lists of a server instance
+#
+##############################################################################
+
+import argparse
+import datetime
+import ipaddress
+import os
+import threading
+import time
+
+from flask import Flask, abort, jsonify, request
+
+import mcadmin
+import mclog
+import mcmetrics
+import mcpropmerge
+
+
+# Minimum interval between checks of the list files for changes
+RELOAD_CHECK_INTERVAL = 1.0
+
+EXPIRY_FORMAT = '%Y-%m-%d %H:%M:%S %z'
+
+PLAYER_LISTS = ['banned-players', 'whitelist', 'ops']
+IP_LISTS = ['banned-ips']
+
+
+log = mclog.get_logger('mcservice')
+error_msg = log.error
+info_msg = log.info
+
+metrics = mcmetrics.REGISTRY
+
+
+def parse_expiry(entry):
+    """Expiry of an entry as a unix timestamp; None if it never expires"""
+    expires = entry.get('expires')
+    if not isinstance(expires, str) or expires == 'forever':
+        return None
+    try:
+        return datetime.datetime.strptime(expires, EXPIRY_FORMAT).timestamp()
+    except ValueError:
+        # Unreadable expiry: keep the ban in force rather than dropping it
+        return None
+
+
+def first_active(entries, now):
+    for expiry, entry in entries:
+        if expiry is None or expiry > now:
+            return entry
+    return None
+
+
+class IPTrie(object):
+    """
+    Binary prefix trie of banned networks, one per address family. Single
+    addresses are kept in a dict; only real CIDR ranges go into the trie,
+    so a lookup is a hash probe plus a walk of at most 32/128 nodes.
+    """
+
+    def __init__(self):
+        self.hosts = {}
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        self.networks = 0
+
+    def insert(self, network, item):
+        if network.prefixlen == network.max_prefixlen:
+            self.hosts.setdefault(network.network_address, []).append(item)
+            return
+        node = self.roots[network.version]
+        value = int(network.network_address)
+        for bit in range(network.max_prefixlen - 1, network.max_prefixlen - 1 - network.prefixlen, -1):
+            branch = (value >> bit) & 1
+            if node[branch] is None:
+                node[branch] = [None, None, None]
+            node = node[branch]
+        if node[2] is None:
+            node[2] = []
+            self.networks += 1
+        node[2].append(item)
+
+    def lookup(self, address, now):
+        """Most specific active entry covering address, or None"""
+        entry = first_active(self.hosts.get(address, ()), now)
+        if entry is not None:
+            return entry
+
+        matches = []
+        node = self.roots[address.version]
+        value = int(address)
+        bit = address.max_prefixlen - 1
+        while node is not None:
+            if node[2] is not None:
+                matches.append(node[2])
+            if bit < 0:
+                break
+            node = node[(value >> bit) & 1]
+            bit -= 1
+        for items in reversed(matches):
+            entry = first_active(items, now)
+            if entry is not None:
+                return entry
+        return None
+
+
+class PlayerIndex(object):
+    def __init__(self, props):
+        self.by_uuid = {}
+        self.by_name = {}
+        for entry in props:
+            if type(entry) != type({}):
+                continue
+            item = (parse_expiry(entry), entry)
+            uuid = entry.get('uuid')
+            uuid = mcadmin.format_uuid(uuid) if isinstance(uuid, str) else None
+            if uuid is not None:
+                self.by_uuid.setdefault(uuid, []).append(item)
+            name = entry.get('name')
+            if isinstance(name, str) and name:
+                self.by_name.setdefault(name.lower(), []).append(item)
+        self.count = len(props)
+
+    def lookup(self, uuid=None, name=None, now=None):
+        if now is None:
+            now = time.time()
+        entry = None
+        if uuid is not None:
+            entry = first_active(self.by_uuid.get(uuid, ()), now)
+        if entry is None and name is not None:
+            entry = first_active(self.by_name.get(name.lower(), ()), now)
+        return entry
+
+
+def fold_ipv4_mapped(network):
+    """The IPv4 network of an IPv4-mapped IPv6 network (::ffff:a.b.c.d/96+), else network itself"""
+    if network.version == 6 and network.prefixlen >= 96 and network.network_address.ipv4_mapped is not None:
+        return ipaddress.ip_network((network.network_address.ipv4_mapped, network.prefixlen - 96))
+    return network
+
+
+class IPIndex(object):
+    def __init__(self, props):
+        self.trie = IPTrie()
+        self.count = len(props)
+        for entry in props:
+            if type(entry) != type({}) or not isinstance(entry.get('ip'), str):
+                continue
+            try:
+                network = ipaddress.ip_network(entry['ip'].strip(), strict=False)
+            except ValueError:
+                continue
+            # Stored the way lookup() folds addresses, so either form matches either
+            self.trie.insert(fold_ipv4_mapped(network), (parse_expiry(entry), entry))
+
+    def lookup(self, address, now=None):
+        if now is None:
+            now = time.time()
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        return self.trie.lookup(address, now)
+
+
+class PropIndex(object):
+    """
+    Indexes of the property lists in one directory. A list is re-read when
+    its file's mtime or size changes; the new index replaces the old one
+    only once fully built, so lookups never see a half loaded list. A file
+    that fails to load keeps its previous index.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.indexes = {}
+        self.stamps = {}
+        self.loaded = {}
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+        self.refresh(force=True)
+
+    def get_path(self, prop_type):
+        return os.path.join(self.directory, '{}.json'.format(prop_type))
+
+    def _load(self, prop_type, stamp):
+        path = self.get_path(prop_type)
+        if stamp is None:
+            props = []
+        else:
+            props = mcpropmerge.load_props(path)
+            if props is None:
+                metrics.inc('mcservice_reloads_total', list=prop_type, result='failed')
+                if prop_type not in self.indexes:
+                    # Never loaded: serve an empty list and retry on every check
+                    self.indexes[prop_type] = IPIndex([]) if prop_type in IP_LISTS else PlayerIndex([])
+                    self.loaded[prop_type] = time.time()
+                return False
+        index = IPIndex(props) if prop_type in IP_LISTS else PlayerIndex(props)
+        self.indexes[prop_type] = index
+        self.stamps[prop_type] = stamp
+        self.loaded[prop_type] = time.time()
+        metrics.inc('mcservice_reloads_total', list=prop_type, result='ok')
+        info_msg("Loaded {} entries from [{}]", index.count, path)
+        return True
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_check < RELOAD_CHECK_INTERVAL:
+            return
+        if not self.lock.acquire(blocking=force):
+            # Another request is already checking; keep serving the current indexes
+            return
+        try:
+            self.last_check = now
+            for prop_type in PLAYER_LISTS + IP_LISTS:
+                try:
+                    st = os.stat(self.get_path(prop_type))
+                    stamp = (st.st_mtime_ns, st.st_size)
+                except FileNotFoundError:
+                    stamp = None
+                if force or prop_type not in self.indexes or self.stamps.get(prop_type) != stamp:
+                    self._load(prop_type, stamp)
+        finally:
+            self.lock.release()
+
+    def get(self, prop_type):
+        self.refresh()
+        return self.indexes[prop_type]
+
+    def check_player(self, uuid=None, name=None):
+        now = time.time()
+        ban = self.get('banned-players').lookup(uuid, name, now)
+        whitelist = self.get('whitelist').lookup(uuid, name, now)
+        op = self.get('ops').lookup(uuid, name, now)
+        metrics.inc('mcservice_lookups_total', kind='player', result='banned' if ban is not None else 'clear')
+        return {
+            'banned': ban is not None,
+            'ban': ban,
+            'whitelisted': whitelist is not None,
+            'op': op.get('level') if op is not None else None,
+        }
+
+    def check_ip(self, address):
+        ban = self.get('banned-ips').lookup(address)
+        metrics.inc('mcservice_lookups_total', kind='ip', result='banned' if ban is not None else 'clear')
+        return {'banned': ban is not None, 'ban': ban}
+
+    def get_status(self):
+        status = {}
+        for prop_type, index in self.indexes.items():
+            status[prop_type] = {
+                'entries': index.count,
+                'loaded': datetime.datetime.fromtimestamp(self.loaded[prop_type], datetime.timezone.utc).isoformat(),
+            }
+        return status
+
+
+class PropService(object):
+    """The global lists plus one PropIndex per server instance, created on first use"""
+
+    def __init__(self, working_dir):
+        self.working_dir = os.path.abspath(working_dir)
+        self.instances = {}
+        self.lock = threading.Lock()
+        self.conf = PropIndex(os.path.join(self.working_dir, 'conf'))
+
+    def get_index(self, instance=None):
+        if not instance:
+            return self.conf
+        if instance in self.instances:
+            return self.instances[instance]
+        if instance in ('.', '..') or os.sep in instance or (os.altsep and os.altsep in instance):
+            return None
+        directory = os.path.join(self.working_dir, 'worlds', instance)
+        if not os.path.isdir(directory):
+            return None
+        with self.lock:
+            if instance not in self.instances:
+                self.instances[instance] = PropIndex(directory)
+            return self.instances[instance]
+
+
+def parse_player(ident):
+    """Split a player identifier into (uuid, name); anything not a uuid is a name"""
+    uuid = mcadmin.format_uuid(ident)
+    if uuid is not None:
+        return uuid, None
+    return None, ident
+
+
+def parse_address(value):
+    try:
+        return ipaddress.ip_address(value.strip())
+    except ValueError:
+        abort(400, "Invalid IP address [{}]".format(value))
+
+
+def create_app(working_dir):
+    app = Flask(__name__)
+    service = PropService(working_dir)
+    app.config['PROP_SERVICE'] = service
+
+    def get_index():
+        index = service.get_index(request.args.get('instance'))
+        if index is None:
+            abort(404, "Unknown instance [{}]".format(request.args.get('instance')))
+        return index
+
+    @app.route('/player/<ident>')
+    def player(ident):
+        uuid, name = parse_player(ident)
+        result = get_index().check_player(uuid, name)
+        result['player'] = ident
+        return jsonify(result)
+
+    @app.route('/ip/<addr>')
+    def ip(addr):
+        result = get_index().check_ip(parse_address(addr))
+        result['ip'] = addr
+        return jsonify(result)
+
+    @app.route('/check')
+    def check():
+        index = get_index()
+        result = {}
+        uuid = request.args.get('uuid')
+        name = request.args.get('name')
+        if uuid is not None and mcadmin.format_uuid(uuid) is None:
+            abort(400, "Invalid uuid [{}]".format(uuid))
+        if uuid is not None or name is not None:
+            result['player'] = index.check_player(mcadmin.format_uuid(uuid) if uuid else None, name)
+        if request.args.get('ip') is not None:
+            result['ip'] = index.check_ip(parse_address(request.args['ip']))
+        if not result:
+            abort(400, "Expected uuid, name and/or ip")
+        result['banned'] = any(part['banned'] for part in result.values())
+        return jsonify(result)
+
+    @app.route('/metrics')
+    def metrics_route():
+        # mcadmin's recorded metrics, plus this service's own
+        snapshot = mcmetrics.load(os.path.join(service.working_dir, mcmetrics.METRICS_FILE))
+        mcmetrics.merge_snapshots(snapshot, metrics.snapshot())
+        return mcmetrics.render_prometheus(snapshot), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+    @app.route('/status')
+    def status():
+        result = {'conf': service.conf.get_status()}
+        result['instances'] = {name: index.get_status() for name, index in service.instances.items()}
+        return jsonify(result)
+
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve ban, whitelist and op lookups from the property lists.")
+    parser.add_argument('--dir', help="mcadmin working directory (default: $MC_ADMIN_PATH, or ~/mcadmin)")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8025, help="port to listen on (default: 8025)")
+    mclog.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    mclog.configure_from_args(args)
+    working_dir = args.dir
+    if working_dir is None:
+        working_dir = mcadmin.get_default_working_dir()
+    if not os.path.isdir(os.path.join(working_dir, 'conf')):
+        error_msg("No conf directory under [{}]", os.path.abspath(working_dir))
+        exit(1)
+    create_app(working_dir).run(host=args.host, port=args.port, threaded=True)
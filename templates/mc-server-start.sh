@@ -1,9 +1,6 @@
 #!/bin/bash
 
-for props in 'banned-ips' 'banned-players' 'ops' 'whitelist'; do
-    echo Merging ${props}...
-    mcpropmerge.py ../../conf/${props}.json local.${props}.json > ${props}.json
-done
+mcpropmerge.py --batch ../../conf .
 
 # ISO 8601: YYYY-MM-DDTHH:mm:ssZ
 date -u +"%Y-%m-%dT%H:%M:%SZ" >server-start
@@ -0,0 +1,160 @@
+import http.server
+import os
+import struct
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mcnbt
+import mcregion
+
+
+class StubServer(object):
+    """
+    A local HTTP stand-in. handler(request) is called for every request
+    and returns (status, headers, body); request has 'method', 'path',
+    'headers' and 'body'. Every request is also appended to requests.
+    """
+
+    def __init__(self):
+        self.handler = None
+        self.requests = []
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = {'method': self.command, 'path': self.path, 'headers': dict(self.headers),
+                           'body': self.rfile.read(length) if length else b''}
+                stub.requests.append(request)
+                status, headers, body = stub.handler(request)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if 'Content-Length' not in headers:
+                    self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            do_GET = do_HEAD = do_POST = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+def chunk_record(payload, compression=mcregion.COMPRESSION_ZLIB):
+    """A chunk record as stored in a region: length, compression type, payload"""
+    return struct.pack('>IB', len(payload) + 1, compression) + payload
+
+
+def write_region(path, chunks):
+    """
+    Write a region file. chunks maps chunk indexes to (timestamp, record)
+    or (timestamp, record, sector, count). Records without a sector follow
+    the previous one, in index order; count defaults to the sectors the
+    record fills. Gaps between records are zero filled.
+    """
+    locations = [0] * mcregion.CHUNKS_PER_REGION
+    timestamps = [0] * mcregion.CHUNKS_PER_REGION
+    body = bytearray()
+    next_sector = mcregion.HEADER_SIZE // mcregion.SECTOR_SIZE
+    for index, entry in sorted(chunks.items()):
+        timestamp, data, sector, count = (tuple(entry) + (None, None))[:4]
+        fit = max((len(data) + mcregion.SECTOR_SIZE - 1) // mcregion.SECTOR_SIZE, 1)
+        sector = sector if sector is not None else next_sector
+        locations[index] = (sector << 8) | (count if count is not None else fit)
+        timestamps[index] = timestamp
+        start = (sector - 2) * mcregion.SECTOR_SIZE
+        end = start + fit * mcregion.SECTOR_SIZE
+        if len(body) < end:
+            body.extend(b'\0' * (end - len(body)))
+        body[start:start + len(data)] = data
+        next_sector = max(next_sector, sector + fit)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fp:
+        fp.write(mcregion.HEADER.pack(*(locations + timestamps)) + body)
+
+
+def read_region(path):
+    """{index: (timestamp, (compression, payload) or the raw sectors of an unreadable chunk)}"""
+    chunks = {}
+    with mcregion.RegionFile(path) as region:
+        for index, _, _, timestamp in region.chunks():
+            try:
+                compression, data = region.read_chunk(index)
+            except ValueError:
+                with region.read_sectors(index) as sectors:
+                    chunks[index] = (timestamp, bytes(sectors))
+                continue
+            with data:
+                chunks[index] = (timestamp, (compression, bytes(data)))
+    return chunks
+
+
+def read_records(path):
+    """{index: (timestamp, record bytes)} of the readable chunks of a region file"""
+    records = {}
+    with mcregion.RegionFile(path) as region:
+        for index, offset, _, timestamp in region.chunks():
+            _, data = region.read_chunk(index)
+            with data:
+                start = offset * mcregion.SECTOR_SIZE
+                records[index] = (timestamp, bytes(region._view[start:start + 4 + len(data) + 1]))
+    return records
+
+
+def nbt_payload(value):
+    """(tag, payload) of a value; tuples pick the tag: ('b', 1), ('l', 1), ('d', 1.0), ('I', [..]), ('L', [..])"""
+    if isinstance(value, tuple):
+        kind, value = value
+        if kind in ('I', 'L'):
+            tag, fmt = (mcnbt.TAG_INT_ARRAY, '>i') if kind == 'I' else (mcnbt.TAG_LONG_ARRAY, '>q')
+            return tag, struct.pack('>i', len(value)) + b''.join(struct.pack(fmt, item) for item in value)
+        if kind == 'B':
+            return mcnbt.TAG_BYTE_ARRAY, struct.pack('>i', len(value)) + bytes(value)
+        tag = {'b': mcnbt.TAG_BYTE, 's': mcnbt.TAG_SHORT, 'l': mcnbt.TAG_LONG, 'f': mcnbt.TAG_FLOAT, 'd': mcnbt.TAG_DOUBLE}[kind]
+        return tag, mcnbt.SCALARS[tag].pack(value)
+    if isinstance(value, int):
+        return mcnbt.TAG_INT, struct.pack('>i', value)
+    if isinstance(value, str):
+        encoded = value.encode('utf-8')
+        return mcnbt.TAG_STRING, struct.pack('>H', len(encoded)) + encoded
+    if isinstance(value, dict):
+        out = b''
+        for name, item in value.items():
+            tag, data = nbt_payload(item)
+            out += bytes([tag]) + nbt_payload(name)[1] + data
+        return mcnbt.TAG_COMPOUND, out + b'\0'
+    if isinstance(value, list):
+        items = [nbt_payload(item) for item in value]
+        tag = items[0][0] if items else mcnbt.TAG_END
+        return mcnbt.TAG_LIST, bytes([tag]) + struct.pack('>i', len(items)) + b''.join(data for _, data in items)
+    raise TypeError(value)
+
+
+def nbt_dumps(value, name=''):
+    tag, data = nbt_payload(value)
+    return bytes([tag]) + nbt_payload(name)[1] + data
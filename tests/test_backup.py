@@ -0,0 +1,145 @@
+import itertools
+import os
+import struct
+import zlib
+
+import pytest
+
+import mcbackup
+import mcregion
+from conftest import chunk_record, read_region, write_region
+
+
+def record(index, version=0):
+    """A chunk record: length, zlib compression and a little NBT compound"""
+    nbt = b'\x0a\x00\x00\x03\x00\x01x' + struct.pack('>i', index) + b'\x08\x00\x01v' + struct.pack('>H', 2) + b'v' + bytes([48 + version]) + b'\x00'
+    return chunk_record(zlib.compress(nbt * (1 + index % 3)))
+
+
+# A record claiming more data than its one sector holds
+CORRUPT = struct.pack('>IB', 3 * mcregion.SECTOR_SIZE, mcregion.COMPRESSION_ZLIB) + b'\xde\xad\xbe\xef' * 100
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # One second per snapshot, so their ids differ
+    ticks = itertools.count(1700000000)
+    monkeypatch.setattr(mcbackup.time, 'time', lambda: float(next(ticks)))
+
+
+@pytest.fixture
+def world(tmp_path):
+    source = tmp_path / 'instance'
+    (source / 'world' / 'region').mkdir(parents=True)
+    (source / 'logs').mkdir()
+    (source / 'server.properties').write_bytes(b'motd=test\n')
+    (source / 'logs' / 'latest.log').write_bytes(b'not backed up')
+    write_region(str(source / 'world' / 'region' / 'r.0.0.mca'),
+                 {index: (1000 + index, record(index)) for index in (0, 1, 33, 1023)})
+    write_region(str(source / 'world' / 'region' / 'r.-1.0.mca'),
+                 {0: (500, record(0)), 5: (505, CORRUPT, None, 1), 7: (507, record(7))})
+    return source
+
+
+def check_restore(backup, snapshot, dest, expected):
+    assert backup.restore(snapshot['id'], str(dest))
+    assert not os.path.exists(str(dest / 'logs'))
+    for rel, content in expected.items():
+        if isinstance(content, bytes):
+            assert (dest / rel).read_bytes() == content
+        else:
+            assert read_region(str(dest / rel)) == content
+
+
+def test_snapshot_restore_round_trip(tmp_path, world, clock):
+    backup = mcbackup.MCBackup(str(tmp_path / 'backup'))
+    region = os.path.join('world', 'region', 'r.0.0.mca')
+    damaged = os.path.join('world', 'region', 'r.-1.0.mca')
+    first_state = {'server.properties': b'motd=test\n', region: read_region(str(world / region)),
+                   damaged: read_region(str(world / damaged))}
+    assert first_state[damaged][5] == (505, CORRUPT + b'\0' * (mcregion.SECTOR_SIZE - len(CORRUPT)))
+
+    first = backup.snapshot(str(world))
+    assert first['stats']['raw_chunks'] == 1
+    assert first['stats']['changed_chunks'] == 6
+    assert first['regions'][damaged]['raw'] == [5]
+    assert 'raw' not in first['regions'][region]
+    check_restore(backup, first, tmp_path / 'first', first_state)
+
+    # Change one chunk, add one, drop one; the damaged region is carried over unread
+    chunks = {index: (1000 + index, record(index)) for index in (0, 33, 1023)}
+    chunks[33] = (2033, record(33, 1))
+    chunks[64] = (2064, record(64))
+    write_region(str(world / region), chunks)
+    (world / 'server.properties').write_bytes(b'motd=changed\n')
+    second_state = dict(first_state, **{'server.properties': b'motd=changed\n', region: read_region(str(world / region))})
+
+    second = backup.snapshot(str(world))
+    assert second['parent'] == first['id']
+    assert second['stats']['changed_chunks'] == 2
+    assert second['stats']['changed_regions'] == 1
+    assert second['regions'][damaged] == first['regions'][damaged]
+    check_restore(backup, second, tmp_path / 'second', second_state)
+    check_restore(backup, first, tmp_path / 'first-again', first_state)
+
+    # The restored world snapshots to the same chunks
+    copy = mcbackup.MCBackup(str(tmp_path / 'backup-copy'))
+    restored = copy.snapshot(str(tmp_path / 'second'))
+    assert restored['stats']['raw_chunks'] == 1
+    assert {rel: entry['table'] for rel, entry in restored['regions'].items()} == \
+        {rel: entry['table'] for rel, entry in second['regions'].items()}
+
+
+def test_repaired_chunk_is_read_again(tmp_path, world, clock):
+    backup = mcbackup.MCBackup(str(tmp_path / 'backup'))
+    damaged = os.path.join('world', 'region', 'r.-1.0.mca')
+    backup.snapshot(str(world))
+
+    # Same timestamp, now readable
+    write_region(str(world / damaged), {0: (500, record(0)), 5: (505, record(5)), 7: (507, record(7))})
+    snapshot = backup.snapshot(str(world))
+    assert snapshot['stats']['raw_chunks'] == 0
+    assert snapshot['stats']['changed_chunks'] == 1
+    assert 'raw' not in snapshot['regions'][damaged]
+    check_restore(backup, snapshot, tmp_path / 'restored', {damaged: read_region(str(world / damaged))})
+
+
+def test_chunk_past_the_end_of_the_file(tmp_path, world, clock):
+    damaged = str(world / 'world' / 'region' / 'r.-1.0.mca')
+    with open(damaged, 'r+b') as fp:
+        # Chunk 9 points to sectors 40-41, well past the end of the file
+        fp.seek(9 * 4)
+        fp.write(struct.pack('>I', (40 << 8) | 2))
+        fp.seek(mcregion.SECTOR_SIZE + 9 * 4)
+        fp.write(struct.pack('>I', 509))
+    backup = mcbackup.MCBackup(str(tmp_path / 'backup'))
+    snapshot = backup.snapshot(str(world))
+    assert snapshot['stats']['raw_chunks'] == 2
+    dest = tmp_path / 'restored'
+    assert backup.restore(snapshot['id'], str(dest))
+    with mcregion.RegionFile(str(dest / 'world' / 'region' / 'r.-1.0.mca')) as region:
+        assert region.timestamps[9] == 509
+        assert region.locations[9] & 0xff == 0
+        with pytest.raises(ValueError):
+            region.read_chunk(9)
+
+
+def test_restore_starts_from_an_empty_tree(tmp_path, world, clock, monkeypatch):
+    backup = mcbackup.MCBackup(str(tmp_path / 'backup'))
+    snapshot = backup.snapshot(str(world))
+    partial = tmp_path / 'restored.partial'
+
+    # A failed restore leaves nothing behind
+    def fail(digest):
+        raise OSError("read error")
+    with monkeypatch.context() as patch:
+        patch.setattr(backup, 'read_object', fail)
+        assert not backup.restore(snapshot['id'], str(tmp_path / 'restored'))
+    assert not partial.exists() and not (tmp_path / 'restored').exists()
+
+    # Nor do files of an interrupted one end up in the restored tree
+    (partial / 'world').mkdir(parents=True)
+    (partial / 'world' / 'stale.dat').write_bytes(b'not in the snapshot')
+    check_restore(backup, snapshot, tmp_path / 'restored', {'server.properties': b'motd=test\n'})
+    assert not (tmp_path / 'restored' / 'world' / 'stale.dat').exists()
+    assert not partial.exists()
@@ -0,0 +1,129 @@
+import hashlib
+import os
+
+import pytest
+
+import mcadmin
+
+
+@pytest.fixture
+def admin(tmp_path):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    yield admin
+    admin.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1700000000.0]
+    monkeypatch.setattr(mcadmin.time, 'time', lambda: now[0])
+    return now
+
+
+def cache_file(admin, cache, filename, size):
+    with open(admin.get_cache_path(filename), 'wb') as fp:
+        fp.write(b'x' * size)
+    return cache.add(filename, size)
+
+
+def cached(admin):
+    return sorted(name for name in os.listdir(admin.get_cache_dir()) if name != mcadmin.MCCache.INDEX_FILE and not name.startswith('.'))
+
+
+def test_least_recently_used_are_evicted(admin, clock):
+    cache = mcadmin.MCCache(admin, max_entries=3, pinned=['pinned.json'])
+    for filename in ('pinned.json', 'a.json', 'b.json'):
+        assert cache_file(admin, cache, filename, 10)
+        clock[0] += 1
+    # A use older than the access time resolution makes a.json recent again
+    clock[0] += mcadmin.MCADMIN_CACHE_ATIME_RESOLUTION
+    assert cache.lookup('a.json')
+    clock[0] += 1
+    assert cache_file(admin, cache, 'c.json', 10)
+    assert cached(admin) == ['a.json', 'c.json', 'pinned.json']
+
+    stats = mcadmin.MCCache(admin).get_stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions'], stats['hits']) == (3, 30, 1, 1)
+
+
+def test_byte_budget_keeps_the_newest_entry(admin, clock):
+    cache = mcadmin.MCCache(admin, max_bytes=100, pinned=[])
+    for filename in ('a.json', 'b.json'):
+        assert cache_file(admin, cache, filename, 40)
+        clock[0] += 1
+    # Over budget on its own: everything else goes, the new entry stays
+    assert cache_file(admin, cache, 'big.json', 150)
+    assert cached(admin) == ['big.json']
+
+
+def test_clear_keeps_pinned_entries(admin, clock):
+    cache = mcadmin.MCCache(admin, pinned=['pinned.json'])
+    for filename in ('pinned.json', 'a.json'):
+        assert cache_file(admin, cache, filename, 10)
+    assert cache.clear()
+    assert cached(admin) == ['pinned.json']
+    assert cache.clear(pinned=True)
+    assert cached(admin) == []
+
+
+def test_expired_entry_is_revalidated(admin, stub):
+    stub.handler = lambda request: (304, {}, b'') if request['headers'].get('If-None-Match') == '"v1"' \
+        else (200, {'ETag': '"v1"'}, b'content')
+    url = stub.url + '/file.json'
+    assert admin.get_url_and_cache(url, 'file.json', 60) == b'content'
+    assert admin.get_url_and_cache(url, 'file.json', 60) == b'content'
+    assert len(stub.requests) == 1
+
+    meta = admin.cache_load_meta('file.json')
+    meta['fetched'] -= 120
+    admin.cache_save_meta('file.json', meta)
+    assert admin.get_url_and_cache(url, 'file.json', 60) == b'content'
+    assert [request['headers'].get('If-None-Match') for request in stub.requests] == [None, '"v1"']
+    assert admin.cache_load_meta('file.json')['fetched'] > meta['fetched'] + 60
+
+    # A forced refresh still revalidates rather than refetching
+    assert admin.get_url_and_cache(url, 'file.json', True) == b'content'
+    assert len(stub.requests) == 3
+
+
+def test_forced_refresh_revalidates(admin, stub):
+    versions = {'current': b'v1'}
+
+    def handler(request):
+        if request['headers'].get('If-Modified-Since') == 'Mon, 01 Jan 2024 00:00:00 GMT' and versions['current'] == b'v1':
+            return 304, {}, b''
+        return 200, {'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}, versions['current']
+    stub.handler = handler
+    url = stub.url + '/file.json'
+    assert admin.get_url_and_cache(url, 'file.json', True) == b'v1'
+    assert admin.get_url_and_cache(url, 'file.json', True) == b'v1'
+    assert [request['headers'].get('If-Modified-Since') for request in stub.requests] == \
+        [None, 'Mon, 01 Jan 2024 00:00:00 GMT']
+
+    # Changed upstream: the conditional request returns the new content, which is cached
+    versions['current'] = b'v2'
+    assert admin.get_url_and_cache(url, 'file.json', True) == b'v2'
+    assert admin.cache_load('file.json') == b'v2'
+    assert admin.cache_load_meta('file.json')['sha1'] == hashlib.sha1(b'v2').hexdigest()
+
+    # Cached from another url: nothing to revalidate against
+    assert admin.get_url_and_cache(stub.url + '/moved.json', 'file.json', True) == b'v2'
+    assert stub.requests[-1]['headers'].get('If-Modified-Since') is None
+
+
+def test_metadata_counts_toward_the_entry(admin, stub, clock):
+    stub.handler = lambda request: (200, {'ETag': '"v1"'}, b'x' * 100)
+    cache = admin.get_cache()
+    for filename in ('a.json', 'b.json'):
+        assert admin.get_url_and_cache(stub.url + '/' + filename, filename) == b'x' * 100
+        clock[0] += 1
+    entry_size = 100 + os.path.getsize(admin.get_cache_meta_path('a.json'))
+    assert cache.get_stats()['bytes'] == 2 * entry_size
+
+    # Room for two entries only with their sidecars: the oldest goes, sidecar and all
+    cache._max_bytes = 2 * entry_size + 50
+    assert admin.get_url_and_cache(stub.url + '/c.json', 'c.json') == b'x' * 100
+    assert cached(admin) == ['b.json', 'b.json.meta.json', 'c.json', 'c.json.meta.json']
+    assert cache.get_stats()['bytes'] == 2 * entry_size
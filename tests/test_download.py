@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import re
+
+import mcadmin
+
+
+CONTENT = bytes(range(256)) * 64 * 17
+
+
+def serve(content, ranges=True):
+    """A handler serving content at any path, honouring Range requests if ranges"""
+    def handler(request):
+        headers = {'Accept-Ranges': 'bytes'} if ranges else {}
+        match = re.match(r'bytes=(\d+)-(\d*)$', request['headers'].get('Range', ''))
+        if not ranges or match is None:
+            headers['Content-Length'] = str(len(content))
+            return 200, headers, content if request['method'] == 'GET' else b''
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else len(content) - 1
+        if start >= len(content):
+            return 416, headers, b''
+        headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, len(content))
+        return 206, headers, content[start:end + 1]
+    return handler
+
+
+def sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def leftovers(path):
+    return [name for name in (path + '.part', path + '.part.json') if os.path.exists(name)]
+
+
+def test_download(stub, tmp_path):
+    stub.handler = serve(CONTENT)
+    path = str(tmp_path / 'file.jar')
+    assert mcadmin.download_file(stub.url + '/file.jar', path, sha1(CONTENT), len(CONTENT))
+    assert open(path, 'rb').read() == CONTENT
+    assert leftovers(path) == []
+
+
+def test_resume_from_partial(stub, tmp_path):
+    stub.handler = serve(CONTENT)
+    url = stub.url + '/file.jar'
+    path = str(tmp_path / 'file.jar')
+    have = 5000
+    with open(path + '.part', 'wb') as fp:
+        fp.write(CONTENT[:have])
+    with open(path + '.part.json', 'w') as fp:
+        json.dump({'url': url, 'sha1': sha1(CONTENT), 'size': len(CONTENT), 'ranges': [[0, None, have]]}, fp)
+
+    assert mcadmin.download_file(url, path, sha1(CONTENT), len(CONTENT))
+    assert open(path, 'rb').read() == CONTENT
+    assert [request['headers'].get('Range') for request in stub.requests] == ['bytes={}-'.format(have)]
+    assert leftovers(path) == []
+
+
+def test_stale_partial_state_is_discarded(stub, tmp_path):
+    stub.handler = serve(CONTENT)
+    url = stub.url + '/file.jar'
+    path = str(tmp_path / 'file.jar')
+    with open(path + '.part', 'wb') as fp:
+        fp.write(b'x' * 5000)
+    with open(path + '.part.json', 'w') as fp:
+        json.dump({'url': url, 'sha1': '0' * 40, 'size': len(CONTENT), 'ranges': [[0, None, 5000]]}, fp)
+
+    assert mcadmin.download_file(url, path, sha1(CONTENT), len(CONTENT))
+    assert open(path, 'rb').read() == CONTENT
+    assert 'Range' not in stub.requests[0]['headers']
+
+
+def test_restart_when_range_ignored(stub, tmp_path):
+    stub.handler = serve(CONTENT, ranges=False)
+    url = stub.url + '/file.jar'
+    path = str(tmp_path / 'file.jar')
+    with open(path + '.part', 'wb') as fp:
+        fp.write(CONTENT[:5000])
+    with open(path + '.part.json', 'w') as fp:
+        json.dump({'url': url, 'sha1': sha1(CONTENT), 'size': len(CONTENT), 'ranges': [[0, None, 5000]]}, fp)
+
+    assert mcadmin.download_file(url, path, sha1(CONTENT), len(CONTENT))
+    assert open(path, 'rb').read() == CONTENT
+    assert [request['headers'].get('Range') for request in stub.requests] == ['bytes=5000-', None]
+
+
+def test_parallel_ranges(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(mcadmin, 'MCADMIN_DOWNLOAD_CHECKPOINT_SIZE', 4096)
+    stub.handler = serve(CONTENT)
+    path = str(tmp_path / 'file.jar')
+    assert mcadmin.download_file(stub.url + '/file.jar', path, sha1(CONTENT), len(CONTENT), parts=4)
+    assert open(path, 'rb').read() == CONTENT
+
+    gets = sorted(request['headers']['Range'] for request in stub.requests if request['method'] == 'GET')
+    expected = sorted('bytes={}-{}'.format(start, end) for start, end, _ in mcadmin._split_ranges(len(CONTENT), 4))
+    assert gets == expected
+    assert leftovers(path) == []
+
+
+def test_parallel_ranges_fall_back_to_sequential(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(mcadmin, 'MCADMIN_DOWNLOAD_CHECKPOINT_SIZE', 4096)
+    handler = serve(CONTENT)
+
+    def no_ranges_on_get(request):
+        if request['method'] == 'GET':
+            request['headers'].pop('Range', None)
+        return handler(request)
+    stub.handler = no_ranges_on_get
+    path = str(tmp_path / 'file.jar')
+    assert mcadmin.download_file(stub.url + '/file.jar', path, sha1(CONTENT), len(CONTENT), parts=4)
+    assert open(path, 'rb').read() == CONTENT
+
+
+def test_hash_mismatch_removes_partial(stub, tmp_path):
+    stub.handler = serve(CONTENT)
+    path = str(tmp_path / 'file.jar')
+    assert not mcadmin.download_file(stub.url + '/file.jar', path, '0' * 40, len(CONTENT))
+    assert not os.path.exists(path)
+    assert leftovers(path) == []
+
+
+def test_size_mismatch_removes_partial(stub, tmp_path):
+    stub.handler = serve(CONTENT[:-10], ranges=False)
+    path = str(tmp_path / 'file.jar')
+    assert not mcadmin.download_file(stub.url + '/file.jar', path, None, len(CONTENT))
+    assert not os.path.exists(path)
+    assert leftovers(path) == []
+
+
+def test_http_error_is_not_retried(stub, tmp_path):
+    stub.handler = lambda request: (404, {}, b'')
+    path = str(tmp_path / 'file.jar')
+    assert not mcadmin.download_file(stub.url + '/file.jar', path)
+    assert len(stub.requests) == 1
+    assert leftovers(path) == []
@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+import mcfs
+
+
+def test_atomic_open_replaces_the_file(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text('old')
+    with mcfs.atomic_open(str(path), 'w') as fp:
+        fp.write('new')
+        assert path.read_text() == 'old'
+    assert path.read_text() == 'new'
+    assert os.listdir(str(tmp_path)) == ['data.json']
+
+
+def test_failed_write_leaves_the_file_untouched(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text('old')
+    with pytest.raises(ValueError):
+        with mcfs.atomic_open(str(path), 'w') as fp:
+            fp.write('partial')
+            raise ValueError("Write failed")
+    with mcfs.atomic_open(str(path), 'w') as fp:
+        fp.write('partial')
+        raise mcfs.Discard()
+    assert path.read_text() == 'old'
+    assert os.listdir(str(tmp_path)) == ['data.json']
@@ -0,0 +1,147 @@
+import argparse
+import io
+import json
+
+import pytest
+
+import mclog
+
+
+@pytest.fixture
+def output(monkeypatch):
+    monkeypatch.delenv(mclog.LOG_LEVEL_ENV_VAR, raising=False)
+    monkeypatch.delenv(mclog.LOG_FORMAT_ENV_VAR, raising=False)
+    stream = io.StringIO()
+    mclog.configure(stream=stream)
+    yield stream
+    mclog.configure()
+
+
+def lines(stream):
+    return stream.getvalue().splitlines()
+
+
+class Spy(object):
+    """An argument that records being formatted"""
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __format__(self, spec):
+        self.formatted += 1
+        return 'spy'
+
+
+def test_levels(output):
+    log = mclog.get_logger('test')
+    mclog.configure(level='warn', stream=output)
+    log.debug("debug {}", 1)
+    log.info("info {}", 2)
+    log.warn("warn {}", 3)
+    log.error("error {}", 4)
+    log.log(mclog.ERROR + 5, "custom")
+    assert lines(output) == ['WARN : warn 3', 'ERROR: error 4', 'LOG45: custom']
+
+    output.truncate(0)
+    output.seek(0)
+    mclog.configure(level='debug', stream=output)
+    log.debug("debug {}", 1, tries=2)
+    assert lines(output) == ['DEBUG: debug 1 (tries=2)']
+    assert mclog.get_logger('test') is log
+
+
+def test_level_from_environment(output, monkeypatch):
+    monkeypatch.setenv(mclog.LOG_LEVEL_ENV_VAR, 'ERROR')
+    mclog.configure(stream=output)
+    assert not mclog.is_enabled(mclog.WARN) and mclog.is_enabled(mclog.ERROR)
+    monkeypatch.setenv(mclog.LOG_LEVEL_ENV_VAR, 'loud')
+    mclog.configure(stream=output)
+    assert mclog.is_enabled(mclog.INFO) and not mclog.is_enabled(mclog.DEBUG)
+    assert lines(output) == ["WARN : Unknown log level [loud]; using info"]
+
+
+def test_disabled_messages_are_not_formatted(output, monkeypatch):
+    log = mclog.get_logger('test')
+    spy = Spy()
+    log.debug("lookup {}", spy)
+    assert spy.formatted == 0 and output.getvalue() == ''
+    log.info("lookup {}", spy)
+    assert spy.formatted == 1 and lines(output) == ['INFO : lookup spy']
+
+    # Nor timed: the clock is never read
+    def clock():
+        raise AssertionError("clock read")
+    monkeypatch.setattr(mclog.time, 'perf_counter', clock)
+    with log.timed('lookup') as timer:
+        timer.fields['hit'] = True
+
+    @log.timing('fetch')
+    def fetch(value):
+        return value * 2
+    assert fetch(21) == 42
+    assert lines(output) == ['INFO : lookup spy']
+
+
+def test_configure_from_args(output, monkeypatch):
+    parser = argparse.ArgumentParser()
+    mclog.add_arguments(parser)
+
+    mclog.configure_from_args(parser.parse_args(['-v']))
+    assert mclog.is_enabled(mclog.DEBUG)
+    mclog.configure_from_args(parser.parse_args(['-q']))
+    assert not mclog.is_enabled(mclog.INFO) and mclog.is_enabled(mclog.WARN)
+    mclog.configure_from_args(parser.parse_args(['--log-level', 'error']))
+    assert not mclog.is_enabled(mclog.WARN)
+
+    # No flags: the environment decides
+    monkeypatch.setenv(mclog.LOG_LEVEL_ENV_VAR, 'debug')
+    monkeypatch.setenv(mclog.LOG_FORMAT_ENV_VAR, 'json')
+    mclog.configure_from_args(parser.parse_args([]))
+    assert mclog.is_enabled(mclog.DEBUG) and mclog._json
+    monkeypatch.delenv(mclog.LOG_FORMAT_ENV_VAR)
+    mclog.configure_from_args(parser.parse_args(['--log-json']))
+    assert mclog._json
+
+
+def test_json_output(output):
+    mclog.configure(json_format=True, stream=output)
+    mclog.get_logger('mccache').info("Cached [{}]", 'a.jar', size=10, path=object)
+    record = json.loads(output.getvalue())
+    assert sorted(record) == ['level', 'logger', 'message', 'path', 'size', 'thread', 'time']
+    assert (record['level'], record['logger'], record['message'], record['size']) == ('info', 'mccache', 'Cached [a.jar]', 10)
+    assert record['thread'] == 'MainThread'
+    assert record['path'] == str(object)
+    assert record['time'].endswith('Z') and 'T' in record['time']
+
+
+def test_timing(output, monkeypatch):
+    mclog.configure(level='debug', json_format=True, stream=output)
+    log = mclog.get_logger('test')
+    ticks = iter([10.0, 10.25, 20.0, 20.5])
+    monkeypatch.setattr(mclog.time, 'perf_counter', lambda: next(ticks))
+
+    @log.timing('fetch')
+    def fetch(value):
+        return value * 2
+    assert fetch(21) == 42
+    assert fetch.__name__ == 'fetch'
+
+    with pytest.raises(ValueError):
+        with log.timed('parse', level=mclog.INFO, url='u') as timer:
+            timer.fields['bytes'] = 3
+            raise ValueError("bad")
+
+    first, second = [json.loads(line) for line in lines(output)]
+    assert (first['level'], first['message'], first['operation'], first['elapsed_ms']) == \
+        ('debug', 'fetch took 250.0ms', 'fetch', 250.0)
+    assert (second['level'], second['operation'], second['elapsed_ms']) == ('info', 'parse', 500.0)
+    assert (second['url'], second['bytes'], second['error']) == ('u', 3, 'bad')
+
+
+def test_timing_text_hides_timing_fields(output, monkeypatch):
+    mclog.configure(level='debug', stream=output)
+    ticks = iter([1.0, 1.002])
+    monkeypatch.setattr(mclog.time, 'perf_counter', lambda: next(ticks))
+    with mclog.get_logger('test').timed('lookup', hit=True):
+        pass
+    assert lines(output) == ['DEBUG: lookup took 2.0ms (hit=True)']
@@ -0,0 +1,65 @@
+import concurrent.futures
+import json
+import sqlite3
+
+import pytest
+
+import mcadmin
+
+
+def manifest(version):
+    return json.dumps({
+        'id': version,
+        'downloads': {'server': {'sha1': 'a' * 40, 'size': 100, 'url': 'http://example/server.jar'}},
+        'libraries': [{'name': 'com.example:lib:1.0', 'downloads': {'artifact': {'path': 'lib.jar', 'sha1': 'b' * 40, 'size': 10}}}],
+        'assetIndex': {'id': '1', 'sha1': 'c' * 40, 'size': 1, 'totalSize': 1000},
+    }).encode()
+
+
+@pytest.fixture
+def admin(tmp_path):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    yield admin
+    admin.close()
+
+
+def test_close_releases_every_thread_connection(admin):
+    store = admin.get_manifest_store()
+    store.save('1.0', 'release', 1, 'd' * 40, manifest('1.0'))
+
+    def save(version):
+        store.save(version, 'release', 2, 'd' * 40, manifest(version))
+        return store._local.db
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+        connections = set(pool.map(save, ['1.1', '1.2', '1.3']))
+    connections.add(store._local.db)
+    assert set(store._connections) == connections
+
+    store.close()
+    assert store._connections == []
+    for db in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            db.execute("SELECT 1")
+
+    # Reopened on next use
+    assert sorted(store.get_versions_with_library('com.example:lib')) == ['1.0', '1.1', '1.2', '1.3']
+
+
+def test_admin_close(admin):
+    store = admin.get_manifest_store()
+    store.save('1.0', 'release', 1, 'd' * 40, manifest('1.0'))
+    db = store._local.db
+    admin.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("SELECT 1")
+    assert store.contains('1.0')
+
+
+def test_context_manager(admin):
+    with mcadmin.MCManifestStore(admin) as store:
+        store.save('1.0', 'release', 1, 'd' * 40, manifest('1.0'))
+        db = store._local.db
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("SELECT 1")
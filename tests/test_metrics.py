@@ -0,0 +1,74 @@
+import json
+
+import mcmetrics
+
+
+def test_histogram_exposition():
+    metrics = mcmetrics.MCMetrics()
+    for value in (0.003, 0.005, 0.2, 0.2, 1000.0):
+        metrics.observe('mcadmin_cache_fetch_seconds', value, host='a')
+    lines = mcmetrics.render_prometheus(metrics.snapshot()).splitlines()
+
+    assert lines[:2] == ['# HELP mcadmin_cache_fetch_seconds ' + mcmetrics.METRICS['mcadmin_cache_fetch_seconds'][1],
+                         '# TYPE mcadmin_cache_fetch_seconds histogram']
+    buckets = [line for line in lines if line.startswith('mcadmin_cache_fetch_seconds_bucket')]
+    assert len(buckets) == len(mcmetrics.LATENCY_BUCKETS) + 1
+    # Cumulative: a bucket counts every value up to and including its bound
+    assert buckets[0] == 'mcadmin_cache_fetch_seconds_bucket{host="a",le="0.005"} 2'
+    assert buckets[4] == 'mcadmin_cache_fetch_seconds_bucket{host="a",le="0.1"} 2'
+    assert buckets[5] == 'mcadmin_cache_fetch_seconds_bucket{host="a",le="0.25"} 4'
+    assert buckets[-2] == 'mcadmin_cache_fetch_seconds_bucket{host="a",le="300.0"} 4'
+    assert buckets[-1] == 'mcadmin_cache_fetch_seconds_bucket{host="a",le="+Inf"} 5'
+    counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+    assert lines[-2:] == ['mcadmin_cache_fetch_seconds_sum{host="a"} 1000.408',
+                          'mcadmin_cache_fetch_seconds_count{host="a"} 5']
+
+
+def test_label_escaping():
+    metrics = mcmetrics.MCMetrics()
+    metrics.inc('mcadmin_downloads_total', result='a\\b "c"\nd')
+    metrics.set('mcadmin_download_throughput_bytes_per_second', 2.5)
+    text = mcmetrics.render_prometheus(metrics.snapshot())
+    assert 'mcadmin_downloads_total{result="a\\\\b \\"c\\"\\nd"} 1\n' in text
+    assert 'mcadmin_download_throughput_bytes_per_second 2.5\n' in text
+    assert '# TYPE mcadmin_downloads_total counter\n' in text
+    # One line per sample: the newline never ends up in the output raw
+    assert all(line.startswith(('#', 'mcadmin_')) for line in text.splitlines())
+
+
+def test_flush_adds_up(tmp_path):
+    path = str(tmp_path / mcmetrics.METRICS_FILE)
+    first = mcmetrics.MCMetrics()
+    first.inc('mcadmin_downloads_total', result='ok')
+    first.inc('mcadmin_downloads_total', result='failed')
+    first.set('mcadmin_download_throughput_bytes_per_second', 100)
+    first.observe('mcadmin_download_seconds', 0.3)
+    assert first.flush(path)
+    assert first.is_empty()
+
+    second = mcmetrics.MCMetrics()
+    second.inc('mcadmin_downloads_total', 2, result='ok')
+    second.set('mcadmin_download_throughput_bytes_per_second', 50)
+    second.observe('mcadmin_download_seconds', 20.0)
+    assert second.flush(path)
+    # Nothing recorded since: the file is left alone
+    assert second.flush(path)
+
+    samples = mcmetrics.export_json(mcmetrics.load(path))
+    assert samples['mcadmin_downloads_total']['samples'] == [{'labels': {'result': 'failed'}, 'value': 1},
+                                                             {'labels': {'result': 'ok'}, 'value': 3}]
+    # Gauges take the last value flushed
+    assert samples['mcadmin_download_throughput_bytes_per_second']['samples'] == [{'labels': {}, 'value': 50}]
+    histogram = samples['mcadmin_download_seconds']['samples'][0]
+    assert (histogram['count'], histogram['sum']) == (2, 20.3)
+    assert (histogram['buckets']['0.5'], histogram['buckets']['30.0'], histogram['buckets']['+Inf']) == (1, 1, 0)
+    with open(path) as fp:
+        assert sorted(json.load(fp)) == ['counters', 'gauges', 'histograms']
+
+
+def test_flush_without_directory(tmp_path):
+    metrics = mcmetrics.MCMetrics()
+    metrics.inc('mcadmin_downloads_total', result='ok')
+    assert metrics.flush(str(tmp_path / 'missing' / mcmetrics.METRICS_FILE))
+    assert not metrics.is_empty()
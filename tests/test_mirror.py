@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+import mcadmin
+
+
+def sha1(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+OBJECTS = [b'sound', b'lang', b'icon' * 100]
+LIBRARY = b'library jar' * 50
+NATIVES = b'natives jar'
+INDEX = json.dumps({'objects': {
+    'minecraft/sounds/a.ogg': {'hash': sha1(OBJECTS[0]), 'size': len(OBJECTS[0])},
+    'minecraft/lang/en_us.json': {'hash': sha1(OBJECTS[1]), 'size': len(OBJECTS[1])},
+    'icons/icon_16x16.png': {'hash': sha1(OBJECTS[2]), 'size': len(OBJECTS[2])},
+    # Same content under another name: stored and fetched once
+    'icons/icon_32x32.png': {'hash': sha1(OBJECTS[2]), 'size': len(OBJECTS[2])},
+}}).encode()
+
+
+@pytest.fixture
+def files(stub):
+    """{path: content} served by the stub; tests may change it"""
+    files = {'/indexes/5.json': INDEX, '/lib.jar': LIBRARY, '/natives.jar': NATIVES}
+    files.update(('/resources/{}/{}'.format(sha1(obj)[:2], sha1(obj)), obj) for obj in OBJECTS)
+    stub.handler = lambda request: (200, {}, files[request['path']]) if request['path'] in files else (404, {}, b'')
+    return files
+
+
+@pytest.fixture
+def admin(tmp_path, stub, monkeypatch):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    monkeypatch.setattr(mcadmin, 'MOJANG_RESOURCES_URL', stub.url + '/resources')
+    # The icon goes through the resumable download path
+    monkeypatch.setattr(mcadmin, 'MCADMIN_DOWNLOAD_CHECKPOINT_SIZE', 100)
+    yield admin
+    admin.close()
+
+
+def version(admin, stub):
+    artifact = {'path': 'com/example/lib/1.0/lib-1.0.jar', 'url': stub.url + '/lib.jar', 'sha1': sha1(LIBRARY), 'size': len(LIBRARY)}
+    natives = {'path': 'com/example/lib/1.0/lib-1.0-natives-linux.jar', 'url': stub.url + '/natives.jar',
+               'sha1': sha1(NATIVES), 'size': len(NATIVES)}
+    return mcadmin.MCVersion(admin, '1.0', {
+        'assetIndex': {'id': '5', 'url': stub.url + '/indexes/5.json', 'sha1': sha1(INDEX), 'size': len(INDEX)},
+        'libraries': [{'name': 'com.example:lib:1.0', 'downloads': {'artifact': artifact, 'classifiers': {'natives-linux': natives}}},
+                      {'name': 'com.example:nodownloads:1.0'}]})
+
+
+def object_path(admin, content):
+    return os.path.join(admin.get_assets_dir(), 'objects', sha1(content)[:2], sha1(content))
+
+
+def test_mirror(admin, stub, files):
+    assert version(admin, stub).mirror(workers=4)
+    assert sorted(request['path'] for request in stub.requests) == sorted(files)
+    for obj in OBJECTS:
+        assert open(object_path(admin, obj), 'rb').read() == obj
+    libraries = admin.get_libraries_dir()
+    assert open(os.path.join(libraries, 'com/example/lib/1.0/lib-1.0.jar'), 'rb').read() == LIBRARY
+    assert open(os.path.join(libraries, 'com/example/lib/1.0/lib-1.0-natives-linux.jar'), 'rb').read() == NATIVES
+    assert open(os.path.join(admin.get_assets_dir(), 'indexes', '5.json'), 'rb').read() == INDEX
+
+    # Everything is present: nothing is fetched again
+    count = len(stub.requests)
+    assert version(admin, stub).mirror()
+    assert len(stub.requests) == count
+
+
+def test_verify_fetches_corrupt_files_again(admin, stub, files):
+    assert version(admin, stub).mirror()
+    with open(object_path(admin, OBJECTS[1]), 'wb') as fp:
+        fp.write(b'LANG')
+    count = len(stub.requests)
+    # Same size: only a re-hash notices
+    assert version(admin, stub).mirror()
+    assert len(stub.requests) == count
+    assert version(admin, stub).mirror(verify=True)
+    assert [request['path'] for request in stub.requests[count:]] == ['/resources/{}/{}'.format(sha1(OBJECTS[1])[:2], sha1(OBJECTS[1]))]
+    assert open(object_path(admin, OBJECTS[1]), 'rb').read() == OBJECTS[1]
+
+
+def test_mismatched_files_are_not_kept(admin, stub, files):
+    files['/lib.jar'] = b'tampered'
+    del files['/natives.jar']
+    assert not version(admin, stub).mirror()
+    libraries = admin.get_libraries_dir()
+    assert not os.path.exists(os.path.join(libraries, 'com/example/lib/1.0/lib-1.0.jar'))
+    assert not os.path.exists(os.path.join(libraries, 'com/example/lib/1.0/lib-1.0-natives-linux.jar'))
+    for obj in OBJECTS:
+        assert os.path.isfile(object_path(admin, obj))
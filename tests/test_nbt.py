@@ -0,0 +1,122 @@
+import struct
+
+import pytest
+
+import mcnbt
+from conftest import nbt_dumps
+
+
+DOCUMENT = {
+    'Data': {
+        'Version': {'Name': '1.20.1', 'Id': 3465, 'Snapshot': ('b', 0)},
+        'Time': ('l', 123456789),
+        'SpawnAngle': ('f', 0.5),
+        'BorderSize': ('d', 6e7),
+        'LevelName': 'Wörld ☃',
+    },
+    'Heights': ('L', [1, -2, 2 ** 62]),
+    'Biomes': ('I', [4, 5, 6]),
+    'Light': ('B', [0, 1, 255]),
+    'Sections': [{'Y': ('b', -4), 'Palette': ['minecraft:stone', 'minecraft:air']}, {'Y': ('b', -3), 'Palette': []}],
+    'Pos': [('d', 1.5), ('d', 64.0), ('d', -3.25)],
+    'Empty': {},
+}
+
+EXPECTED = {
+    'Data': {
+        'Version': {'Name': '1.20.1', 'Id': 3465, 'Snapshot': 0},
+        'Time': 123456789,
+        'SpawnAngle': 0.5,
+        'BorderSize': 6e7,
+        'LevelName': 'Wörld ☃',
+    },
+    'Heights': [1, -2, 2 ** 62],
+    'Biomes': [4, 5, 6],
+    'Light': [0, 1, -1],
+    'Sections': [{'Y': -4, 'Palette': ['minecraft:stone', 'minecraft:air']}, {'Y': -3, 'Palette': []}],
+    'Pos': [1.5, 64.0, -3.25],
+    'Empty': {},
+}
+
+
+def walk(value):
+    """Decode a value through the lazy views only"""
+    if isinstance(value, mcnbt.Compound):
+        return {name: walk(value[name]) for name in value}
+    if isinstance(value, (mcnbt.List, mcnbt.NBTArray)):
+        return [walk(item) for item in value]
+    return value
+
+
+def test_lazy_and_eager_decoding():
+    name, root = mcnbt.parse(nbt_dumps(DOCUMENT, 'root'))
+    assert name == 'root'
+    assert root['Data']['Version']['Name'] == '1.20.1'
+    assert root.get_tag('Heights') == mcnbt.TAG_LONG_ARRAY
+    assert root['Sections'][1]['Y'] == -3
+    assert root['Pos'][-1] == -3.25
+    assert 'Missing' not in root
+    assert walk(root) == EXPECTED
+    assert mcnbt.unwrap(root) == EXPECTED
+    assert mcnbt.unwrap(mcnbt.parse(nbt_dumps(DOCUMENT))[1]['Sections']) == EXPECTED['Sections']
+    assert list(root['Heights'].to_array()) == EXPECTED['Heights']
+
+
+def test_negative_array_length():
+    # {'a': int array of -3 items, 'b': 7}: the length must not move the scan backwards
+    data = bytearray(nbt_dumps({'a': ('I', []), 'b': 7}))
+    count = data.index(b'\x00\x01a') + 3
+    data[count:count + 4] = struct.pack('>i', -3)
+    root = mcnbt.parse(bytes(data))[1]
+    with pytest.raises(mcnbt.NBTError):
+        root['b']
+    with pytest.raises(mcnbt.NBTError):
+        root['a']
+    with pytest.raises(mcnbt.NBTError):
+        mcnbt.unwrap(mcnbt.parse(bytes(data))[1])
+
+
+@pytest.mark.parametrize('item', [['x', 'y'], [('d', 1.0)], [{'k': 1}]])
+def test_negative_list_length(item):
+    data = bytearray(nbt_dumps({'a': item, 'b': 7}))
+    count = data.index(b'\x00\x01a') + 4
+    data[count:count + 4] = struct.pack('>i', -1)
+    root = mcnbt.parse(bytes(data))[1]
+    with pytest.raises(mcnbt.NBTError):
+        root['b']
+    with pytest.raises(mcnbt.NBTError):
+        root['a']
+    with pytest.raises(mcnbt.NBTError):
+        mcnbt.unwrap(mcnbt.parse(bytes(data))[1])
+
+
+def test_truncated_scalar():
+    data = nbt_dumps({'x': 1, 'y': ('l', 2)})
+    # Cut off in the middle of the long
+    root = mcnbt.parse(data[:-4])[1]
+    assert root['x'] == 1
+    with pytest.raises(mcnbt.NBTError):
+        root['y']
+    with pytest.raises(mcnbt.NBTError):
+        len(root)
+
+
+def test_every_truncation_raises_nbt_error():
+    data = nbt_dumps(DOCUMENT)
+    for end in range(len(data)):
+        with pytest.raises(mcnbt.NBTError):
+            walk(mcnbt.parse(data[:end])[1])
+        with pytest.raises(mcnbt.NBTError):
+            mcnbt.unwrap(mcnbt.parse(data[:end])[1])
+
+
+def test_corrupt_bytes_raise_nbt_error():
+    data = nbt_dumps(DOCUMENT)
+    for pos in range(len(data)):
+        for byte in (0x00, 0x7f, 0x80, 0xff):
+            corrupt = data[:pos] + bytes([byte]) + data[pos + 1:]
+            try:
+                walk(mcnbt.parse(corrupt)[1])
+                mcnbt.unwrap(mcnbt.parse(corrupt)[1])
+            except mcnbt.NBTError:
+                pass
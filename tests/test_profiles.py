@@ -0,0 +1,110 @@
+import json
+import time
+
+import pytest
+
+import mcadmin
+
+
+KNOWN = {'player{}'.format(n): '{:032x}'.format(n + 1) for n in range(20)}
+
+
+def profiles(request):
+    names = json.loads(request['body'])
+    found = [{'id': KNOWN[name.lower()], 'name': name.lower()} for name in names if name.lower() in KNOWN]
+    return 200, {'Content-Type': 'application/json'}, json.dumps(found).encode()
+
+
+@pytest.fixture
+def admin(tmp_path):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    yield admin
+    admin.close()
+
+
+def posted(stub):
+    return [json.loads(request['body']) for request in stub.requests]
+
+
+def test_batches_of_at_most_ten(admin, stub):
+    stub.handler = profiles
+    resolver = mcadmin.MCProfileResolver(admin, url=stub.url + '/profiles')
+    names = list(KNOWN) + ['Unknown{}'.format(n) for n in range(5)]
+    result = resolver.resolve(names)
+
+    batches = posted(stub)
+    assert len(batches) == 3
+    assert all(len(batch) <= mcadmin.MCADMIN_PROFILE_BATCH_SIZE == 10 for batch in batches)
+    assert sorted(name for batch in batches for name in batch) == sorted(name.lower() for name in names)
+    assert result['player3'] == mcadmin.format_uuid(KNOWN['player3'])
+    assert result['Unknown1'] is None
+
+    # Everything is cached, unknown names included
+    del stub.requests[:]
+    assert resolver.resolve(names) == result
+    assert mcadmin.MCProfileResolver(admin, url=stub.url + '/profiles').resolve(['PLAYER3', 'unknown1']) == \
+        {'PLAYER3': result['player3'], 'unknown1': None}
+    assert stub.requests == []
+
+
+def test_invalid_names_are_not_requested(admin, stub):
+    stub.handler = profiles
+    resolver = mcadmin.MCProfileResolver(admin, url=stub.url + '/profiles')
+    assert resolver.resolve(['bad name', 'player1']) == {'bad name': None, 'player1': mcadmin.format_uuid(KNOWN['player1'])}
+    assert posted(stub) == [['player1']]
+
+
+def age_cache(admin, seconds):
+    path = admin.get_cache_path(mcadmin.MCProfileResolver.CACHE_FILE)
+    with open(path) as fp:
+        entries = json.load(fp)
+    for entry in entries.values():
+        entry['fetched'] -= seconds
+    with open(path, 'w') as fp:
+        json.dump(entries, fp)
+
+
+def test_ttl_expiry(admin, stub):
+    stub.handler = profiles
+    url = stub.url + '/profiles'
+    mcadmin.MCProfileResolver(admin, url=url).resolve(['player1', 'nobody'])
+    del stub.requests[:]
+
+    # Unknown names expire after MCADMIN_PROFILE_NEGATIVE_TTL, known ones after MCADMIN_PROFILE_TTL
+    age_cache(admin, mcadmin.MCADMIN_PROFILE_NEGATIVE_TTL + 60)
+    mcadmin.MCProfileResolver(admin, url=url).resolve(['player1', 'nobody'])
+    assert posted(stub) == [['nobody']]
+
+    del stub.requests[:]
+    age_cache(admin, mcadmin.MCADMIN_PROFILE_TTL)
+    mcadmin.MCProfileResolver(admin, url=url).resolve(['player1', 'nobody'])
+    assert posted(stub) == [['player1', 'nobody']]
+
+
+def test_retry_after_429(admin, stub):
+    limited = []
+
+    def handler(request):
+        if not limited:
+            limited.append(time.monotonic())
+            return 429, {'Retry-After': '0.5'}, b''
+        limited.append(time.monotonic())
+        return profiles(request)
+    stub.handler = handler
+    resolver = mcadmin.MCProfileResolver(admin, url=stub.url + '/profiles')
+    assert resolver.resolve(['player2']) == {'player2': mcadmin.format_uuid(KNOWN['player2'])}
+    assert len(stub.requests) == 2
+    assert limited[1] - limited[0] >= 0.5
+
+
+def test_failures_are_not_cached(admin, stub):
+    stub.handler = lambda request: (503, {}, b'')
+    resolver = mcadmin.MCProfileResolver(admin, url=stub.url + '/profiles')
+    assert resolver.resolve(['player4']) == {'player4': None}
+
+    stub.handler = profiles
+    del stub.requests[:]
+    assert resolver.resolve(['player4']) == {'player4': mcadmin.format_uuid(KNOWN['player4'])}
+    assert posted(stub) == [['player4']]
@@ -0,0 +1,137 @@
+import io
+import json
+import os
+import random
+
+import pytest
+
+import mcpropmerge
+
+
+UUIDS = ['0f1e2d3c-0000-0000-0000-00000000000{}'.format(n) for n in range(6)]
+NAMES = ['Steve', 'steve', 'Ålex', 'Jöns', '名前', 'Zoë', 'x☃y']
+
+
+def entry(rng, prop_type):
+    if prop_type == 'banned-ips':
+        return {'ip': '10.0.0.{}'.format(rng.randrange(6)), 'created': '2024-01-01 00:00:00 +0000',
+                'source': rng.choice(NAMES), 'expires': rng.choice(['forever', '2031-05-04 12:00:00 +0000']),
+                'reason': 'Banned by an operator.'}
+    result = {}
+    if rng.random() < 0.9:
+        result['uuid'] = rng.choice(UUIDS)
+    result['name'] = rng.choice(NAMES)
+    if prop_type == 'ops':
+        result['level'] = rng.randrange(1, 5)
+        result['bypassesPlayerLimit'] = rng.random() < 0.5
+    elif prop_type == 'banned-players':
+        result['created'] = '2024-01-01 00:00:00 +0000'
+        result['source'] = 'Server'
+        result['expires'] = rng.choice(['forever', '2031-05-04 12:00:00 +0000'])
+        result['reason'] = rng.choice(['Griefing', 'Spam éè'])
+    return result
+
+
+def write(path, props):
+    with open(path, 'w', encoding='utf-8') as fp:
+        json.dump(props, fp, ensure_ascii=False, indent=2)
+
+
+def merge_both(tmp_path, prop_type, g_props, l_props):
+    g_path = str(tmp_path / '{}.json'.format(prop_type))
+    l_path = str(tmp_path / 'local.{}.json'.format(prop_type))
+    write(g_path, g_props)
+    write(l_path, l_props)
+    loaded = mcpropmerge.dump_props(mcpropmerge.prop_merge(g_path, l_path))
+    out = io.StringIO()
+    assert mcpropmerge.stream_merge(g_path, l_path, out) is not None
+    return loaded, out.getvalue()
+
+
+@pytest.mark.parametrize('prop_type', mcpropmerge.PROP_FILES)
+@pytest.mark.parametrize('seed', range(25))
+def test_stream_merge_matches_prop_merge(tmp_path, prop_type, seed):
+    rng = random.Random(seed)
+    g_props = [entry(rng, prop_type) for _ in range(rng.randrange(0, 8))]
+    l_props = [entry(rng, prop_type) for _ in range(rng.randrange(0, 8))]
+    loaded, streamed = merge_both(tmp_path, prop_type, g_props, l_props)
+    assert streamed == loaded
+
+
+def test_ops_precedence_and_duplicate_uuids(tmp_path):
+    g_props = [{'uuid': UUIDS[0], 'name': 'Steve', 'level': 2, 'bypassesPlayerLimit': False},
+               {'uuid': UUIDS[0], 'name': 'Steve', 'level': 1, 'bypassesPlayerLimit': False},
+               {'uuid': UUIDS[1], 'name': '名前', 'level': 4, 'bypassesPlayerLimit': True}]
+    l_props = [{'uuid': UUIDS[0], 'name': 'Steve', 'level': 3, 'bypassesPlayerLimit': True},
+               {'uuid': UUIDS[0], 'name': 'Steve', 'level': 4, 'bypassesPlayerLimit': True},
+               {'uuid': UUIDS[1], 'name': '名前', 'level': 1, 'bypassesPlayerLimit': False},
+               {'uuid': UUIDS[2], 'name': 'Zoë', 'level': 1, 'bypassesPlayerLimit': False},
+               {'uuid': UUIDS[2], 'name': 'Zoë', 'level': 2, 'bypassesPlayerLimit': False}]
+    loaded, streamed = merge_both(tmp_path, 'ops', g_props, l_props)
+    assert streamed == loaded
+    assert [(e['uuid'], e['level']) for e in json.loads(loaded)] == [(UUIDS[0], 4), (UUIDS[0], 1), (UUIDS[1], 4), (UUIDS[2], 2)]
+
+
+def test_stream_merge_with_resolve(tmp_path):
+    resolve = lambda names: {name: UUIDS[5] if name == 'Ålex' else None for name in names}
+    g_props = [{'uuid': UUIDS[5], 'name': 'Ålex'}, {'uuid': UUIDS[1], 'name': 'Jöns'}]
+    l_props = [{'name': 'Ålex'}, {'name': 'Zoë'}, {'uuid': UUIDS[2], 'name': 'Zoë'}]
+    g_path = str(tmp_path / 'whitelist.json')
+    l_path = str(tmp_path / 'local.whitelist.json')
+    write(g_path, g_props)
+    write(l_path, l_props)
+    out = io.StringIO()
+    mcpropmerge.stream_merge(g_path, l_path, out, resolve=resolve)
+    assert out.getvalue() == mcpropmerge.dump_props(mcpropmerge.prop_merge(g_path, l_path, resolve))
+
+
+def test_batch_merge_stream_matches(tmp_path):
+    rng = random.Random(7)
+    global_dir = tmp_path / 'conf'
+    global_dir.mkdir()
+    outputs = {}
+    for stream in (False, True):
+        instance_dir = tmp_path / 'instance-{}'.format(stream)
+        instance_dir.mkdir()
+        outputs[stream] = instance_dir
+    for prop_type in mcpropmerge.PROP_FILES:
+        g_props = [entry(rng, prop_type) for _ in range(6)]
+        l_props = [entry(rng, prop_type) for _ in range(6)]
+        write(str(global_dir / '{}.json'.format(prop_type)), g_props)
+        for instance_dir in outputs.values():
+            write(str(instance_dir / 'local.{}.json'.format(prop_type)), l_props)
+    for stream, instance_dir in outputs.items():
+        assert mcpropmerge.batch_merge(str(global_dir), str(instance_dir), stream=stream)
+    for prop_type in mcpropmerge.PROP_FILES:
+        name = '{}.json'.format(prop_type)
+        with open(os.path.join(str(outputs[False]), name), 'rb') as loaded, open(os.path.join(str(outputs[True]), name), 'rb') as streamed:
+            assert streamed.read() == loaded.read()
+
+
+def test_iter_props_across_chunk_boundaries():
+    props = [{'uuid': UUIDS[n % 6], 'name': NAMES[n % len(NAMES)], 'level': n} for n in range(40)] + [1, 'two', None, [3]]
+    text = json.dumps(props, ensure_ascii=False, indent=2)
+    for chunk_size in (1, 2, 7, 64):
+        assert list(mcpropmerge.iter_props(io.StringIO(text), chunk_size)) == props
+
+
+def test_failed_stream_merge_leaves_no_temp_file(tmp_path, monkeypatch):
+    write(str(tmp_path / 'global.json'), [])
+    write(str(tmp_path / 'local.json'), [])
+    instance = tmp_path / 'instance'
+    instance.mkdir()
+
+    def fail(*args, **kwargs):
+        raise ValueError("Malformed JSON")
+    monkeypatch.setattr(mcpropmerge, 'stream_merge', fail)
+    assert not mcpropmerge.stream_merge_to_file(str(tmp_path / 'global.json'), str(tmp_path / 'local.json'),
+                                                str(instance / 'ops.json'), 'ops')
+    assert os.listdir(str(instance)) == []
+
+
+def test_failed_write_leaves_no_temp_file(tmp_path, monkeypatch):
+    def fail(src, dst):
+        raise OSError("Read-only file system")
+    monkeypatch.setattr(mcpropmerge.os, 'replace', fail)
+    assert not mcpropmerge.write_props(str(tmp_path / 'ops.json'), [])
+    assert os.listdir(str(tmp_path)) == []
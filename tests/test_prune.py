@@ -0,0 +1,174 @@
+import gzip
+import os
+import random
+import struct
+import subprocess
+import sys
+import zlib
+
+import pytest
+
+import mcprune
+import mcregion
+from conftest import chunk_record, read_records, write_region
+
+
+def nbt_long(name, value):
+    return b'\x04' + struct.pack('>H', len(name)) + name.encode() + struct.pack('>q', value)
+
+
+def chunk(inhabited, updated, padding=0, seed=0):
+    """Zlib compressed NBT of a 1.18+ terrain chunk; padding adds incompressible bytes"""
+    nbt = b'\x0a\x00\x00' + b'\x03\x00\x0bDataVersion' + struct.pack('>i', 3465)
+    nbt += nbt_long('InhabitedTime', inhabited) + nbt_long('LastUpdate', updated)
+    nbt += b'\x07\x00\x04Junk' + struct.pack('>i', padding) + random.Random(seed).randbytes(padding) + b'\x00'
+    return zlib.compress(nbt)
+
+
+def snapshot(directory):
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as fp:
+                files[os.path.relpath(path, directory)] = (os.stat(path).st_mtime_ns, fp.read())
+    return files
+
+
+@pytest.fixture
+def world(tmp_path):
+    save = tmp_path / 'world'
+    save.mkdir()
+    level = b'\x0a\x00\x00\x0a\x00\x04Data' + nbt_long('Time', 1000) + b'\x00\x00'
+    (save / 'level.dat').write_bytes(gzip.compress(level))
+    (save / 'session.lock').write_bytes(b'\xe2\x98\x83')
+
+    # Never inhabited: 0, 2 (saved long ago) and the external 50; 1 and 40 were played in
+    region = str(save / 'region' / 'r.0.0.mca')
+    write_region(region, {
+        0: (1000, chunk_record(chunk(0, 900)), 2),
+        1: (1001, chunk_record(chunk(500, 900)), 5),
+        2: (1002, chunk_record(chunk(0, 10)), 6),
+        40: (1040, chunk_record(chunk(9000, 900, padding=6000, seed=40)), 9),
+        50: (1050, b'\x00\x00\x00\x01' + bytes([mcregion.COMPRESSION_ZLIB | mcregion.COMPRESSION_EXTERNAL]), 13),
+    })
+    (save / 'region' / 'c.18.1.mcc').write_bytes(chunk(0, 10, padding=1000, seed=50))
+    write_region(str(save / 'entities' / 'r.0.0.mca'), {
+        0: (1000, chunk_record(b'entities of 0'), 2),
+        1: (1001, chunk_record(b'entities of 1'), 3),
+        40: (1040, chunk_record(b'entities of 40'), 7),
+    })
+    # Only never inhabited chunks: removed altogether
+    write_region(str(save / 'region' / 'r.-1.0.mca'), {3: (1003, chunk_record(chunk(0, 10)))})
+    write_region(str(save / 'poi' / 'r.-1.0.mca'), {3: (1003, chunk_record(b'poi of 3'))})
+    return save
+
+
+def prune(world, **kwargs):
+    return mcprune.prune_world(str(world), workers=1, **kwargs)
+
+
+def test_compact_region_keeps_chunks_byte_for_byte(world):
+    path = str(world / 'region' / 'r.0.0.mca')
+    before = read_records(path)
+    result = mcprune.compact_region(path, frozenset([0, 2, 50]))
+    assert result['rewritten'] and not result['removed']
+    assert (result['chunks'], result['dropped']) == (5, 3)
+
+    after = read_records(path)
+    assert sorted(after) == [1, 40]
+    for index in after:
+        assert after[index] == before[index]
+    # Consecutive sectors right after the header, in index order
+    with mcregion.RegionFile(path) as region:
+        layout = [(offset, count) for _, offset, count, _ in region.chunks()]
+        assert layout == [(2, 1), (3, 2)]
+        assert region.size == result['bytes_after'] == mcregion.HEADER_SIZE + 3 * mcregion.SECTOR_SIZE
+    assert not os.path.exists(str(world / 'region' / 'c.18.1.mcc'))
+
+
+def test_compact_region_already_compact(world):
+    path = str(world / 'entities' / 'r.0.0.mca')
+    mcprune.compact_region(path, frozenset())
+    compact = snapshot(str(world / 'entities'))
+    result = mcprune.compact_region(path, frozenset())
+    assert not result['rewritten'] and result['bytes_after'] == result['bytes_before']
+    assert snapshot(str(world / 'entities')) == compact
+
+
+def test_prune_world(world):
+    region = str(world / 'region' / 'r.0.0.mca')
+    entities = str(world / 'entities' / 'r.0.0.mca')
+    terrain_before = read_records(region)
+    entities_before = read_records(entities)
+
+    report = prune(world, max_inhabited=100)
+    assert report['failed'] == []
+    assert (report['regions'], report['chunks'], report['pruned_chunks']) == (2, 6, 4)
+    assert read_records(region) == {index: terrain_before[index] for index in (1, 40)}
+    assert read_records(entities) == {index: entities_before[index] for index in (1, 40)}
+    assert not os.path.exists(str(world / 'region' / 'r.-1.0.mca'))
+    assert not os.path.exists(str(world / 'poi' / 'r.-1.0.mca'))
+    assert report['bytes_after'] == sum(os.path.getsize(path) for path in (region, entities))
+
+
+def test_min_age(world):
+    # Game time 1000: only chunks last saved at tick 500 or before go
+    report = prune(world, max_inhabited=100, min_age=500)
+    assert report['pruned_chunks'] == 3
+    assert sorted(read_records(str(world / 'region' / 'r.0.0.mca'))) == [0, 1, 40]
+
+
+def test_dry_run_matches(world):
+    before = snapshot(str(world))
+    dry = prune(world, max_inhabited=100, dry_run=True)
+    assert snapshot(str(world)) == before
+    assert dry['dry_run']
+    real = prune(world, max_inhabited=100)
+    for key in ('regions', 'chunks', 'pruned_chunks', 'bytes_before', 'bytes_after'):
+        assert dry[key] == real[key], key
+
+
+def test_unreadable_kept_chunk_fails_the_region(world):
+    path = str(world / 'region' / 'r.0.0.mca')
+    records = {index: (1000 + index, chunk_record(chunk(0, 10)), sector) for index, sector in ((0, 2), (1, 3))}
+    # Chunk 2 claims more data than its sector holds
+    records[2] = (1002, struct.pack('>IB', 2 * mcregion.SECTOR_SIZE, mcregion.COMPRESSION_ZLIB) + b'\0' * 100, 4)
+    write_region(path, records)
+    before = snapshot(str(world))
+
+    report = prune(world, max_inhabited=100)
+    assert [failed['path'] for failed in report['failed']] == [os.path.join('region', 'r.0.0.mca')]
+    after = snapshot(str(world))
+    # The other region is pruned as usual; the failed one's entities are untouched
+    assert sorted(set(before) - set(after)) == [os.path.join('poi', 'r.-1.0.mca'), os.path.join('region', 'r.-1.0.mca')]
+    assert os.path.join('entities', 'r.0.0.mca') in after
+    assert after == {name: before[name] for name in after}
+
+
+LOCKER = '''
+import fcntl, sys
+with open(sys.argv[1], 'a') as fp:
+    fcntl.lockf(fp, fcntl.LOCK_EX)
+    print('locked', flush=True)
+    sys.stdin.read()
+'''
+
+
+@pytest.mark.skipif(mcprune.fcntl is None, reason="needs fcntl")
+def test_running_world_is_skipped(world):
+    assert not mcprune.is_locked(str(world))
+    before = snapshot(str(world))
+    server = subprocess.Popen([sys.executable, '-c', LOCKER, str(world / 'session.lock')],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert server.stdout.readline().strip() == 'locked'
+        assert mcprune.is_locked(str(world))
+        assert prune(world, max_inhabited=100) is None
+        assert snapshot(str(world)) == before
+        # A dry run only reads
+        assert prune(world, max_inhabited=100, dry_run=True)['pruned_chunks'] == 4
+    finally:
+        server.communicate('')
+    assert not mcprune.is_locked(str(world))
+    assert prune(world, max_inhabited=100)['pruned_chunks'] == 4
@@ -0,0 +1,120 @@
+import gzip
+import os
+import zlib
+
+import pytest
+
+import mcadmin
+import mcregion
+from conftest import chunk_record, write_region
+
+
+NBT = b'\x0a\x00\x00\x01\x00\x01b\x05\x00'
+
+
+def errors(path):
+    report = mcregion.verify_region(path)
+    assert report['error'] is None
+    return {(chunk['x'], chunk['z']): chunk['error'] for chunk in report['errors']}
+
+
+@pytest.fixture
+def region_dir(tmp_path):
+    return tmp_path / 'world' / 'region'
+
+
+def test_clean_region(region_dir):
+    path = str(region_dir / 'r.-1.0.mca')
+    write_region(path, {
+        0: (1, chunk_record(zlib.compress(NBT))),
+        1: (1, chunk_record(gzip.compress(NBT), mcregion.COMPRESSION_GZIP)),
+        2: (1, chunk_record(NBT, mcregion.COMPRESSION_NONE)),
+        3: (1, chunk_record(mcregion.LZ4_MAGIC + b'\x10' * 16, mcregion.COMPRESSION_LZ4)),
+        32: (1, chunk_record(b'', mcregion.COMPRESSION_ZLIB | mcregion.COMPRESSION_EXTERNAL)),
+    })
+    (region_dir / 'c.-32.1.mcc').write_bytes(zlib.compress(NBT))
+    report = mcregion.verify_region(path)
+    assert report == {'path': path, 'chunks': 5, 'errors': [], 'error': None}
+
+
+def test_empty_region_is_clean(region_dir):
+    region_dir.mkdir(parents=True)
+    (region_dir / 'r.0.0.mca').write_bytes(b'')
+    assert mcregion.verify_region(str(region_dir / 'r.0.0.mca')) == \
+        {'path': str(region_dir / 'r.0.0.mca'), 'chunks': 0, 'errors': [], 'error': None}
+
+
+def test_truncated_header(region_dir):
+    region_dir.mkdir(parents=True)
+    (region_dir / 'r.0.0.mca').write_bytes(b'\0' * 100)
+    report = mcregion.verify_region(str(region_dir / 'r.0.0.mca'))
+    assert report['error'] == "truncated header (100 bytes)"
+
+
+def test_overlapping_sectors(region_dir):
+    path = str(region_dir / 'r.0.0.mca')
+    record = chunk_record(zlib.compress(NBT))
+    write_region(path, {0: (1, record, 2), 1: (1, record, 3), 33: (1, record, 2, 2)})
+    found = errors(path)
+    # Chunk 1,1 spans sectors 2-3, over both other chunks
+    assert found == {
+        (0, 0): "sector 2 overlaps chunk 1,1",
+        (1, 0): "sector 3 overlaps chunk 1,1",
+        (1, 1): "sector 2 overlaps chunk 0,0",
+    }
+
+
+def test_sectors_out_of_place(region_dir):
+    path = str(region_dir / 'r.0.0.mca')
+    record = chunk_record(zlib.compress(NBT))
+    # Chunk 2 runs two sectors past the end of the four sector file
+    write_region(path, {0: (1, record, 1), 1: (1, record, 3), 2: (1, record, 3, 3)})
+    found = errors(path)
+    assert found[(0, 0)] == "sector 1 is inside the header"
+    assert found[(2, 0)] == "sectors 3-5 out of bounds of 4"
+    assert (1, 0) not in found
+
+
+def test_corrupt_streams(region_dir):
+    path = str(region_dir / 'r.0.0.mca')
+    write_region(path, {
+        0: (1, chunk_record(b'\x78\x9c' + b'\xff' * 20)),
+        1: (1, chunk_record(b'\x1f\x8b\x08\x00' + b'\xff' * 20, mcregion.COMPRESSION_GZIP)),
+        2: (1, chunk_record(zlib.compress(NBT * 100)[:-20])),
+        3: (1, chunk_record(zlib.compress(b'\x08not a compound'))),
+        4: (1, chunk_record(NBT, 7)),
+    })
+    found = errors(path)
+    assert found[(0, 0)].startswith("corrupt zlib stream")
+    assert found[(1, 0)].startswith("corrupt gzip stream")
+    assert found[(2, 0)] == "truncated zlib stream"
+    assert found[(3, 0)] == "chunk is not an NBT compound"
+    assert found[(4, 0)] == "unknown compression type 7"
+
+
+def test_missing_external_chunk(region_dir):
+    path = str(region_dir / 'r.1.0.mca')
+    external = chunk_record(b'', mcregion.COMPRESSION_ZLIB | mcregion.COMPRESSION_EXTERNAL)
+    write_region(path, {0: (1, external), 1: (1, external)})
+    (region_dir / 'c.33.0.mcc').write_bytes(zlib.compress(NBT))
+    assert errors(path) == {(32, 0): "missing external chunk file [c.32.0.mcc]"}
+
+
+def test_verify_world(tmp_path):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path / 'work'))
+    admin.init_env()
+    world = mcadmin.MCWorld(admin, 'alpha')
+    save = os.path.join(world.get_world_dir(), 'world')
+    record = chunk_record(zlib.compress(NBT))
+    write_region(os.path.join(save, 'region', 'r.0.0.mca'), {0: (1, record), 1: (1, record)})
+    write_region(os.path.join(save, 'entities', 'r.0.0.mca'), {0: (1, record), 1: (1, chunk_record(NBT, 9))})
+    write_region(os.path.join(save, 'DIM-1', 'region', 'r.0.0.mca'), {5: (1, record)})
+
+    report = world.verify(workers=1)
+    assert (report['regions'], report['chunks'], report['corrupt_chunks']) == (3, 5, 1)
+    assert [(region['path'], region['errors']) for region in report['damaged']] == \
+        [(os.path.join('world', 'entities', 'r.0.0.mca'), [{'x': 1, 'z': 0, 'error': "unknown compression type 9"}])]
+    assert not mcregion.log_report(report)
+    assert mcadmin.MCWorld(admin, 'beta').verify(workers=1) is None
+    admin.close()
@@ -0,0 +1,295 @@
+import os
+import zlib
+
+import numpy
+import pytest
+from PIL import Image
+
+import mcadmin
+import mcnbt
+import mcregion
+import mcrender
+from conftest import chunk_record, nbt_dumps, write_region
+
+
+class Release(object):
+    def __init__(self, texture_dir):
+        self._texture_dir = texture_dir
+
+    def extract_textures(self):
+        return True
+
+    def get_texture_path(self):
+        return self._texture_dir
+
+
+class Progress(mcadmin.MCProgress):
+    created = []
+
+    def __init__(self, label, total, interval=None):
+        super().__init__(label, total, interval)
+        self.total = total
+        self.finished = False
+        Progress.created.append(self)
+
+    def finish(self):
+        super().finish()
+        self.finished = True
+
+
+@pytest.fixture
+def admin(tmp_path, monkeypatch):
+    monkeypatch.setattr(mcadmin, 'MCProgress', Progress)
+    del Progress.created[:]
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    yield admin
+    admin.close()
+
+
+def test_render_progress_counts_regions(admin, tmp_path):
+    world = mcadmin.MCWorld(admin, 'alpha')
+    region_dir = os.path.join(world.get_world_dir(), 'world', 'region')
+    os.makedirs(region_dir)
+    for name in ('r.0.0.mca', 'r.-1.0.mca'):
+        with open(os.path.join(region_dir, name), 'wb') as fp:
+            fp.write(b'\0' * mcregion.HEADER_SIZE)
+    # Not regions, so not rendered or counted
+    for name in ('c.0.0.mcc', 'r.0.0.mca.tmp', 'notes.txt'):
+        with open(os.path.join(region_dir, name), 'wb') as fp:
+            fp.write(b'x')
+    release = Release(str(tmp_path / 'textures'))
+    os.makedirs(release.get_texture_path())
+
+    summary = world.render(release, workers=1)
+    assert summary['regions'] == summary['rendered'] == 2
+    progress = Progress.created[-1]
+    assert (progress.total, progress.done, progress.skipped, progress.failed) == (2, 2, 0, 0)
+    assert progress.finished
+
+    # Nothing changed: every region is reported as skipped
+    summary = world.render(release, workers=1)
+    assert summary['rendered'] == 0
+    progress = Progress.created[-1]
+    assert (progress.total, progress.done, progress.skipped) == (2, 2, 2)
+    assert progress.finished
+
+
+def pack(values, bits, spanning):
+    """Signed longs of values packed the way chunk sections store them"""
+    if spanning:
+        stream = sum(value << (bits * i) for i, value in enumerate(values))
+        words = [(stream >> (64 * i)) & (2 ** 64 - 1) for i in range((len(values) * bits + 63) // 64)]
+    else:
+        per_word = 64 // bits
+        words = [sum(value << (bits * j) for j, value in enumerate(values[i:i + per_word]))
+                 for i in range(0, len(values), per_word)]
+    return [word - 2 ** 64 if word >= 2 ** 63 else word for word in words]
+
+
+def long_array(longs):
+    return mcnbt.parse(nbt_dumps({'data': ('L', longs)}))[1]['data']
+
+
+@pytest.mark.parametrize('spanning', [False, True])
+def test_unpack_indices(spanning):
+    values = [(i * 7) % 32 for i in range(100)]
+    longs = pack(values, 5, spanning)
+    # 12 values to a long, or all 500 bits back to back with values split across two longs
+    assert len(longs) == (8 if spanning else 9)
+    assert list(mcrender.unpack_indices(long_array(longs), 5, 100, spanning)) == values
+    assert list(mcrender.unpack_indices(long_array(longs), 5, 10, spanning)) == values[:10]
+
+
+def test_unpack_indices_layouts_differ():
+    values = [(i * 7) % 32 for i in range(100)]
+    spanning = mcrender.unpack_indices(long_array(pack(values, 5, True)), 5, 100, False)
+    assert list(spanning[:12]) == values[:12]
+    assert list(spanning[12:24]) != values[12:24]
+
+
+STONE = (100, 100, 100)
+GRASS = (200, 200, 200)
+# Left half of the colormaps is hot (plains), right half cold (taiga)
+HOT = (128, 255, 0)
+COLD = (0, 128, 255)
+
+
+def write_png(path, pixels):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.fromarray(numpy.array(pixels, dtype=numpy.uint8), 'RGB').save(path)
+
+
+@pytest.fixture
+def textures(tmp_path):
+    texture_dir = tmp_path / 'textures'
+    write_png(str(texture_dir / 'block' / 'stone.png'), [[STONE] * 16] * 16)
+    write_png(str(texture_dir / 'block' / 'grass_block_top.png'), [[GRASS] * 16] * 16)
+    for name in ('grass', 'foliage'):
+        write_png(str(texture_dir / 'colormap' / '{}.png'.format(name)), [[HOT] * 128 + [COLD] * 128] * 256)
+    return str(texture_dir)
+
+
+def terrain(status='minecraft:full'):
+    """
+    A 1.18+ chunk: stone up to y=2, then grass at y=3 in the north half and
+    water at y=3-4 in the south half; plains in the west, taiga in the east.
+    """
+    palette = ['minecraft:air', 'minecraft:stone', 'minecraft:grass_block', 'minecraft:water']
+    blocks = []
+    for y in range(16):
+        for z in range(16):
+            for x in range(16):
+                if y <= 2:
+                    blocks.append(1)
+                elif y == 3 and z < 8:
+                    blocks.append(2)
+                elif y in (3, 4) and z >= 8:
+                    blocks.append(3)
+                else:
+                    blocks.append(0)
+    biomes = [1 if x >= 2 else 0 for y in range(4) for z in range(4) for x in range(4)]
+    section = {
+        'Y': ('b', 0),
+        'block_states': {'palette': [{'Name': name} for name in palette], 'data': ('L', pack(blocks, 4, False))},
+        'biomes': {'palette': ['minecraft:plains', 'minecraft:taiga'], 'data': ('L', pack(biomes, 1, False))},
+    }
+    return {'DataVersion': 3465, 'Status': status, 'sections': [section]}
+
+
+def parse(chunk):
+    return mcnbt.parse(nbt_dumps(chunk))[1]
+
+
+def assert_color(pixel, expected):
+    assert all(abs(int(value) - round(want)) <= 1 for value, want in zip(pixel, expected)), (tuple(pixel), expected)
+
+
+def test_chunk_columns(textures):
+    colors = mcrender.BlockColors(textures)
+    surface, depth, floor_ids, heights, biomes = mcrender.chunk_columns(parse(terrain()), colors)
+    grass, water, stone = (colors.block_id(name) for name in ('grass_block', 'water', 'stone'))
+    assert (surface[:8] == grass).all() and (surface[8:] == water).all()
+    assert (heights[:8] == 3).all() and (heights[8:] == 4).all()
+    assert (depth[:8] == 0).all() and (depth[8:] == 2).all()
+    assert (floor_ids == numpy.where(surface == grass, grass, stone)).all()
+    plains, taiga = colors.biome_id('plains'), colors.biome_id('taiga')
+    assert (biomes[:, :8] == plains).all() and (biomes[:, 8:] == taiga).all()
+
+    assert mcrender.chunk_columns(parse(terrain('minecraft:features')), colors) is None
+    assert mcrender.chunk_columns(parse({'DataVersion': 3465, 'sections': []}), colors) is None
+
+
+def test_shade(textures):
+    colors = mcrender.BlockColors(textures)
+    columns = mcrender.chunk_columns(parse(terrain()), colors)
+    image = mcrender.shade(colors, *columns, numpy.ones((16, 16), dtype=bool))
+    assert image.shape == (16, 16, 4) and (image[:, :, 3] == 255).all()
+
+    # Grass tinted by the colormap of its biome
+    assert_color(image[4, 2], [g * h / 255 for g, h in zip(GRASS, HOT)])
+    assert_color(image[4, 12], [g * c / 255 for g, c in zip(GRASS, COLD)])
+    # Water two blocks deep over stone
+    assert_color(image[12, 4], [w * 0.6 + s * 0.4 for w, s in zip(mcrender.WATER_COLOR, STONE)])
+    # One block higher than the grass north of it: lighter
+    assert_color(image[8, 4], [(w * 0.6 + s * 0.4) * 1.06 for w, s in zip(mcrender.WATER_COLOR, STONE)])
+
+    image = mcrender.shade(colors, *columns, numpy.zeros((16, 16), dtype=bool))
+    assert (image[:, :, 3] == 0).all()
+
+
+def save_tile(out_dir, zoom, x, z, color):
+    image = numpy.zeros((mcrender.TILE_SIZE, mcrender.TILE_SIZE, 4), dtype=numpy.uint8)
+    image[:, :] = color
+    mcrender._save_tile(image, mcrender.get_tile_path(out_dir, zoom, x, z))
+
+
+def read_tile(out_dir, zoom, x, z):
+    with Image.open(mcrender.get_tile_path(out_dir, zoom, x, z)) as image:
+        return numpy.asarray(image.convert('RGBA'))
+
+
+def test_build_parent(tmp_path):
+    out_dir = str(tmp_path / 'map')
+    save_tile(out_dir, 0, 2, 4, (10, 20, 30, 255))
+    save_tile(out_dir, 0, 3, 5, (40, 50, 60, 255))
+    assert mcrender.build_parent(out_dir, -1, 1, 2)
+    parent = read_tile(out_dir, -1, 1, 2)
+    half = mcrender.TILE_SIZE // 2
+    assert (parent[:half, :half] == (10, 20, 30, 255)).all()
+    assert (parent[half:, half:] == (40, 50, 60, 255)).all()
+    assert (parent[:half, half:] == 0).all() and (parent[half:, :half] == 0).all()
+
+    # Children gone: so is the parent
+    os.remove(mcrender.get_tile_path(out_dir, 0, 2, 4))
+    os.remove(mcrender.get_tile_path(out_dir, 0, 3, 5))
+    assert not mcrender.build_parent(out_dir, -1, 1, 2)
+    assert not os.path.exists(mcrender.get_tile_path(out_dir, -1, 1, 2))
+
+
+@pytest.mark.parametrize('coords, levels', [
+    ([], 0),
+    ([(0, 0), (1, 1)], 0),
+    ([(-1, 0), (0, -1)], 0),
+    ([(0, 0), (2, 0)], 1),
+    ([(-2, 0), (1, 0)], 1),
+    ([(0, 0), (0, 5)], 2),
+    ([(-1000, 0), (1000, 0)], mcrender.MAX_ZOOM_OUT),
+])
+def test_zoom_levels(coords, levels):
+    assert mcrender._zoom_levels(coords) == levels
+
+
+def write_terrain(region_dir, name, timestamp, chunk=None):
+    record = chunk_record(zlib.compress(nbt_dumps(chunk or terrain())))
+    write_region(os.path.join(region_dir, name), {0: (timestamp, record), 33: (timestamp, record)})
+
+
+def test_render_world(textures, tmp_path):
+    region_dir = str(tmp_path / 'region')
+    out_dir = str(tmp_path / 'map')
+    write_terrain(region_dir, 'r.0.0.mca', 1)
+    write_terrain(region_dir, 'r.2.0.mca', 1)
+
+    summary = mcrender.render_world(region_dir, textures, out_dir, workers=1)
+    assert summary == {'regions': 2, 'rendered': 2, 'removed': 0, 'chunks': 4, 'failed': 0, 'levels': 1}
+    tile = read_tile(out_dir, 0, 2, 0)
+    assert (tile[:16, :16, 3] == 255).all() and (tile[16:32, 16:32, 3] == 255).all()
+    assert (tile[:16, 16:32, 3] == 0).all()
+    assert_color(tile[4, 2], [g * h / 255 for g, h in zip(GRASS, HOT)])
+    # Region 2,0 is the west half of parent tile 1,0
+    assert os.path.isfile(mcrender.get_tile_path(out_dir, -1, 0, 0))
+    parent = read_tile(out_dir, -1, 1, 0)
+    assert (parent[:8, :8, 3] == 255).all() and (parent[:, 256:, 3] == 0).all()
+
+    # Unchanged regions are skipped and their tiles left alone
+    tiles = {path: os.stat(path).st_mtime_ns for path in (mcrender.get_tile_path(out_dir, 0, 0, 0),
+                                                          mcrender.get_tile_path(out_dir, -1, 1, 0))}
+    seen = []
+    summary = mcrender.render_world(region_dir, textures, out_dir, workers=1,
+                                    progress=lambda name, skipped, failed: seen.append((name, skipped, failed)))
+    assert summary['rendered'] == 0
+    assert sorted(seen) == [('r.0.0.mca', True, False), ('r.2.0.mca', True, False)]
+    assert {path: os.stat(path).st_mtime_ns for path in tiles} == tiles
+
+    # Only the saved region is rendered again
+    write_terrain(region_dir, 'r.2.0.mca', 2)
+    summary = mcrender.render_world(region_dir, textures, out_dir, workers=1)
+    assert (summary['rendered'], summary['chunks']) == (1, 2)
+    assert os.stat(mcrender.get_tile_path(out_dir, 0, 0, 0)).st_mtime_ns == tiles[mcrender.get_tile_path(out_dir, 0, 0, 0)]
+
+
+def test_render_world_counts_only_rendered_regions(textures, tmp_path):
+    region_dir = str(tmp_path / 'region')
+    out_dir = str(tmp_path / 'map')
+    write_terrain(region_dir, 'r.0.0.mca', 1)
+    # Sections that are not compounds fail the whole region
+    write_terrain(region_dir, 'r.1.0.mca', 1, {'DataVersion': 3465, 'sections': [1, 2]})
+
+    summary = mcrender.render_world(region_dir, textures, out_dir, workers=1)
+    assert (summary['regions'], summary['rendered'], summary['failed']) == (2, 1, 1)
+    assert not os.path.exists(mcrender.get_tile_path(out_dir, 0, 1, 0))
+    # The failed region is tried again on the next run
+    summary = mcrender.render_world(region_dir, textures, out_dir, workers=1)
+    assert (summary['rendered'], summary['failed']) == (0, 1)
@@ -0,0 +1,123 @@
+import ipaddress
+import json
+import os
+
+import mcadmin
+import mcservice
+
+
+FUTURE = '2999-01-01 00:00:00 +0000'
+PAST = '2001-01-01 00:00:00 +0000'
+
+
+def ip_entry(ip, expires='forever'):
+    return {'ip': ip, 'created': '2024-01-01 00:00:00 +0000', 'source': 'Server', 'expires': expires, 'reason': ip}
+
+
+def lookup(index, address):
+    entry = index.lookup(ipaddress.ip_address(address))
+    return entry['reason'] if entry is not None else None
+
+
+def test_most_specific_match():
+    index = mcservice.IPIndex([ip_entry('10.0.0.0/8'), ip_entry('10.1.0.0/16'), ip_entry('10.1.2.3'),
+                               ip_entry('10.1.2.0/24'), ip_entry('2001:db8::/32'), ip_entry('2001:db8:1::/48')])
+    assert lookup(index, '10.1.2.3') == '10.1.2.3'
+    assert lookup(index, '10.1.2.4') == '10.1.2.0/24'
+    assert lookup(index, '10.1.9.9') == '10.1.0.0/16'
+    assert lookup(index, '10.200.0.1') == '10.0.0.0/8'
+    assert lookup(index, '11.0.0.1') is None
+    assert lookup(index, '2001:db8:1::5') == '2001:db8:1::/48'
+    assert lookup(index, '2001:db8:2::5') == '2001:db8::/32'
+    assert lookup(index, '2001:db9::1') is None
+
+
+def test_expired_entries_fall_through():
+    index = mcservice.IPIndex([ip_entry('10.0.0.0/8', FUTURE), ip_entry('10.1.0.0/16', PAST),
+                               ip_entry('10.1.2.3', PAST), ip_entry('10.9.9.9', PAST)])
+    assert lookup(index, '10.1.2.3') == '10.0.0.0/8'
+    assert lookup(index, '10.1.5.5') == '10.0.0.0/8'
+    assert mcservice.IPIndex([ip_entry('10.9.9.9', PAST)]).lookup(ipaddress.ip_address('10.9.9.9')) is None
+
+
+def test_ipv4_mapped_entries():
+    index = mcservice.IPIndex([ip_entry('::ffff:1.2.3.4'), ip_entry('::ffff:10.9.0.0/112'), ip_entry('5.6.7.8')])
+    assert lookup(index, '1.2.3.4') == '::ffff:1.2.3.4'
+    assert lookup(index, '::ffff:1.2.3.4') == '::ffff:1.2.3.4'
+    assert lookup(index, '10.9.200.1') == '::ffff:10.9.0.0/112'
+    assert lookup(index, '::ffff:5.6.7.8') == '5.6.7.8'
+
+
+def test_player_lookup():
+    index = mcservice.PlayerIndex([{'uuid': '0F1E2D3C00000000000000000000000A', 'name': 'Steve', 'expires': PAST},
+                                   {'uuid': '0f1e2d3c-0000-0000-0000-00000000000b', 'name': 'Alex'}])
+    assert index.lookup('0f1e2d3c-0000-0000-0000-00000000000a') is None
+    assert index.lookup(None, 'ALEX')['name'] == 'Alex'
+    assert index.lookup('0f1e2d3c-0000-0000-0000-00000000000b')['name'] == 'Alex'
+
+
+def test_parse_player():
+    assert mcservice.parse_player(' 0F1E2D3C00000000000000000000000A') == ('0f1e2d3c-0000-0000-0000-00000000000a', None)
+    # Not hex digits only, though int() would take them
+    for ident in ('0x' + '1' * 30, '1' + '_1' * 15 + '1', '+' + '1' * 31, 'Steve'):
+        assert mcservice.parse_player(ident) == (None, ident)
+
+
+def write(path, props):
+    with open(path, 'w') as fp:
+        json.dump(props, fp)
+
+
+def test_reload_on_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(mcservice, 'RELOAD_CHECK_INTERVAL', 0)
+    write(str(tmp_path / 'banned-players.json'), [{'uuid': '0f1e2d3c-0000-0000-0000-00000000000a', 'name': 'Steve'}])
+    index = mcservice.PropIndex(str(tmp_path))
+    assert index.check_player(name='steve')['banned']
+    assert not index.check_ip(ipaddress.ip_address('1.2.3.4'))['banned']
+
+    write(str(tmp_path / 'banned-players.json'), [{'uuid': '0f1e2d3c-0000-0000-0000-00000000000b', 'name': 'Alex'}])
+    write(str(tmp_path / 'banned-ips.json'), [ip_entry('1.2.3.0/24')])
+    assert not index.check_player(name='steve')['banned']
+    assert index.check_player(name='alex')['banned']
+    assert index.check_ip(ipaddress.ip_address('1.2.3.4'))['banned']
+
+    # An unreadable file keeps the previous index
+    with open(str(tmp_path / 'banned-players.json'), 'w') as fp:
+        fp.write('[{"name": ')
+    assert index.check_player(name='alex')['banned']
+
+    os.remove(str(tmp_path / 'banned-players.json'))
+    assert not index.check_player(name='alex')['banned']
+
+
+def test_reload_check_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(mcservice, 'RELOAD_CHECK_INTERVAL', 3600)
+    index = mcservice.PropIndex(str(tmp_path))
+    write(str(tmp_path / 'whitelist.json'), [{'name': 'Steve'}])
+    assert not index.check_player(name='steve')['whitelisted']
+    index.refresh(force=True)
+    assert index.check_player(name='steve')['whitelisted']
+
+
+def test_app(tmp_path):
+    os.makedirs(str(tmp_path / 'conf'))
+    os.makedirs(str(tmp_path / 'worlds' / 'alpha'))
+    write(str(tmp_path / 'conf' / 'banned-ips.json'), [ip_entry('::ffff:1.2.3.4')])
+    write(str(tmp_path / 'worlds' / 'alpha' / 'ops.json'), [{'uuid': '0f1e2d3c-0000-0000-0000-00000000000a', 'name': 'Steve', 'level': 4}])
+    client = mcservice.create_app(str(tmp_path)).test_client()
+
+    assert client.get('/ip/1.2.3.4').get_json()['banned']
+    assert client.get('/player/Steve?instance=alpha').get_json()['op'] == 4
+    assert client.get('/player/Steve').get_json()['op'] is None
+    assert client.get('/check?name=Steve&ip=1.2.3.4').get_json()['banned']
+    assert client.get('/player/Steve?instance=nope').status_code == 404
+    assert client.get('/player/Steve?instance=..').status_code == 404
+    assert client.get('/ip/not-an-ip').status_code == 400
+    assert client.get('/check?uuid=0x' + '1' * 30).status_code == 400
+
+
+def test_default_working_dir(monkeypatch):
+    monkeypatch.setenv(mcadmin.MCADMIN_WORKDIR_ENV_VAR, '/srv/mc')
+    assert mcadmin.get_default_working_dir() == '/srv/mc'
+    monkeypatch.delenv(mcadmin.MCADMIN_WORKDIR_ENV_VAR)
+    assert mcadmin.get_default_working_dir() == os.path.expanduser('~/mcadmin')
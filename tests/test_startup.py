@@ -0,0 +1,139 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import mcadmin
+
+
+MCADMIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mcadmin.py')
+
+# Cold start of an offline 'mcadmin versions', in seconds, and the share of it spent importing
+STARTUP_BUDGET = 1.0
+IMPORT_BUDGET = 0.25
+
+# Modules an offline 'versions' must not import
+HEAVY_MODULES = ['requests', 'urllib3', 'sqlite3', 'concurrent.futures', 'zipfile', 'flask', 'numpy', 'PIL']
+
+
+def manifest():
+    versions = [{'id': '1.{}'.format(n), 'type': 'release', 'url': 'http://127.0.0.1:9/1.{}.json'.format(n),
+                 'time': '2020-01-{:02}T00:00:00+00:00'.format(n + 1), 'releaseTime': '2020-01-{:02}T00:00:00+00:00'.format(n + 1),
+                 'sha1': '{:040x}'.format(n)} for n in range(10, 20)]
+    versions.append({'id': '20w01a', 'type': 'snapshot', 'url': 'http://127.0.0.1:9/20w01a.json',
+                     'time': '2020-02-01T00:00:00+00:00', 'releaseTime': '2020-02-01T00:00:00+00:00', 'sha1': '0' * 40})
+    versions.reverse()
+    return {'latest': {'release': '1.19', 'snapshot': '20w01a'}, 'versions': versions}
+
+
+@pytest.fixture
+def work_dir(tmp_path):
+    work_dir = str(tmp_path / 'work')
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(work_dir)
+    admin.init_env()
+    with open(admin.get_cache_path('version_manifest.json'), 'w') as fp:
+        json.dump(manifest(), fp)
+    return work_dir
+
+
+def parse_importtime(stderr):
+    """{module: cumulative microseconds} from the output of python -X importtime"""
+    imported = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                imported[name.rstrip()] = int(cumulative)
+    return imported
+
+
+def run(work_dir, *args, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [MCADMIN, '--work-dir', work_dir] + list(args)
+    started = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return time.perf_counter() - started, result
+
+
+def snapshot(directory):
+    files = {}
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            files[os.path.relpath(path, directory)] = (st.st_mtime_ns, st.st_size)
+    return files
+
+
+def test_versions_cold_start(work_dir):
+    # The first run indexes the cached manifest
+    run(work_dir, 'versions', '--latest')
+    elapsed, result = run(work_dir, 'versions', '--latest', importtime=True)
+    assert result.stdout.split() == ['release', '1.19', 'snapshot', '20w01a']
+
+    # Whatever the interpreter imports at startup (site, .pth files) is not mcadmin's doing
+    baseline = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'pass'], capture_output=True, text=True, timeout=60)
+    preloaded = {name.strip() for name in parse_importtime(baseline.stderr)}
+    imported = {name: micros for name, micros in parse_importtime(result.stderr).items() if name.strip() not in preloaded}
+    for module in HEAVY_MODULES:
+        assert module not in {name.strip() for name in imported}, "'mcadmin versions' imports {}".format(module)
+    # Top level imports only (nested ones are indented)
+    total = sum(micros for name, micros in imported.items() if name == name.lstrip()) / 1e6
+    assert total < IMPORT_BUDGET, "imports took {:.3f}s".format(total)
+    assert elapsed < STARTUP_BUDGET, "'mcadmin versions' took {:.3f}s".format(elapsed)
+
+
+def test_versions_is_read_only(work_dir):
+    run(work_dir, 'versions')
+    before = snapshot(work_dir)
+    run(work_dir, 'versions', '--latest')
+    run(work_dir, 'versions', '--type', 'snapshot')
+    assert snapshot(work_dir) == before
+
+
+def test_deferred_hits_are_kept(work_dir):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(work_dir)
+    cache = admin.get_cache()
+    assert cache.lookup('version_manifest.json')
+    cache.flush()
+    hits = cache.get_stats()['hits']
+
+    cache = mcadmin.MCCache(admin)
+    assert cache.lookup('version_manifest.json')
+    assert not cache.lookup('missing.json')
+    assert not cache._dirty
+    # Persisted along with the next real change
+    cache.add('other.json', 10)
+    stats = mcadmin.MCCache(admin).get_stats()
+    assert (stats['hits'], stats['misses']) == (hits + 1, 1)
+
+
+def test_close_saves_metrics(work_dir):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(work_dir)
+    mcadmin.metrics.snapshot(reset=True)
+    mcadmin.metrics.inc('mcadmin_downloads_total', result='ok')
+    assert not os.path.exists(admin.get_metrics_path())
+    admin.close()
+    exported = mcadmin.mcmetrics.export_json(mcadmin.mcmetrics.load(admin.get_metrics_path()))
+    assert exported['mcadmin_downloads_total']['samples'] == [{'labels': {'result': 'ok'}, 'value': 1}]
+    assert mcadmin.metrics.is_empty()
+
+
+def test_close_saves_cache_updates(work_dir, monkeypatch):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(work_dir)
+    admin.get_cache().flush(enforce=True)
+    # An access time older than the resolution is recorded, on close
+    later = time.time() + mcadmin.MCADMIN_CACHE_ATIME_RESOLUTION + 60
+    monkeypatch.setattr(mcadmin.time, 'time', lambda: later)
+    assert admin.get_cache().lookup('version_manifest.json')
+    assert admin.get_cache()._dirty
+    admin.close()
+    entry = mcadmin.MCCache(admin)._read_index()[0]['version_manifest.json']
+    assert entry['atime'] == later
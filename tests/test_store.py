@@ -0,0 +1,119 @@
+import hashlib
+import os
+
+import pytest
+
+import mcadmin
+
+
+JAR = bytes(range(256)) * 100
+
+
+@pytest.fixture
+def admin(tmp_path):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    yield admin
+    admin.close()
+
+
+def serve_jar(stub):
+    stub.handler = lambda request: (200, {}, JAR)
+
+
+def version(admin, stub, name):
+    download = {'url': stub.url + '/server.jar', 'sha1': hashlib.sha1(JAR).hexdigest(), 'size': len(JAR)}
+    return mcadmin.MCVersion(admin, name, {'downloads': {'server': download}})
+
+
+def jar_path(admin, name):
+    return os.path.join(admin.get_version_dir(name), 'server.jar')
+
+
+def test_shared_jar_is_fetched_once(admin, stub):
+    serve_jar(stub)
+    assert version(admin, stub, '1.0').get_server_jar()
+    assert version(admin, stub, '1.1').get_server_jar()
+    assert len(stub.requests) == 1
+    assert os.path.samefile(jar_path(admin, '1.0'), jar_path(admin, '1.1'))
+    assert admin.get_store().refcount(hashlib.sha1(JAR).hexdigest()) == 2
+
+
+def test_corrupt_cached_jar_is_fetched_again(admin, stub):
+    serve_jar(stub)
+    assert version(admin, stub, '1.0').get_server_jar()
+    with open(jar_path(admin, '1.0'), 'r+b') as fp:
+        fp.truncate(100)
+    assert version(admin, stub, '1.0').get_server_jar()
+    assert len(stub.requests) == 2
+    assert open(jar_path(admin, '1.0'), 'rb').read() == JAR
+
+
+def test_corrupt_object_is_not_linked_into_a_new_version(admin, stub):
+    serve_jar(stub)
+    assert version(admin, stub, '1.0').get_server_jar()
+    # Same size, different content: only a re-hash notices
+    with open(jar_path(admin, '1.0'), 'r+b') as fp:
+        fp.write(b'corrupt')
+    assert version(admin, stub, '1.1').get_server_jar()
+    assert len(stub.requests) == 2
+    assert open(jar_path(admin, '1.1'), 'rb').read() == JAR
+
+
+def test_copies_are_counted_as_references(admin, stub, monkeypatch):
+    def no_links(src, dst):
+        raise OSError("Hard links not supported")
+    monkeypatch.setattr(mcadmin.os, 'link', no_links)
+    serve_jar(stub)
+    sha1 = hashlib.sha1(JAR).hexdigest()
+    store = admin.get_store()
+    assert version(admin, stub, '1.0').get_server_jar()
+    assert version(admin, stub, '1.1').get_server_jar()
+    assert store.refcount(sha1) == 2
+
+    # Cached copies are neither copied nor fetched again
+    mtime = os.stat(jar_path(admin, '1.0')).st_mtime_ns
+    assert version(admin, stub, '1.0').get_server_jar()
+    assert os.stat(jar_path(admin, '1.0')).st_mtime_ns == mtime
+    assert len(stub.requests) == 1
+
+    assert store.release(jar_path(admin, '1.0'), sha1)
+    assert store.gc() == (0, 0)
+    assert store.contains(sha1) and store.refcount(sha1) == 1
+    assert store.release(jar_path(admin, '1.1'), sha1)
+    assert not store.contains(sha1)
+    assert not os.path.exists(store.get_object_path(sha1) + mcadmin.MCStore.REFS_SUFFIX)
+
+
+def files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, dirs, names in os.walk(directory) for name in names)
+
+
+@pytest.mark.parametrize('served', [JAR[:-1] + b'x', JAR[:-100]], ids=['sha1', 'size'])
+def test_mismatched_download_is_discarded(admin, stub, served):
+    stub.handler = lambda request: (200, {}, served)
+    assert not version(admin, stub, '1.0').get_server_jar()
+    assert not os.path.exists(jar_path(admin, '1.0'))
+    # Neither the object nor a partial download is left behind
+    assert files(admin.get_store_dir()) == []
+
+    serve_jar(stub)
+    assert version(admin, stub, '1.0').get_server_jar()
+    assert open(jar_path(admin, '1.0'), 'rb').read() == JAR
+    digest = hashlib.sha1(JAR).hexdigest()
+    assert files(admin.get_store_dir()) == [os.path.join(digest[:2], digest)]
+
+
+def test_download_file_keeps_only_verified_content(stub, tmp_path):
+    path = str(tmp_path / 'server.jar')
+    digest = hashlib.sha1(JAR).hexdigest()
+    stub.handler = lambda request: (200, {}, JAR[:-1] + b'x')
+    assert not mcadmin.download_file(stub.url + '/server.jar', path, digest, len(JAR))
+    assert os.listdir(str(tmp_path)) == []
+
+    serve_jar(stub)
+    assert mcadmin.download_file(stub.url + '/server.jar', path, digest, len(JAR))
+    assert os.listdir(str(tmp_path)) == ['server.jar']
+    assert mcadmin.verify_file(path, digest, len(JAR))
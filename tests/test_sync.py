@@ -0,0 +1,37 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import mcadmin
+
+
+@pytest.fixture
+def admin(tmp_path):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    yield admin
+    admin.close()
+
+
+def test_sync_without_worlds_dir(admin):
+    shutil.rmtree(admin.get_worlds_dir(None))
+    assert admin.get_instances() == []
+    assert admin.sync_properties(resolve=False) == {}
+
+
+def test_sync_all_instances(admin):
+    for name in ('beta', 'alpha'):
+        os.makedirs(admin.get_worlds_dir(name))
+    open(os.path.join(admin.get_worlds_dir(None), 'notes.txt'), 'w').close()
+    with open(os.path.join(admin.get_config_dir(), 'ops.json'), 'w') as fp:
+        json.dump([{'uuid': '0f1e2d3c-0000-0000-0000-000000000001', 'name': 'Steve', 'level': 4}], fp)
+
+    summary = admin.sync_properties(resolve=False)
+    assert sorted(summary) == ['alpha', 'beta']
+    assert summary['alpha']['ops'] == 'updated'
+    with open(os.path.join(admin.get_worlds_dir('alpha'), 'ops.json')) as fp:
+        assert [entry['name'] for entry in json.load(fp)] == ['Steve']
+    assert admin.sync_properties(resolve=False)['beta']['ops'] == 'unchanged'
@@ -0,0 +1,106 @@
+import hashlib
+import io
+import os
+import zipfile
+
+import pytest
+
+import mcadmin
+
+
+ROOT = 'assets/minecraft/textures/'
+
+
+def jar(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('META-INF/MANIFEST.MF', b'Manifest-Version: 1.0\n')
+        for name, (content, method) in members.items():
+            zf.writestr(zipfile.ZipInfo(ROOT + name), content, compress_type=method)
+    return buf.getvalue()
+
+
+FIRST = {
+    'block/stone.png': (b'stone' * 1000, zipfile.ZIP_DEFLATED),
+    'block/dirt.png': (b'dirt', zipfile.ZIP_STORED),
+    'colormap/grass.png': (b'grass' * 100, zipfile.ZIP_DEFLATED),
+    'item/apple.png': (b'not a block texture', zipfile.ZIP_DEFLATED),
+}
+SECOND = {
+    'block/stone.png': FIRST['block/stone.png'],
+    'block/dirt.png': (b'new dirt' * 100, zipfile.ZIP_DEFLATED),
+}
+
+
+JARS = {'first.jar': jar(FIRST), 'second.jar': jar(SECOND)}
+
+
+@pytest.fixture
+def admin(tmp_path, stub):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    stub.handler = lambda request: (200, {}, JARS[request['path'].lstrip('/')])
+    yield admin
+    admin.close()
+
+
+def version(admin, stub, name, jar_name, content=None):
+    content = content if content is not None else JARS[jar_name]
+    download = {'url': stub.url + '/' + jar_name, 'sha1': hashlib.sha1(content).hexdigest(), 'size': len(content)}
+    return mcadmin.MCVersion(admin, name, {'downloads': {'client': download}})
+
+
+def textures(release):
+    found = {}
+    for root, dirs, names in os.walk(release.get_texture_path()):
+        for name in names:
+            path = os.path.join(root, name)
+            if name != mcadmin.MCVersion.TEXTURE_MANIFEST:
+                found[os.path.relpath(path, release.get_texture_path()).replace(os.sep, '/')] = open(path, 'rb').read()
+    return found
+
+
+def test_extract_textures(admin, stub):
+    release = version(admin, stub, '1.0', 'first.jar')
+    assert release.extract_textures(workers=2)
+    assert textures(release) == {name: content for name, (content, _) in FIRST.items() if not name.startswith('item/')}
+
+    # Up to date: nothing is rewritten
+    stone = os.path.join(release.get_texture_path(), 'block', 'stone.png')
+    mtime = os.stat(stone).st_mtime_ns
+    assert version(admin, stub, '1.0', 'first.jar').extract_textures()
+    assert os.stat(stone).st_mtime_ns == mtime
+
+
+def test_new_jar_updates_incrementally(admin, stub):
+    assert version(admin, stub, '1.0', 'first.jar').extract_textures()
+    stone = os.path.join(version(admin, stub, '1.0', 'first.jar').get_texture_path(), 'block', 'stone.png')
+    mtime = os.stat(stone).st_mtime_ns
+
+    release = version(admin, stub, '1.0', 'second.jar')
+    assert release.extract_textures()
+    # Unchanged members stay, changed ones are extracted again and dropped ones removed
+    assert textures(release) == {name: content for name, (content, _) in SECOND.items()}
+    assert os.stat(stone).st_mtime_ns == mtime
+
+
+def test_identical_members_are_linked_across_versions(admin, stub):
+    first = version(admin, stub, '1.0', 'first.jar')
+    second = version(admin, stub, '1.1', 'second.jar')
+    assert first.extract_textures() and second.extract_textures()
+    assert textures(second) == {name: content for name, (content, _) in SECOND.items()}
+    assert os.path.samefile(os.path.join(first.get_texture_path(), 'block', 'stone.png'),
+                            os.path.join(second.get_texture_path(), 'block', 'stone.png'))
+    assert not os.path.samefile(os.path.join(first.get_texture_path(), 'block', 'dirt.png'),
+                                os.path.join(second.get_texture_path(), 'block', 'dirt.png'))
+
+
+def test_corrupt_member_fails_the_extraction(admin, stub):
+    content = bytearray(JARS['first.jar'])
+    # Flip a byte of the stored dirt.png data, so its CRC no longer matches
+    offset = content.index(b'block/dirt.png') + len(b'block/dirt.png')
+    assert content[offset:offset + 4] == b'dirt'
+    content[offset] ^= 0xff
+    stub.handler = lambda request: (200, {}, bytes(content))
+    assert not version(admin, stub, '1.0', 'first.jar', bytes(content)).extract_textures()
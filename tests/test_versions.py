@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+
+import pytest
+import requests
+
+import mcadmin
+
+
+RELEASES = ['1.8.9', '1.9', '1.9.4', '1.10', '1.10.2', '1.20', '1.20.6', '1.21', '1.21.1']
+SNAPSHOTS = ['20w01a', '20w02a', '20w02b', '21w10a', '24w01a']
+# Every version the tests list, which fixes each one's release time
+ORDER = RELEASES + ['1.21.2'] + SNAPSHOTS + ['24w02a']
+
+
+def version_json(vid, changed=False):
+    """Content of a per-version manifest"""
+    return json.dumps({'id': vid, 'changed': changed}).encode()
+
+
+def version(vid, vtype, base, changed):
+    # A month apart, in ORDER
+    month = ORDER.index(vid) if vid in ORDER else 0
+    when = '20{:02}-{:02}-01T00:00:00+00:00'.format(10 + month // 12, month % 12 + 1)
+    return {'id': vid, 'type': vtype, 'url': '{}/{}.json'.format(base, vid), 'time': when, 'releaseTime': when,
+            'sha1': hashlib.sha1(version_json(vid, vid in changed)).hexdigest()}
+
+
+def manifest(releases=RELEASES, snapshots=SNAPSHOTS, changed=(), base='http://127.0.0.1:9'):
+    versions = [version(vid, 'release', base, changed) for vid in releases]
+    versions += [version(vid, 'snapshot', base, changed) for vid in snapshots]
+    versions.append(version('b1.7.3', 'old_beta', base, changed))
+    # Newest first, as Mojang lists them
+    versions.sort(key=lambda entry: entry['releaseTime'], reverse=True)
+    return json.dumps({'latest': {'release': releases[-1], 'snapshot': snapshots[-1]}, 'versions': versions}).encode()
+
+
+@pytest.fixture
+def admin(tmp_path):
+    admin = mcadmin.MCAdmin()
+    admin.set_working_dir(str(tmp_path))
+    admin.init_env()
+    yield admin
+    admin.close()
+
+
+def test_index_queries(admin):
+    versions = mcadmin.MCVersions(admin, manifest())
+    assert versions.get_release_list() == RELEASES
+    assert versions.get_snapshot_list() == SNAPSHOTS
+    assert versions.get_latest_version() == '1.21.1'
+    assert versions.get_latest_version(mcadmin.MCVersions.SNAPSHOT) == '24w01a'
+
+    assert versions.get_releases_newer_than('1.10') == ['1.10.2', '1.20', '1.20.6', '1.21', '1.21.1']
+    assert versions.get_releases_newer_than('1.21.1') == []
+    assert versions.get_latest_patch('1.9') == '1.9.4'
+    assert versions.get_latest_patch('1.20.1') == '1.20.6'
+    assert versions.get_latest_patch('1.11') is None
+
+    by_id = {entry['id']: entry for entry in json.loads(manifest())['versions']}
+    assert versions.get_snapshots_between(by_id['20w02a']['releaseTime'], by_id['21w10a']['releaseTime']) == \
+        ['20w02a', '20w02b', '21w10a']
+    assert versions.get_snapshots_between('2000-01-01T00:00:00Z', '2001-01-01T00:00:00Z') == []
+
+    assert versions.version_url('1.10') == by_id['1.10']['url']
+    assert versions.resolve_version_type('20w02b') == mcadmin.MCVersions.SNAPSHOT
+    assert versions.resolve_version_type('b1.7.3') is None
+    assert versions.parse_version('1.10.2') == (1, 10, 2)
+    assert versions.parse_version('20w02b') == (20, 2, 'b')
+    assert versions.is_minor_update('1.20.6') and not versions.is_update_available('1.21.1')
+
+
+def test_index_is_built_once_per_manifest(admin):
+    raw = manifest()
+    mcadmin.MCVersions(admin, raw)
+    index = admin.get_cache_path('version-index-{}.bin'.format(hashlib.sha1(raw).hexdigest()))
+    assert os.path.isfile(index)
+    mtime = os.stat(index).st_mtime_ns
+
+    versions = mcadmin.MCVersions(admin, raw)
+    assert versions._manifest is None, "the cached index is mapped without parsing the manifest"
+    assert versions.get_release_list() == RELEASES
+    assert os.stat(index).st_mtime_ns == mtime
+
+
+def test_unreadable_index_is_rebuilt(admin):
+    raw = manifest()
+    mcadmin.MCVersions(admin, raw)
+    with open(admin.get_cache_path('version-index-{}.bin'.format(hashlib.sha1(raw).hexdigest())), 'wb') as fp:
+        fp.write(b'garbage')
+    assert mcadmin.MCVersions(admin, raw).get_snapshot_list() == SNAPSHOTS
+
+
+def test_delta(admin):
+    first = mcadmin.MCVersions(admin, manifest()).get_delta()
+    assert first.initial and sorted(first.added) == sorted(RELEASES + SNAPSHOTS)
+    assert not mcadmin.MCVersions(admin, manifest()).get_delta()
+
+    store = admin.get_manifest_store()
+    for vid in ('1.10', '20w01a', '1.21'):
+        store.save(vid, 'release', 0, None, version_json(vid))
+    releases = RELEASES + ['1.21.2']
+    snapshots = [vid for vid in SNAPSHOTS if vid != '20w01a'] + ['24w02a']
+    versions = mcadmin.MCVersions(admin, manifest(releases, snapshots, changed=['1.10']))
+    delta = versions.get_delta(commit=False)
+    assert (sorted(delta.added), delta.removed, delta.changed) == (['1.21.2', '24w02a'], ['20w01a'], ['1.10'])
+    assert store.contains('1.10') and store.contains('20w01a')
+
+    # Only committed deltas move the baseline, and drop the stale stored manifests
+    assert versions.get_delta().changed == ['1.10']
+    assert not store.contains('1.10') and not store.contains('20w01a') and store.contains('1.21')
+    assert not mcadmin.MCVersions(admin, manifest(releases, snapshots, changed=['1.10'])).get_delta()
+
+
+def test_poll_prefetches_new_versions(admin, stub, monkeypatch):
+    state = {'releases': RELEASES, 'changed': ()}
+
+    def handler(request):
+        if request['path'] == '/version_manifest.json':
+            return 200, {}, manifest(state['releases'], changed=state['changed'], base=stub.url)
+        vid = re.match(r'/(.+)\.json$', request['path']).group(1)
+        return 200, {}, version_json(vid, vid in state['changed'])
+    stub.handler = handler
+    monkeypatch.setattr(mcadmin, 'MOJANG_VERSION_MANIFEST_URL', stub.url + '/version_manifest.json')
+    monkeypatch.setattr(mcadmin, 'MCADMIN_VERSION_MANIFEST_EXPIRY', 0)
+
+    # The first poll only records the baseline
+    assert admin.poll_versions(prefetch=('manifest',)).initial
+    assert [request['path'] for request in stub.requests] == ['/version_manifest.json']
+
+    state.update(releases=RELEASES + ['1.21.2'], changed=('1.9',))
+    admin._versions = None
+    delta = admin.poll_versions(prefetch=('manifest',))
+    assert (delta.added, delta.changed) == (['1.21.2'], ['1.9'])
+    assert sorted(request['path'] for request in stub.requests[1:]) == ['/1.21.2.json', '/1.9.json', '/version_manifest.json']
+    assert admin.get_manifest_store().load('1.9')['changed']
+
+
+def jar(vid):
+    return vid.encode() * 1000
+
+
+def test_prefetch_shares_the_session(admin, stub, monkeypatch):
+    vids = ['1.20', '1.20.6', '1.21']
+    manifests = {vid: json.dumps({'id': vid, 'downloads': {'server': {
+        'url': '{}/{}/server.jar'.format(stub.url, vid), 'sha1': hashlib.sha1(jar(vid)).hexdigest(), 'size': len(jar(vid))}}}).encode()
+        for vid in vids}
+    listing = [{'id': vid, 'type': 'release', 'url': '{}/{}.json'.format(stub.url, vid), 'time': when, 'releaseTime': when,
+                'sha1': hashlib.sha1(manifests[vid]).hexdigest()}
+               for vid, when in zip(reversed(vids), ['2024-03-01T00:00:00+00:00', '2024-02-01T00:00:00+00:00', '2024-01-01T00:00:00+00:00'])]
+
+    def handler(request):
+        if request['path'] == '/version_manifest.json':
+            return 200, {}, json.dumps({'latest': {'release': vids[-1], 'snapshot': vids[-1]}, 'versions': listing}).encode()
+        match = re.match(r'/(.+)/server\.jar$', request['path'])
+        if match:
+            return 200, {}, jar(match.group(1))
+        return 200, {}, manifests[re.match(r'/(.+)\.json$', request['path']).group(1)]
+    stub.handler = handler
+    monkeypatch.setattr(mcadmin, 'MOJANG_VERSION_MANIFEST_URL', stub.url + '/version_manifest.json')
+
+    # Every request goes through the shared session, none through a bare requests call
+    sent = []
+    session = admin.get_session()
+    send = session.send
+    monkeypatch.setattr(session, 'send', lambda request, **kwargs: sent.append(request.url) or send(request, **kwargs))
+
+    def bare(*args, **kwargs):
+        raise AssertionError("request outside the shared session")
+    for name in ('get', 'head', 'request'):
+        monkeypatch.setattr(requests, name, bare)
+
+    # Listed twice, 1.21 is still fetched once
+    assert admin.prefetch(vids + ['1.21'], artifacts=('manifest', 'server'), workers=4)
+    paths = sorted(request['path'] for request in stub.requests)
+    assert paths == sorted(['/version_manifest.json'] + ['/{}.json'.format(vid) for vid in vids] +
+                           ['/{}/server.jar'.format(vid) for vid in vids])
+    assert len(sent) == len(stub.requests)
+    for vid in vids:
+        assert open(os.path.join(admin.get_version_dir(vid), 'server.jar'), 'rb').read() == jar(vid)
+    assert admin.get_session() is session
+
+    # Everything is cached: nothing is fetched again
+    assert admin.prefetch(vids, artifacts=('manifest', 'server'))
+    assert len(stub.requests) == len(paths)